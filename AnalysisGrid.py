@@ -0,0 +1,108 @@
+# # # One analysis grid per run that every input raster is aligned to # # #
+
+# the grid is fixed by a projection, an upper left origin, a cell size and a number of rows and columns.
+# Inputs are warped onto it through virtual warped datasets (or a cached GeoTIFF when the aligned copy is
+# a product in its own right), each one at most once, so every raster read on the grid has the same
+# window arithmetic and no half cell shifts creep in between terms
+
+import hashlib
+import math
+import os
+from osgeo import gdal
+import RasterBlocks
+
+
+def keepIfSame(temp, path):
+    """Moves a freshly written file into place unless the file already there has the same content, in which
+    case it is left untouched so checkpoints that stamp it by modification time still match"""
+    if os.path.exists(path):
+        with open(temp, "rb") as new, open(path, "rb") as old:
+            same = new.read() == old.read()
+        if same:
+            os.remove(temp)
+            return path
+        os.remove(path)
+    os.rename(temp, path)
+    return path
+
+
+class AnalysisGrid:
+    """Projection, origin, cell size and extent shared by every raster of an analysis"""
+
+    def __init__(self, projection, origin, cell_size, xsize, ysize, folder):
+        self.projection = projection
+        self.origin = origin
+        self.cell_size = cell_size
+        self.xsize = xsize
+        self.ysize = ysize
+        self.folder = folder
+        self.aligned = {}
+        self.template_path = None
+
+    @classmethod
+    def fromRaster(cls, raster, folder, cell_size=None):
+        """Grid snapped to a raster's origin covering its extent, optionally at another cell size"""
+        rasterDS = gdal.Open(raster)
+        gt = rasterDS.GetGeoTransform()
+        if cell_size is None:
+            cell_size = gt[1]
+        width = rasterDS.RasterXSize * gt[1]
+        height = rasterDS.RasterYSize * abs(gt[5])
+        return cls(rasterDS.GetProjection(), (gt[0], gt[3]), cell_size,
+                   int(math.ceil(round(width / cell_size, 6))), int(math.ceil(round(height / cell_size, 6))), folder)
+
+    @property
+    def geotransform(self):
+        return self.origin[0], self.cell_size, 0.0, self.origin[1], 0.0, -self.cell_size
+
+    @property
+    def bounds(self):
+        """(minx, miny, maxx, maxy) of the grid"""
+        return (self.origin[0], self.origin[1] - self.ysize * self.cell_size,
+                self.origin[0] + self.xsize * self.cell_size, self.origin[1])
+
+    def fingerprint(self):
+        """The grid's definition, for checkpoints of stages run on it"""
+        return repr((self.projection, tuple(self.origin), self.cell_size, self.xsize, self.ysize,
+                     os.path.abspath(self.folder)))
+
+    def template(self):
+        """Path of an empty virtual raster on the grid, for functions that take a template dataset. A template
+        of the same grid left by an earlier run is kept as it is"""
+        if self.template_path is None:
+            path = os.path.join(self.folder, "analysis_grid.vrt")
+            templateDS = gdal.GetDriverByName("VRT").Create(path + ".tmp", self.xsize, self.ysize, 1,
+                                                            gdal.GDT_Float32)
+            templateDS.SetGeoTransform(self.geotransform)
+            templateDS.SetProjection(self.projection)
+            templateDS = None
+            self.template_path = keepIfSame(path + ".tmp", path)
+        return self.template_path
+
+    def align(self, raster, resampling="bilinear", output=None):
+        """Path of a raster warped onto the grid. Without an output the warp is a virtual dataset that is only
+        evaluated as it is read, with one it is written once as a GeoTIFF. Repeated calls reuse the first, and a
+        virtual dataset an earlier run left unchanged is kept as it is"""
+        key = (os.path.abspath(raster), resampling)
+        if key in self.aligned:
+            return self.aligned[key]
+
+        sourceDS = gdal.Open(raster)
+        nodata = sourceDS.GetRasterBand(1).GetNoDataValue()
+        options = dict(outputBounds=self.bounds, xRes=self.cell_size, yRes=self.cell_size, dstSRS=self.projection,
+                       resampleAlg=resampling, srcNodata=nodata, dstNodata=nodata)
+        if output is None:
+            name = os.path.splitext(os.path.basename(raster))[0]
+            # named by source and resampling so stages aligning at the same time never share a file
+            digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:8]
+            output = os.path.join(self.folder, "aligned_" + name + "_" + digest + ".vrt")
+            gdal.Warp(output + ".tmp", sourceDS, format="VRT", **options)
+            keepIfSame(output + ".tmp", output)
+        else:
+            gdal.Warp(output, sourceDS, format="GTiff",
+                      creationOptions=["TILED=YES", "COMPRESS=LZW", "BIGTIFF=IF_SAFER"], **options)
+
+        if not RasterBlocks.sameGrid(gdal.Open(output), gdal.Open(self.template())):
+            raise Exception(raster + " could not be aligned to the analysis grid")
+        self.aligned[key] = output
+        return output
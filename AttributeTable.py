@@ -0,0 +1,144 @@
+# # # Per-segment results kept as numpy columns keyed by segment id # # #
+
+# columns are added and joined by key in memory, derived fields are computed on whole columns and every
+# new field is written onto the feature class in one arcpy.da.ExtendTable call instead of a text table,
+# CopyRows and JoinField per result
+
+import arcpy
+import hashlib
+import numpy as np
+import SegmentZS
+
+
+class AttributeTable:
+    """Result columns for a set of unique segment ids, each column aligned with ids"""
+
+    def __init__(self, ids):
+        self.ids = np.asarray(ids)
+        if len(np.unique(self.ids)) != len(self.ids):
+            raise Exception("Attribute table ids must be unique")
+        self.columns = {}
+
+    @classmethod
+    def fromFeatures(cls, features, fields, id_field="OID@"):
+        """Reads attribute columns of a feature class, keyed by its object id or the given id field"""
+        id_field = idFieldName(features, id_field)
+        array = arcpy.da.TableToNumPyArray(features, [id_field] + list(fields))
+        table = cls(SegmentZS.segmentKeys(array[id_field]))
+        for field in fields:
+            table.add(field, array[field])
+        return table
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def add(self, name, values, ids=None, default=np.nan):
+        """Adds a column aligned with the table ids, or with ids of its own that are joined by key.
+        Table ids missing from them get the default"""
+        values = np.asarray(values)
+        if ids is None:
+            if len(values) != len(self.ids):
+                raise Exception("Column " + name + " does not match the table ids")
+            self.columns[name] = values
+            return values
+
+        position, found = self.lookup(ids)
+        column = np.full(len(self.ids), default, np.result_type(values.dtype, np.asarray(default).dtype))
+        column[position[found]] = values[found]
+        self.columns[name] = column
+        return column
+
+    def lookup(self, ids):
+        """Position of each of the given ids in the table and whether it is there at all"""
+        ids = np.asarray(ids)
+        if len(self.ids) == 0:
+            return np.zeros(len(ids), np.int64), np.zeros(len(ids), bool)
+        order = np.argsort(self.ids, kind="mergesort")
+        sorted_ids = self.ids[order]
+        position = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return order[position], sorted_ids[position] == ids
+
+    def join(self, other, names=None):
+        """Copies columns of another table onto this one by id"""
+        for name in (names or list(other.columns)):
+            self.add(name, other.columns[name], other.ids)
+
+    def rekey(self, ids, new_ids):
+        """Copy of the table keyed by new ids, new_ids[i] taking the row of ids[i]. Rows whose id is not
+        among ids are left out"""
+        position, found = self.lookup(ids)
+        table = AttributeTable(np.asarray(new_ids)[found])
+        for name, values in self.columns.items():
+            table.add(name, values[position[found]])
+        return table
+
+    def records(self, names=None, id_name="ID"):
+        """Structured array of the ids and columns, float columns as doubles and integers as 32 or 64 bit"""
+        names = list(names or self.columns)
+        dtypes = [(id_name, fieldType(self.ids))] + [(name, fieldType(self.columns[name])) for name in names]
+        array = np.empty(len(self.ids), dtypes)
+        array[id_name] = self.ids
+        for name in names:
+            array[name] = self.columns[name]
+        return array
+
+    def save(self, path):
+        """Writes the ids and columns to a .npz file"""
+        arrays = dict(("column_" + name, values) for name, values in self.columns.items())
+        np.savez(path, ids=self.ids, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a table written by save"""
+        data = np.load(path, allow_pickle=False)
+        table = cls(data["ids"])
+        for name in data.files:
+            if name.startswith("column_"):
+                table.add(name[len("column_"):], data[name])
+        return table
+
+    def fingerprint(self):
+        """Hash of the ids and columns"""
+        sha = hashlib.sha1(np.ascontiguousarray(self.ids).tobytes())
+        for name in sorted(self.columns):
+            sha.update(name.encode("utf-8"))
+            sha.update(np.ascontiguousarray(self.columns[name]).tobytes())
+        return sha.hexdigest()
+
+    def write(self, features, names=None, id_field="OID@"):
+        """Writes columns onto a feature class in one bulk join on the id field, object id by default.
+        Fields already on the features are overwritten and rows not in the table are left null"""
+        id_field = idFieldName(features, id_field)
+        names = list(names or self.columns)
+        key = "_JOIN_ID"
+        array = self.records(names, key)
+        # ids stored in a double field, as NHDPlus ids often are, are matched as doubles
+        if arcpy.ListFields(features, id_field)[0].type == "Double":
+            array = array.astype([(key, np.float64)] + [(name, array.dtype[name]) for name in names])
+        arcpy.da.ExtendTable(features, id_field, array, key, False)
+        return features
+
+
+def featureIds(features, id_field="OID@"):
+    """Ids of the features in cursor order, the order CopyFeatures writes them in"""
+    return SegmentZS.segmentKeys([row[0] for row in arcpy.da.SearchCursor(features, [id_field])])
+
+
+def idFieldName(features, id_field="OID@"):
+    """Name of the id field, the object id field of the features for OID@"""
+    if id_field in (None, "OID@"):
+        return arcpy.Describe(features).OIDFieldName
+    return id_field
+
+
+def fieldType(values):
+    """numpy type a column is written with, what ExtendTable turns into DOUBLE, LONG or BIGINTEGER"""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.integer):
+        if len(values) and (values.min() < -2 ** 31 or values.max() >= 2 ** 31):
+            return np.int64
+        return np.int32
+    return np.float64
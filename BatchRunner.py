@@ -0,0 +1,342 @@
+# # #=========================# # #
+# # # WRAT Multi-HUC Batch Run # # #
+# # #=========================# # #
+
+# Runs the WRAT tools headless over many HUCs. A json manifest lists one job per HUC, each a sequence of
+# tool steps with their parameters. Jobs are kept in a SQLite table so a batch can be watched, failed jobs
+# are retried and a run that dies with its node picks up where it left off when started again with the same
+# database. Every job runs in a fresh worker process so arcpy state never leaks from one HUC into the next
+#
+# manifest:
+# [{"huc": "1701020101",
+#   "steps": [{"tool": "individual", "params": {"projectFolder": "...", "network": "...", ...}},
+#             {"tool": "episodic", "params": {"network": "@previous", ...}}]}]
+#
+# a parameter given as "@previous" is replaced by what the step before returned, the Individual tool returns
+# its output network. Usage: python BatchRunner.py manifest.json jobs.sqlite summary.json [workers] [attempts]
+#
+# several runners on different nodes can share one database. A running job is only taken back when its
+# worker process on this host is gone or its heartbeat is older than the lease
+
+import ctypes
+import errno
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+
+# tool name in the manifest: (module, function)
+TOOLS = {"individual": ("Individual_Recruitment", "main"),
+         "episodic": ("Episodic_Recruitment", "main"),
+         "episodic2": ("Episodic_Recruitment2", "main"),
+         "episodic_batch": ("Episodic_Recruitment", "batchMain"),
+         "project": ("WRATProject", "main")}
+
+PREVIOUS = "@previous"
+
+# seconds between heartbeats of a running job, and how old a heartbeat may get before the job counts as dead
+HEARTBEAT = 60
+LEASE = 900
+
+# tools whose stages call arcpy and must not run on threads, they get one worker unless the manifest says
+# otherwise
+SERIAL_TOOLS = ["episodic"]
+
+
+def connect(database):
+    """Connection to the job database, waiting on other processes that are writing to it"""
+    connection = sqlite3.connect(database, timeout=120)
+    connection.execute("PRAGMA journal_mode=WAL")
+    return connection
+
+
+def createTable(database):
+    connection = connect(database)
+    with connection:
+        connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                              huc TEXT PRIMARY KEY,
+                              steps TEXT NOT NULL,
+                              status TEXT NOT NULL DEFAULT 'pending',
+                              attempts INTEGER NOT NULL DEFAULT 0,
+                              next_step INTEGER NOT NULL DEFAULT 0,
+                              results TEXT NOT NULL DEFAULT '[]',
+                              timings TEXT NOT NULL DEFAULT '[]',
+                              host TEXT,
+                              pid INTEGER,
+                              started REAL,
+                              finished REAL,
+                              error TEXT)""")
+        # databases made before heartbeats were recorded
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(jobs)")]
+        if "heartbeat" not in columns:
+            connection.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+    connection.close()
+
+
+def readManifest(manifest):
+    """Reads the jobs of a manifest and checks that every step names a known tool"""
+    with open(manifest) as f:
+        jobs = json.load(f)
+    hucs = set()
+    for job in jobs:
+        huc = str(job["huc"])
+        if huc in hucs:
+            raise Exception("HUC " + huc + " is in the manifest twice")
+        hucs.add(huc)
+        for step in job["steps"]:
+            if step["tool"] not in TOOLS:
+                raise Exception("Unknown tool " + step["tool"] + " for HUC " + huc)
+    return jobs
+
+
+def loadJobs(database, jobs):
+    """Adds manifest jobs that are not in the table yet, jobs already there keep their status"""
+    connection = connect(database)
+    with connection:
+        for job in jobs:
+            connection.execute("INSERT OR IGNORE INTO jobs (huc, steps) VALUES (?, ?)",
+                               (str(job["huc"]), json.dumps(job["steps"])))
+    connection.close()
+
+
+def processAlive(pid):
+    """Whether a process of this host is still running"""
+    if os.name == "nt":
+        # os.kill would terminate the process on Windows
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+    return True
+
+
+def resetInterrupted(database, lease=LEASE):
+    """Jobs left running by a run that died go back to pending, they resume at the step they were on. A job
+    is taken back when it ran on this host and its process is gone, or when its heartbeat is older than the
+    lease. Jobs another runner is still working on are left alone"""
+    host = socket.gethostname()
+    now = time.time()
+    connection = connect(database)
+    rows = connection.execute("SELECT huc, host, pid, heartbeat, started FROM jobs WHERE status = 'running'").fetchall()
+    dead = []
+    for huc, job_host, pid, heartbeat, started in rows:
+        last = heartbeat if heartbeat is not None else started
+        if (job_host == host and (pid is None or not processAlive(pid))) or last is None or now - last > lease:
+            dead.append(huc)
+    with connection:
+        for huc in dead:
+            connection.execute("UPDATE jobs SET status = 'pending', pid = NULL WHERE huc = ? AND status = 'running'",
+                               (huc,))
+    connection.close()
+    return len(dead)
+
+
+def heartbeat(database, huc, stop):
+    """Records that a job is alive every HEARTBEAT seconds until stop is set"""
+    connection = connect(database)
+    while not stop.wait(HEARTBEAT):
+        with connection:
+            connection.execute("UPDATE jobs SET heartbeat = ? WHERE huc = ?", (time.time(), huc))
+    connection.close()
+
+
+def retryFailed(database):
+    """Gives failed jobs a new set of attempts"""
+    connection = connect(database)
+    with connection:
+        count = connection.execute("UPDATE jobs SET status = 'pending', attempts = 0 WHERE status = 'failed'").rowcount
+    connection.close()
+    return count
+
+
+def runStep(step, previous):
+    """Imports the tool of a step and calls it with the step's parameters"""
+    module_name, function_name = TOOLS[step["tool"]]
+    module = __import__(module_name)
+    params = dict(step.get("params", {}))
+    for key, value in params.items():
+        if value == PREVIOUS:
+            params[key] = previous
+    if step["tool"] in SERIAL_TOOLS:
+        params.setdefault("workers", 1)
+    return getattr(module, function_name)(**params)
+
+
+def claimJob(database, huc):
+    """Marks a pending job as running on this host and counts the attempt. False if another runner took it
+    first"""
+    connection = connect(database)
+    with connection:
+        count = connection.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, host = ?, pid = ?, "
+                                   "started = ?, heartbeat = ?, error = NULL WHERE huc = ? AND status = 'pending'",
+                                   (socket.gethostname(), os.getpid(), time.time(), time.time(), huc)).rowcount
+    connection.close()
+    return count == 1
+
+
+def runJob(args):
+    """Worker: runs the remaining steps of a claimed HUC and records progress after each one"""
+    database, huc = args
+    connection = connect(database)
+    with connection:
+        row = connection.execute("SELECT steps, next_step, results, timings FROM jobs WHERE huc = ?",
+                                 (huc,)).fetchone()
+        connection.execute("UPDATE jobs SET pid = ?, heartbeat = ? WHERE huc = ?", (os.getpid(), time.time(), huc))
+    steps = json.loads(row[0])
+    next_step = row[1]
+    results = json.loads(row[2])
+    timings = json.loads(row[3])
+
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(database, huc, stop))
+    beat.daemon = True
+    beat.start()
+    try:
+        for i in range(next_step, len(steps)):
+            start = time.time()
+            previous = results[-1] if results else None
+            result = runStep(steps[i], previous)
+            results.append(result if isinstance(result, (str, int, float, type(None))) else str(result))
+            timings.append({"step": i, "tool": steps[i]["tool"], "seconds": time.time() - start})
+            with connection:
+                connection.execute("UPDATE jobs SET next_step = ?, results = ?, timings = ? WHERE huc = ?",
+                                   (i + 1, json.dumps(results), json.dumps(timings), huc))
+    except Exception:
+        error = traceback.format_exc()
+        with connection:
+            connection.execute("UPDATE jobs SET status = 'error', finished = ?, error = ? WHERE huc = ?",
+                               (time.time(), error, huc))
+        connection.close()
+        return huc, False
+    finally:
+        stop.set()
+        beat.join()
+
+    with connection:
+        connection.execute("UPDATE jobs SET status = 'done', finished = ? WHERE huc = ?", (time.time(), huc))
+    connection.close()
+    return huc, True
+
+
+def markCrashed(database, huc, exitcode):
+    """Records an error for a job whose process exited before recording its end"""
+    connection = connect(database)
+    with connection:
+        connection.execute("UPDATE jobs SET status = 'error', finished = ?, error = ? WHERE huc = ? AND "
+                           "status = 'running'", (time.time(), "worker exited with code " + str(exitcode), huc))
+    connection.close()
+
+
+def jobStatus(database, huc):
+    connection = connect(database)
+    status = connection.execute("SELECT status FROM jobs WHERE huc = ?", (huc,)).fetchone()[0]
+    connection.close()
+    return status
+
+
+def settleErrors(database, max_attempts):
+    """Jobs that errored go back to pending while they have attempts left, the rest are failed"""
+    connection = connect(database)
+    with connection:
+        connection.execute("UPDATE jobs SET status = 'pending' WHERE status = 'error' AND attempts < ?",
+                           (max_attempts,))
+        connection.execute("UPDATE jobs SET status = 'failed' WHERE status = 'error'")
+    connection.close()
+
+
+def pendingJobs(database):
+    connection = connect(database)
+    hucs = [row[0] for row in connection.execute("SELECT huc FROM jobs WHERE status = 'pending' ORDER BY huc")]
+    connection.close()
+    return hucs
+
+
+def summary(database, output=None):
+    """Status, attempts, step timings and errors of every job, written as json if an output is given"""
+    connection = connect(database)
+    rows = connection.execute("SELECT huc, status, attempts, next_step, results, timings, host, started, "
+                              "finished, error FROM jobs ORDER BY huc").fetchall()
+    connection.close()
+
+    jobs = []
+    for huc, status, attempts, next_step, results, timings, host, started, finished, error in rows:
+        timings = json.loads(timings)
+        jobs.append({"huc": huc, "status": status, "attempts": attempts, "steps_done": next_step,
+                     "results": json.loads(results), "timings": timings,
+                     "seconds": sum(timing["seconds"] for timing in timings), "host": host,
+                     "started": started, "finished": finished, "error": error})
+    counts = {}
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+    report = {"jobs": len(jobs), "status": counts, "seconds": sum(job["seconds"] for job in jobs),
+              "failed": [job["huc"] for job in jobs if job["status"] == "failed"], "details": jobs}
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def main(manifest, database, summary_file, workers=None, max_attempts=3, retry_failed=False):
+    """Runs every job of the manifest that is not done yet, up to workers at a time"""
+    if workers is None:
+        workers = max(multiprocessing.cpu_count() // 2, 1)
+
+    createTable(database)
+    loadJobs(database, readManifest(manifest))
+    interrupted = resetInterrupted(database)
+    if interrupted:
+        print("resuming " + str(interrupted) + " interrupted jobs")
+    if retry_failed:
+        retryFailed(database)
+
+    # each job gets a process of its own, a process that dies without recording its end (a crash in arcpy or
+    # GDAL) is counted as an error of its job
+    while True:
+        hucs = pendingJobs(database)
+        if not hucs:
+            break
+        running = {}
+        while hucs or running:
+            while hucs and len(running) < workers:
+                huc = hucs.pop(0)
+                if not claimJob(database, huc):
+                    continue
+                process = multiprocessing.Process(target=runJob, args=((database, huc),))
+                process.start()
+                running[huc] = process
+            time.sleep(1)
+            for huc, process in list(running.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                del running[huc]
+                if process.exitcode != 0:
+                    markCrashed(database, huc, process.exitcode)
+                print(huc + " " + jobStatus(database, huc))
+        settleErrors(database, max_attempts)
+
+    report = summary(database, summary_file)
+    print(json.dumps(report["status"]))
+    return report
+
+
+if __name__ == '__main__':
+    main(sys.argv[1],
+         sys.argv[2],
+         sys.argv[3],
+         int(sys.argv[4]) if len(sys.argv) > 4 else None,
+         int(sys.argv[5]) if len(sys.argv) > 5 else 3)
@@ -0,0 +1,240 @@
+# # # Stage checkpoints that let a rerun skip work whose inputs have not changed # # #
+
+# every finished stage leaves a json manifest in scratch/checkpoints holding a fingerprint of its function,
+# arguments and input files, the size and modification time of the files it wrote and its result. On a
+# rerun a stage is skipped if the fingerprint is the same and every output is still there, unchanged and
+# readable. Long loops keep partial progress in a Progress file so a rerun carries on where it stopped
+
+import hashlib
+import json
+import os
+import numpy as np
+from osgeo import gdal
+
+# bump when the manifest layout changes so older checkpoints are ignored
+CHECKPOINT_VERSION = 2
+
+# text type of paths, arcpy hands out unicode paths under python 2
+try:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
+# files that make up a shapefile, any of them changing changes the features
+SHAPEFILE_PARTS = [".shp", ".shx", ".dbf", ".prj"]
+
+
+def geodatabase(path):
+    """The .gdb or .sde a path is inside of, None for other paths"""
+    parts = os.path.normpath(path).split(os.sep)
+    for i, part in enumerate(parts):
+        if os.path.splitext(part)[1].lower() in (".gdb", ".sde"):
+            return os.sep.join(parts[:i + 1])
+    return None
+
+
+def isDataset(path):
+    """Whether a path is data whose files are fingerprinted, a file or an ESRI grid folder. Other folders are
+    working locations (scratch, project folders) that change all the time"""
+    if os.path.isdir(path):
+        return os.path.exists(os.path.join(path, "hdr.adf"))
+    return os.path.exists(path)
+
+
+def fileStamp(path):
+    """Size and modification time of a file, of the parts of a shapefile or of every file in a folder"""
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, dirs, names in os.walk(path) for name in names)
+    elif path.lower().endswith(".shp"):
+        files = [os.path.splitext(path)[0] + part for part in SHAPEFILE_PARTS]
+    else:
+        files = [path]
+    return [[os.path.basename(name), os.path.getsize(name), os.path.getmtime(name)]
+            for name in files if os.path.exists(name)]
+
+
+def codeHash(code, sha):
+    """Adds the bytecode, constants and names of a function's code, and of the functions defined in it"""
+    sha.update(code.co_code)
+    sha.update(repr(code.co_names).encode("utf-8"))
+    for constant in code.co_consts:
+        if hasattr(constant, "co_code"):
+            codeHash(constant, sha)
+        else:
+            sha.update(repr(constant).encode("utf-8"))
+
+
+def fingerprint(value, sha=None, outputs=()):
+    """Stable hash of a stage argument. Existing paths are fingerprinted by their files, except the stage's own
+    outputs, paths inside a file geodatabase by the files of the whole geodatabase, arrays and geometries by
+    their bytes, functions by their code and objects by their own fingerprint method. Returns None for anything
+    else, a stage with such an argument is never skipped"""
+    top = sha is None
+    if top:
+        sha = hashlib.sha1()
+
+    if value is None or isinstance(value, (bool, int, float)):
+        sha.update(repr(value).encode("utf-8"))
+    elif isinstance(value, STRING_TYPES):
+        sha.update(value.encode("utf-8"))
+        gdb = geodatabase(value)
+        if gdb is not None and value not in outputs:
+            # feature classes in a geodatabase are not files of their own, any change to the geodatabase counts.
+            # Enterprise geodatabases can not be stamped at all
+            if gdb.lower().endswith(".sde"):
+                return None
+            if os.path.isdir(gdb):
+                sha.update(json.dumps(fileStamp(gdb)).encode("utf-8"))
+        elif value not in outputs and isDataset(value):
+            sha.update(json.dumps(fileStamp(value)).encode("utf-8"))
+    elif isinstance(value, (list, tuple)):
+        sha.update(b"[")
+        for item in value:
+            if fingerprint(item, sha, outputs) is None:
+                return None
+        sha.update(b"]")
+    elif isinstance(value, dict):
+        sha.update(b"{")
+        for key in sorted(value, key=repr):
+            sha.update(repr(key).encode("utf-8"))
+            if fingerprint(value[key], sha, outputs) is None:
+                return None
+        sha.update(b"}")
+    elif isinstance(value, np.ndarray):
+        sha.update(str(value.dtype).encode("utf-8") + repr(value.shape).encode("utf-8"))
+        sha.update(np.ascontiguousarray(value).tobytes())
+    elif hasattr(value, "wkb"):
+        sha.update(value.wkb)
+    elif hasattr(value, "fingerprint"):
+        sha.update(value.fingerprint().encode("utf-8"))
+    elif hasattr(value, "__self__") and hasattr(value.__self__, "fingerprint"):
+        # bound method of an object that can be fingerprinted
+        sha.update(value.__self__.fingerprint().encode("utf-8") + value.__name__.encode("utf-8"))
+        codeHash(value.__func__.__code__, sha)
+    elif callable(value) and getattr(value, "__name__", "<lambda>") != "<lambda>" and \
+            not getattr(value, "__closure__", None) and hasattr(value, "__code__"):
+        # a function changes its fingerprint when its code does
+        sha.update(((getattr(value, "__module__", None) or "") + "." + value.__name__).encode("utf-8"))
+        codeHash(value.__code__, sha)
+    else:
+        return None
+
+    if top:
+        return sha.hexdigest()
+    return sha
+
+
+def validOutput(path, stamp):
+    """An output is valid if its files are unchanged since the checkpoint and GDAL opens rasters"""
+    if not os.path.exists(path) or fileStamp(path) != stamp:
+        return False
+    if os.path.splitext(path)[1].lower() in (".tif", ".vrt", ".img"):
+        return gdal.Open(path) is not None
+    return True
+
+
+class Checkpoints:
+    """Checkpoint manifests of the stages of a run, kept in the scratch folder"""
+
+    def __init__(self, scratch):
+        self.folder = os.path.join(scratch, "checkpoints")
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    def path(self, name):
+        safe = "".join(c if c.isalnum() else "_" for c in name)
+        return os.path.join(self.folder, safe + ".json")
+
+    def key(self, function, args, kwargs, outputs=()):
+        """Fingerprint of a stage call, None if it cannot be fingerprinted"""
+        return fingerprint([CHECKPOINT_VERSION, function, list(args), kwargs], outputs=set(outputs))
+
+    def load(self, name, key, outputs):
+        """Returns (True, result) if the stage ran before with the same key and its outputs are intact"""
+        if key is None or not os.path.exists(self.path(name)):
+            return False, None
+        with open(self.path(name)) as f:
+            record = json.load(f)
+        if record.get("key") != key or sorted(record["outputs"]) != sorted(outputs):
+            return False, None
+        for output in outputs:
+            if not validOutput(output, record["outputs"][output]):
+                return False, None
+
+        result = record["result"]
+        if record.get("result_file"):
+            if not os.path.exists(record["result_file"]):
+                return False, None
+            # imported here so the checkpoints of stages without tables never need arcpy
+            import AttributeTable
+            result = AttributeTable.AttributeTable.load(record["result_file"])
+        return True, result
+
+    def save(self, name, key, outputs, result):
+        """Records a finished stage, its result has to be json or an AttributeTable to be reused"""
+        if key is None:
+            return
+        result_file = None
+        if hasattr(result, "columns") and hasattr(result, "save"):
+            result_file = os.path.splitext(self.path(name))[0] + ".npz"
+            result.save(result_file)
+            result = None
+        else:
+            try:
+                json.dumps(result)
+            except (TypeError, ValueError):
+                return
+        record = {"version": CHECKPOINT_VERSION, "stage": name, "key": key, "result": result,
+                  "result_file": result_file, "outputs": dict((output, fileStamp(output)) for output in outputs)}
+        # written to a temporary file first so a crash never leaves a half written manifest
+        with open(self.path(name) + ".tmp", "w") as f:
+            json.dump(record, f)
+        if os.path.exists(self.path(name)):
+            os.remove(self.path(name))
+        os.rename(self.path(name) + ".tmp", self.path(name))
+
+    def clear(self, name):
+        if os.path.exists(self.path(name)):
+            os.remove(self.path(name))
+
+    def run(self, name, function, args=(), kwargs=None, outputs=()):
+        """Calls a stage function unless a checkpoint of the same call is intact. Returns the result and
+        whether the call was skipped"""
+        kwargs = kwargs or {}
+        key = self.key(function, args, kwargs, outputs)
+        done, result = self.load(name, key, outputs)
+        if done:
+            return result, True
+        result = function(*args, **kwargs)
+        self.save(name, key, outputs, result)
+        return result, False
+
+
+class Progress:
+    """Partial results of a long loop saved every so often, tied to a key of the loop's inputs"""
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+
+    def load(self):
+        """Arrays saved by the last run with the same key, None if there are none"""
+        if self.key is None or not os.path.exists(self.path):
+            return None
+        data = np.load(self.path, allow_pickle=False)
+        if str(data["_key"]) != self.key:
+            return None
+        return dict((name, data[name]) for name in data.files if name != "_key")
+
+    def save(self, **arrays):
+        if self.key is None:
+            return
+        arrays["_key"] = np.asarray(self.key)
+        np.savez(self.path + ".tmp.npz", **arrays)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(self.path + ".tmp.npz", self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,70 @@
+# # # Tile occupancy of the stream corridor for computing rasters only where the network is # # #
+
+# the buffered network is burned onto a coarse grid whose cells are whole output tiles, so a raster on any
+# grid can be processed tile by tile skipping every tile the corridor does not touch. Outputs written this
+# way are sparse GeoTIFFs, the skipped tiles take no disk space and read back as nodata
+
+import hashlib
+import numpy as np
+import RasterBlocks
+
+# tile size of the rasters written by RasterBlocks.createLike
+TILE_SIZE = 256
+
+
+class Corridor:
+    """Polygons (normally the buffered network) in the coordinate system srs that limit where rasters are
+    computed"""
+
+    def __init__(self, geoms, tile_size=TILE_SIZE, srs=None):
+        self.geoms = geoms
+        self.tile_size = tile_size
+        self.srs = srs
+        self.maps = {}
+
+    def fingerprint(self):
+        """Hash of the corridor polygons and tile size, for checkpoints of stages limited to the corridor"""
+        sha = hashlib.sha1(str(self.tile_size).encode("utf-8"))
+        sha.update((self.srs or "").encode("utf-8"))
+        for geom in self.geoms:
+            sha.update(geom.wkb)
+        return sha.hexdigest()
+
+    def occupancy(self, rasterDS, tile_size=None):
+        """Boolean array with one cell per tile of a dataset's grid, True where the corridor touches the tile"""
+        if tile_size is None:
+            tile_size = self.tile_size
+        gt = rasterDS.GetGeoTransform()
+        projection = rasterDS.GetProjection()
+        key = (gt, rasterDS.RasterXSize, rasterDS.RasterYSize, projection, tile_size)
+        if key not in self.maps:
+            coarse = (gt[0], gt[1] * tile_size, 0.0, gt[3], 0.0, gt[5] * tile_size)
+            nx = -(-rasterDS.RasterXSize // tile_size)
+            ny = -(-rasterDS.RasterYSize // tile_size)
+            geoms = RasterBlocks.projectGeoms(self.geoms, self.srs, projection)
+            zones = RasterBlocks.zoneLayer(geoms, np.ones(len(geoms), np.int64), projection)
+            self.maps[key] = RasterBlocks.rasterizeWindow(zones, coarse, projection, 0, 0, nx, ny,
+                                                          all_touched=True) > 0
+        return self.maps[key]
+
+    def windows(self, rasterDS, tile_size=None):
+        """Yields the (xoff, yoff, xsize, ysize) tiles of a dataset's grid that the corridor touches"""
+        if tile_size is None:
+            tile_size = self.tile_size
+        occupied = self.occupancy(rasterDS, tile_size)
+        for ty, tx in zip(*np.nonzero(occupied)):
+            xoff = int(tx) * tile_size
+            yoff = int(ty) * tile_size
+            yield (xoff, yoff, min(tile_size, rasterDS.RasterXSize - xoff),
+                   min(tile_size, rasterDS.RasterYSize - yoff))
+
+    def fraction(self, rasterDS):
+        """Share of a grid's tiles that are computed"""
+        return float(self.occupancy(rasterDS).mean())
+
+
+def windows(rasterDS, corridor=None):
+    """Windows to process on a dataset's grid, every block without a corridor, occupied tiles with one"""
+    if corridor is None:
+        return RasterBlocks.blockWindows(rasterDS.GetRasterBand(1))
+    return corridor.windows(rasterDS)
@@ -0,0 +1,67 @@
+# # # Euclidean distance from polygons computed directly on the analysis grid # # #
+
+# the polygons are rasterized on the output grid and an exact euclidean distance transform is run at that
+# resolution. With a maximum distance the grid is processed in tiles with a halo as wide as the cutoff, so
+# every distance up to the cutoff is still exact and memory is bounded by the tile size
+
+from osgeo import gdal
+from scipy import ndimage
+import numpy as np
+import Corridor
+import RasterBlocks
+
+
+def distanceBlock(sources, cell_width, cell_height):
+    """Distance from every cell center to the nearest source cell center of a boolean array"""
+    if not sources.any():
+        return np.full(sources.shape, np.inf)
+    return ndimage.distance_transform_edt(~sources, sampling=(cell_height, cell_width))
+
+
+def distanceRaster(geoms, template, output, max_distance=None, tile_size=1024, corridor=None, srs=None):
+    """Writes the distance to the nearest polygon on the grid of a template raster. Cells a polygon touches
+    get 0, so polygons narrower than a cell are never lost. Cells farther than max_distance get nodata. With a
+    corridor (and a cutoff) tiles it does not touch are skipped and left sparse"""
+    templateDS = gdal.Open(template)
+    geotransform = templateDS.GetGeoTransform()
+    projection = templateDS.GetProjection()
+    cols = templateDS.RasterXSize
+    rows = templateDS.RasterYSize
+    cell_width = abs(geotransform[1])
+    cell_height = abs(geotransform[5])
+
+    geoms = RasterBlocks.projectGeoms(geoms, srs, projection)
+    polygons = RasterBlocks.zoneLayer(geoms, np.ones(len(geoms), np.int64), projection)
+    outDS = RasterBlocks.createLike(output, templateDS, gdal.GDT_Float32, RasterBlocks.NODATA, corridor is not None)
+    outBand = outDS.GetRasterBand(1)
+
+    if max_distance is None:
+        # without a cutoff any source can be the nearest, so the whole grid is done at once
+        tile_size = max(rows, cols)
+        halo = 0
+    else:
+        halo = int(np.ceil(float(max_distance) / min(cell_width, cell_height))) + 1
+
+    if corridor is not None and max_distance is not None:
+        # tiles stay a whole number of output blocks so skipped ones are never allocated
+        tile_size = max(Corridor.TILE_SIZE, tile_size // Corridor.TILE_SIZE * Corridor.TILE_SIZE)
+        tiles = corridor.windows(templateDS, tile_size)
+    else:
+        tiles = ((xoff, yoff, min(tile_size, cols - xoff), min(tile_size, rows - yoff))
+                 for yoff in range(0, rows, tile_size) for xoff in range(0, cols, tile_size))
+
+    for xoff, yoff, xsize, ysize in tiles:
+        # sources are burned over the tile and its halo, which may reach past the grid edge
+        sources = RasterBlocks.rasterizeWindow(polygons, geotransform, projection, xoff - halo, yoff - halo,
+                                               xsize + 2 * halo, ysize + 2 * halo, all_touched=True) > 0
+        distance = distanceBlock(sources, cell_width, cell_height)[halo:halo + ysize, halo:halo + xsize]
+
+        invalid = ~np.isfinite(distance)
+        if max_distance is not None:
+            invalid |= distance > max_distance
+        distance[invalid] = RasterBlocks.NODATA
+        outBand.WriteArray(distance.astype(np.float32), xoff, yoff)
+
+    outBand.FlushCache()
+
+    return output
@@ -11,14 +11,32 @@
 import arcpy
 from arcpy.sa import *
 import os
+from osgeo import gdal
 import numpy as np
+import AnalysisGrid
+import AttributeTable
+import Checkpoint
+import Corridor
+import FireScenarios
+import GullyEngine
+import LandfireLUT
 import NormalizedTWI
+import Pipeline
 import RasterOverlap
+import SegmentGeometry
 import SegmentZS
+import StreamNormalize
 import sys
 
-def main(network, evh, evc, dem, valley, firePoly, bps, scratch):
-    """"""
+# gullies farther than this from the network are not scored, the TWI they come from is computed within it
+GULLY_DISTANCE = 250
+
+
+def main(network, evh, evc, dem, valley, firePoly, bps, scratch, corridor_only=False, id_field=None, workers=2,
+         zonal_stats="batched"):
+    """The fire and gully chains share no intermediate data and can run on up to workers threads. The fire
+    and network geometries are read with arcpy before the stages start, so the fire raster is made with GDAL
+    alone while the arcpy stages take turns. zonal_stats is one of SegmentZS.ZONAL_STATS"""
 
     arcpy.env.overwriteOutput = True
     arcpy.CheckOutExtension("spatial")
@@ -30,46 +48,54 @@ def main(network, evh, evc, dem, valley, firePoly, bps, scratch):
 
     # make sure datasets are projected
 
+    # the geometries are read with arcpy here, the stages that only burn them need no arcpy and run alongside
+    # the others
+    fire_ids, fire_geoms = SegmentZS.readSegments(firePoly)
+    network_ids, network_geoms = SegmentZS.readSegments(network)
+    fire_srs = SegmentZS.featureSRS(firePoly)
+    network_srs = SegmentZS.featureSRS(network)
+
+    # only the 50m segment buffers are summarized, so the rasters can be limited to the tiles they touch.
+    # Gullies are scored up to 250m away, so their TWI is limited to the tiles of the 250m buffers
+    corridor = None
+    gully_corridor = None
+    if corridor_only:
+        corridor = Corridor.Corridor(SegmentZS.bufferSegments(network_geoms, 50), srs=network_srs)
+        gully_corridor = Corridor.Corridor(SegmentZS.bufferSegments(network_geoms, GULLY_DISTANCE), srs=network_srs)
+
+    id_field = id_field or "OID@"
+    # stages whose inputs did not change since a run that stopped part way are skipped
+    pipeline = Pipeline.Pipeline(workers, arcpy.AddMessage, Checkpoint.Checkpoints(scratch))
+
     # generate raster that is the overlap between bps lwd species and burned areas, convert to 1s and 0s
-    arcpy.AddMessage("fire raster")
-    fire_raster = fire_rasters(firePoly, bps, network, scratch)
+    if not os.path.exists(os.path.dirname(firePoly) + "/LWD_Burn"):
+        os.mkdir(os.path.dirname(firePoly) + "/LWD_Burn")
+    bps_burn_overlap = os.path.dirname(firePoly) + "/LWD_Burn/lwd_burn.tif"
+    fire_raster = pipeline.add("fire raster", fire_rasters,
+                               (fire_geoms, network_geoms, bps, bps_burn_overlap, corridor, fire_srs, network_srs),
+                               outputs=[bps_burn_overlap])
 
     # summarize the above generated raster onto a table to be merged with network
-    arcpy.AddMessage("fire raster to table")
-    rasterToTable(network, fire_raster, scratch)
-
-    # merge table onto network
-    arcpy.AddMessage("merge table")
-    burn_table = scratch + "/burn_table.txt"
-    burn_table_out = scratch + "/burn_table_out.dbf"
-    arcpy.CopyRows_management(burn_table, burn_table_out)
-    arcpy.JoinField_management(network, "FID", burn_table_out, "ID", "BURN_AREA")
-
-    arcpy.AddField_management(network, "BURN_PROP", "DOUBLE")
-    cursor = arcpy.da.UpdateCursor(network, ["BURN_AREA", "AREA", "BURN_PROP"])
-    for row in cursor:
-        row[2] = row[0] / row[1]
-        cursor.updateRow(row)
-    del row
-    del cursor
+    options = SegmentZS.zonalStatsOptions(zonal_stats, workers)
+    options["id_field"] = id_field
+    pipeline.add("fire raster to table", rasterToTable, (network, fire_raster, scratch), options, threadsafe=False)
 
-    # identify slide gullies
-    arcpy.AddMessage("gullies")
-    slideGullies(network, dem, valley, scratch)
-
-    # get stats within the gullies
-    arcpy.AddMessage("gully stats")
-    gullies = os.path.dirname(dem) + "/Gullies/slide_gullies.shp"
+    # slide gullies and their scores, independent of the fire chain. The height and cover rasters the
+    # Individual tool made are arguments so a checkpoint notices when they change
     height = os.path.dirname(os.path.dirname(evh)) + "/Height_Rasters/total_height.tif"
     cover = os.path.dirname(os.path.dirname(evc)) + "/Cover/total_cover.tif"
-    gulliesSum(gullies, height, cover, scratch)
+    pipeline.add("gullies", gullyScores, (network, dem, valley, height, cover, scratch, gully_corridor, id_field),
+                 outputs=[os.path.dirname(dem) + "/Gullies/slide_gullies.shp"], threadsafe=False)
+    results = pipeline.run()
 
-    # merge table onto network
-    arcpy.AddMessage("merge gully table")
-    gully_table = scratch + "/gully_table.txt"
-    gully_table_out = scratch + "/gully_table_out.dbf"
-    arcpy.CopyRows_management(gully_table, gully_table_out)
-    arcpy.JoinField_management(network, "FID", gully_table_out, "ID", "GULLIES")
+    # merge tables onto network, segments without a gully are left null
+    arcpy.AddMessage("merge table")
+    table = results["fire raster to table"]
+    table.join(AttributeTable.AttributeTable.fromFeatures(network, ["AREA"], id_field))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        table.add("BURN_PROP", table["BURN_AREA"] / table["AREA"])
+    table.write(network, ["BURN_AREA", "BURN_PROP"], id_field)
+    results["gullies"].write(network, ["GULLIES"], id_field)
 
     # delete temp folder...?
 
@@ -78,94 +104,116 @@ def main(network, evh, evc, dem, valley, firePoly, bps, scratch):
     return
 
 
-def fire_rasters(firePoly, bps, network, scratch):
-    """Identify areas where wildfire contributes to LWD recruitment"""
-
-    # raster of fire polygon
-    outds = scratch + "/temp_burn_raster.tif"
-    cellsz = arcpy.Describe(bps).meanCellWidth
-    # arcpy.env.extent = network
-    arcpy.PolygonToRaster_conversion(firePoly, "FID", outds, cellsize=cellsz)
-    burn_raster = scratch + "/burn_raster.tif"
-    arcpy.CopyRaster_management(outds, burn_raster, nodata_value=225)
-    arcpy.Delete_management(outds)
-
-    # derive a potential lwd layer from landfire BpS
-    lfevh = arcpy.ListFields(bps, "LWD")
-    if len(lfevh) == 1:
-        arcpy.DeleteField_management(bps, "LWD")
-    arcpy.AddField_management(bps, "LWD", "SHORT")
-    cursor = arcpy.da.UpdateCursor(bps, ["GROUPVEG", "LWD"])
-    for row in cursor:
-        if row[0] == "PerennialIce/Snow":
-            row[1] = 0
-        elif row[0] == "Barren-Rock/Sand/Clay":
-            row[1] = 0
-        elif row[0] == "Conifer":
-            row[1] = 1
-        elif row[0] == "Conifer-Hardwood":
-            row[1] = 1
-        elif row[0] == "Grassland":
-            row[1] = 0
-        elif row[0] == "Hardwood":
-            row[1] = 1
-        elif row[0] == "Hardwood-Conifer":
-            row[1] = 1
-        elif row[0] == "Peatland Forest":
-            row[1] = 0
-        elif row[0] == "Peatland non-forest":
-            row[1] = 0
-        elif row[0] == "Riparian":
-            row[1] = 0
-        elif row[0] == "Savanna":
-            row[1] = 0
-        elif row[0] == "Sparse":
-            row[1] = 0
+def batchMain(network, evh, evc, dem, valley, fires, bps, scratch, out_table, scenario_field=None, layout="wide",
+              corridor_only=False, id_field=None):
+    """Runs the fire part of the model for many fire perimeters, a list of feature classes that are each one
+    scenario or, with a scenario field, hold one scenario per value of it. The BpS LWD mask, segment zones and
+    gully scores are only made once. BURN_AREA and BURN_PROP of every scenario go to one csv table"""
+
+    arcpy.env.overwriteOutput = True
+    arcpy.CheckOutExtension("spatial")
+
+    # checks
+    lf = arcpy.ListFields(network, "AREA")
+    if len(lf) != 1:
+        raise Exception("Network must contain field 'AREA'. Use individual probability output network.")
+
+    corridor = None
+    gully_corridor = None
+    if corridor_only:
+        network_ids, network_geoms = SegmentZS.readSegments(network)
+        network_srs = SegmentZS.featureSRS(network)
+        corridor = Corridor.Corridor(SegmentZS.bufferSegments(network_geoms, 50), srs=network_srs)
+        gully_corridor = Corridor.Corridor(SegmentZS.bufferSegments(network_geoms, GULLY_DISTANCE), srs=network_srs)
+
+    # burn independent layers: the lwd producing BpS cells and the segment zones on the BpS grid
+    arcpy.AddMessage("bps lwd and segment zones")
+    lwd_raster = LandfireLUT.lookupRaster(bps, "GROUPVEG", LandfireLUT.LWD, scratch + "/bps_lookup.tif",
+                                          corridor=corridor)
+    id_field = id_field or "OID@"
+    index = SegmentZS.segmentIndex(network, lwd_raster, 50, scratch, id_field=id_field)
+    batch = FireScenarios.FireBatch(index, lwd_raster)
+
+    table = AttributeTable.AttributeTable(index.ids)
+    table.join(AttributeTable.AttributeTable.fromFeatures(network, ["AREA"], id_field))
+
+    # every fire is burned in memory over its own extent
+    results = []
+    for name, fire_geoms, fire_srs in readScenarios(fires, scenario_field):
+        arcpy.AddMessage("fire scenario " + name)
+        results.append((name, batch.burnArea(fire_geoms, fire_srs)))
+    FireScenarios.writeTable(out_table, index.ids, table["AREA"], results, layout)
+
+    height = os.path.dirname(os.path.dirname(evh)) + "/Height_Rasters/total_height.tif"
+    cover = os.path.dirname(os.path.dirname(evc)) + "/Cover/total_cover.tif"
+    gully_table = gullyScores(network, dem, valley, height, cover, scratch, gully_corridor, id_field)
+    gully_table.write(network, ["GULLIES"], id_field)
+
+    arcpy.CheckInExtension("spatial")
+
+    return
+
+
+def readScenarios(fires, scenario_field=None):
+    """Returns (name, polygons, coordinate system) of every fire scenario. Without a scenario field each
+    feature class is one scenario named after the file"""
+    scenarios = []
+    for fire in fires:
+        srs = SegmentZS.featureSRS(fire)
+        if scenario_field:
+            columns, geoms = SegmentZS.readFeatures(fire, [scenario_field])
+            values = columns[scenario_field].tolist()
+            for value in sorted(set(values)):
+                scenario_geoms = [geom for geom, v in zip(geoms, values) if v == value]
+                scenarios.append((FireScenarios.TEXT_TYPE(value), scenario_geoms, srs))
         else:
-            row[1] = 0
-        cursor.updateRow(row)
-    del row
-    del cursor
-
-    bps_lookup = Lookup(bps, "LWD")
-    buf_50 = scratch + "/buf_50.shp"
-    arcpy.Buffer_analysis(network, buf_50, "50 Meters", "FULL", "ROUND", "ALL")
-    bps_lwd_temp = ExtractByMask(bps_lookup, buf_50)
-    bps_lwd_temp2 = scratch + "/bps_lwd_temp2.tif"
-    arcpy.Clip_management(bps_lwd_temp, "", bps_lwd_temp2, burn_raster,
-                          arcpy.Describe(bps).noDataValue, "", "MAINTAIN_EXTENT")
-
-    bps_lwd_temp3 = SetNull(bps_lwd_temp2, bps_lwd_temp2, "VALUE = 0")
-
-    if not os.path.exists(os.path.dirname(os.path.dirname(bps)) + "/BPS_LWD"):
-        os.mkdir(os.path.dirname(os.path.dirname(bps)) + "/BPS_LWD")
-    bps_lwd_raster = os.path.dirname(os.path.dirname(bps)) + "/BPS_LWD/bps_lwd.tif"
-    arcpy.CopyRaster_management(bps_lwd_temp3, bps_lwd_raster, nodata_value=127)
-
-    # raster overlap output and function
-    if not os.path.exists(os.path.dirname(firePoly) + "/LWD_Burn"):
-        os.mkdir(os.path.dirname(firePoly) + "/LWD_Burn")
-    bps_burn_overlap = os.path.dirname(firePoly) + "/LWD_Burn/lwd_burn.tif"
+            ids, geoms = SegmentZS.readSegments(fire)
+            scenarios.append((os.path.splitext(os.path.basename(fire))[0], geoms, srs))
+
+    names = [scenario[0] for scenario in scenarios]
+    if len(set(names)) != len(names):
+        raise Exception("Fire scenario names must be unique")
+    return scenarios
+
+
+def gullyScores(network, dem, valley, height, cover, scratch, corridor=None, id_field="OID@"):
+    """Finds the slide gullies and scores them by the total height and cover within them, returns the scores
+    keyed by segment id"""
+
+    # identify slide gullies
+    arcpy.AddMessage("gullies")
+    slideGullies(network, dem, valley, scratch, corridor, id_field=id_field)
+
+    # get stats within the gullies
+    arcpy.AddMessage("gully stats")
+    gullies = os.path.dirname(dem) + "/Gullies/slide_gullies.shp"
+    return gulliesSum(gullies, height, cover, scratch)
+
+
+def fire_rasters(fire_geoms, network_geoms, bps, bps_burn_overlap, corridor=None, fire_srs=None, network_srs=None):
+    """Identify areas where wildfire contributes to LWD recruitment. Works on geometries already read, with GDAL
+    only, so it can run on a thread beside the arcpy stages"""
 
-    RasterOverlap.RasterOverlap(bps_lwd_raster, burn_raster, bps_burn_overlap)
+    # the fire polygons and the 50m network buffer are burned in memory on the BpS grid, within the buffer's
+    # extent, and combined with the BpS LWD lookup block by block
+    buffers = [geom.buffer(50) for geom in network_geoms]
+    FireScenarios.lwdBurnRaster(bps, fire_geoms, buffers, bps_burn_overlap, corridor, fire_srs, network_srs)
 
     return bps_burn_overlap
 
 
-def slideGullies(network, dem, valley, scratch):
+def slideGullies(network, dem, valley, scratch, corridor=None, search_radius=None, id_field="OID@"):
     """"""
 
     # create a normalized twi raster
-    twi_instance = NormalizedTWI.TWI(dem, valley, scratch)
+    twi_instance = NormalizedTWI.TWI(dem, valley, scratch, corridor)
 
     # make sure slope and twi rasters are orthogonal and reclassify them
     twi_raster = twi_instance.twi_output
-    slope_raster = os.path.dirname(dem) + "/Slope/slope_deg.tif"
+    slope_raster = twi_instance.terrain.slope("DEGREE")
 
-    arcpy.Clip_management(slope_raster, rectangle=None, out_raster=scratch + "/slope_clip.tif",
-                          in_template_dataset=twi_raster,maintain_clipping_extent="MAINTAIN_EXTENT")
-
-    slope_clip = Raster(scratch + "/slope_clip.tif")
+    grid = AnalysisGrid.AnalysisGrid.fromRaster(twi_raster.catalogPath, scratch)
+    slope_clip = Raster(grid.align(slope_raster, "nearest"))
     slope_final = Reclassify(slope_clip, "VALUE", "0 25 NODATA; 25 90 1")
     twi_final = Reclassify(twi_raster, "VALUE", RemapRange([[0, 3.4, "NODATA"], [3.4, 10, 1]]))
 
@@ -180,26 +228,23 @@ def slideGullies(network, dem, valley, scratch):
 
     RasterOverlap.RasterOverlap(slope_in, twi_in, scratch + "/overlap_out.tif")
 
-    # convert landslide raster output to prepared landslide polygons
-    landslide_raster = Raster(scratch + "/overlap_out.tif")
-    ls_raster = SetNull(landslide_raster, landslide_raster, "VALUE <> 1")
+    # aggregate landslide cells closer than 70m into gullies in raster space, only gullies over 2500m2 are
+    # turned into polygons
+    gully_geoms = GullyEngine.gullyPolygons(scratch + "/overlap_out.tif", 70, 2500, srs=SegmentZS.featureSRS(network))
 
-    ls_poly = scratch + "/ls_poly.shp"
-    arcpy.RasterToPolygon_conversion(ls_raster, ls_poly, "SIMPLIFY")
-    ag_poly = scratch + "/ag_poly.shp"
-    arcpy.AggregatePolygons_cartography(ls_poly, ag_poly, 70, 2500)
-    arcpy.Near_analysis(ag_poly, network)
+    # gullies are dissolved by their nearest segment, found for all of them at once with an STRtree
+    segment_ids, segment_geoms = SegmentZS.readSegments(network, id_field)
+    gullies, near_fid, near_dist = SegmentGeometry.dissolveByNearest(gully_geoms, segment_geoms, segment_ids,
+                                                                     search_radius)
 
     # generate output file
     if not os.path.exists(os.path.dirname(dem) + "/Gullies"):
         os.mkdir(os.path.dirname(dem) + "/Gullies")
     output = os.path.dirname(dem) + "/Gullies/slide_gullies.shp"
-
-    arcpy.Dissolve_management(ag_poly, output, "NEAR_FID")
-    arcpy.AddField_management(output, "area_sqm", "DOUBLE")
-    arcpy.CalculateField_management(output, "area_sqm", "!SHAPE.AREA@SQUAREMETERS!", "PYTHON_9.3")
-    arcpy.DeleteField_management(output, "NEAR_FID")
-    arcpy.Near_analysis(output, network)
+    SegmentGeometry.writePolygons(output, gullies, network,
+                                  [("area_sqm", np.asarray([gully.area for gully in gullies], np.float64)),
+                                   ("NEAR_FID", near_fid),
+                                   ("NEAR_DIST", near_dist)])
 
     if not os.path.exists(os.path.dirname(dem) + "/TWI"):
         os.mkdir(os.path.dirname(dem) + "/TWI")
@@ -208,8 +253,6 @@ def slideGullies(network, dem, valley, scratch):
     arcpy.Delete_management(slope_clip)
     arcpy.Delete_management(slope_in)
     arcpy.Delete_management(twi_in)
-    arcpy.Delete_management(ls_poly)
-    arcpy.Delete_management(ag_poly)
     arcpy.Delete_management(scratch + "/overlap_out.tif")
     arcpy.Delete_management(scratch + "/slope.tif")
     arcpy.Delete_management(scratch + "/twi_norm.tif")
@@ -217,95 +260,72 @@ def slideGullies(network, dem, valley, scratch):
     return output
 
 
-def rasterToTable(network, raster, scratch):
-    """Applies the overlap raster of bps lwd and burn areas to network after conducting zonal stats"""
-
-    # make nodata values in raster 0s
-    raster = Con(IsNull(raster), 0, raster)
+def rasterToTable(network, raster, scratch, batch=True, workers=1, id_field="OID@"):
+    """Applies the overlap raster of bps lwd and burn areas to network after conducting zonal stats. Results
+    are keyed by the segment id field, the object id by default"""
 
     # raster resolution
-    rwidth = arcpy.Describe(raster).meanCellWidth
-    rheight = arcpy.Describe(raster).meanCellHeight
-    resolution = rwidth * rheight
-
-    # create arrays for fields in output network
-    lengtharray = np.asarray(arcpy.da.FeatureClassToNumPyArray(network, "FID"), np.int16)
-
-    oid = np.arange(0, len(lengtharray), 1)
-    sum_l = []
-
-    # apply functions to each segment of network to get desired output field values
-    cursor = arcpy.da.SearchCursor(network, "SHAPE@")
-    for row in cursor:
-        sval = SegmentZS.segmentSum(row[0], raster, "50 Meters", scratch)
-
-        sum_l.append(sval)
-
-    del row
-    del cursor
+    raster_path = raster
+    gt = gdal.Open(raster_path).GetGeoTransform()
+    resolution = abs(gt[1] * gt[5])
+
+    if batch:
+        # segment zones come from zone indexes cached in scratch, one per chunk of segments, neighbouring
+        # buffers share pixels
+        oid, sum_l, count_l, area_l = SegmentZS.chunkedSegmentStats(network, raster_path, 50, scratch,
+                                                                    id_field=id_field)
+    elif workers > 1:
+        # segment by segment on a process pool, each worker in its own scratch folder. The zonal sums skip
+        # nodata cells and a zone over nodata alone sums to 0, the same as the 0 filled raster below
+        oid, sum_l, area_l = SegmentZS.parallelSegmentStats(network, raster_path, "50 Meters", scratch, workers,
+                                                            id_field=id_field)
+    else:
+        # make nodata values in raster 0s (the batched stats skip nodata cells, which adds the same 0)
+        raster = Con(IsNull(raster), 0, raster)
+
+        # apply functions to each segment of network to get desired output field values, saving progress
+        # as it goes
+        oid, sum_l, area_l = SegmentZS.serialSegmentStats(network, raster, "50 Meters", scratch, raster_path,
+                                                          id_field, area=False)
 
     # create array for proportion burned
     sum_a = np.asarray(sum_l, np.float32)
     burn_area = np.multiply(sum_a, resolution)
 
-    columns = np.column_stack((oid, burn_area))
-    out_table = scratch + "/burn_table.txt"
-    np.savetxt(out_table, columns, delimiter=",", header="ID, BURN_AREA", comments="")
+    table = AttributeTable.AttributeTable(oid)
+    table.add("BURN_AREA", burn_area)
 
-    return
+    return table
 
 
 def gulliesSum(gullies, height, cover, scratch):
     """Stats for the variables within the slide gullies"""
 
-    arcpy.MakeFeatureLayer_management(gullies, "gullies_lyr")
-    arcpy.SelectLayerByAttribute_management("gullies_lyr", "NEW_SELECTION", '"NEAR_DIST" <= 250')
-    final_gullies = scratch + "/final_gullies.shp"
-    arcpy.CopyFeatures_management("gullies_lyr", final_gullies)
-
-    height_t = ZonalStatisticsAsTable(final_gullies, "NEAR_FID", height, "height_t", statistics_type="MEAN")
-    arcpy.JoinField_management(final_gullies, "NEAR_FID", height_t, "NEAR_FID", "MEAN")
-    arcpy.AddField_management(final_gullies, "VH_MEAN", "DOUBLE")
-    cursor = arcpy.da.UpdateCursor(final_gullies, ["MEAN", "VH_MEAN"])
-    for row in cursor:
-        row[1] = row[0]
-        cursor.updateRow(row)
-    del row
-    del cursor
-    arcpy.DeleteField_management(final_gullies, "MEAN")
-
-    cover_t = ZonalStatisticsAsTable(final_gullies, "NEAR_FID", cover, "cover_t", statistics_type="MEAN")
-    arcpy.JoinField_management(final_gullies, "NEAR_FID", cover_t, "NEAR_FID", "MEAN")
-    arcpy.AddField_management(final_gullies, "VC_MEAN", "DOUBLE")
-    cursor = arcpy.da.UpdateCursor(final_gullies, ["MEAN", "VC_MEAN"])
-    for row in cursor:
-        row[1] = row[0]
-        cursor.updateRow(row)
-    del row
-    del cursor
-    arcpy.DeleteField_management(final_gullies, "MEAN")
-
-    area_array = np.asarray(arcpy.da.FeatureClassToNumPyArray(final_gullies, "area_sqm"), np.float32)
-    area_norm = (area_array - area_array.min())/(area_array.max() - area_array.min())
-
-    dist_array = np.asarray(arcpy.da.FeatureClassToNumPyArray(final_gullies, "NEAR_DIST"), np.float32)
-    dist_norm = (dist_array - dist_array.min())/(dist_array.max() - dist_array.min())
-
-    vh_array = np.asarray(arcpy.da.FeatureClassToNumPyArray(final_gullies, "VC_MEAN"), np.float32)
-    vh_norm = (vh_array - vh_array.min())/(vh_array.max() - vh_array.min())
-
-    vc_array = np.asarray(arcpy.da.FeatureClassToNumPyArray(final_gullies, "VC_MEAN"), np.float32)
-    vc_norm = (vc_array - vc_array.min())/(vc_array.max() - vc_array.min())
+    # gullies within 250m of the network, selected in memory
+    columns, geoms = SegmentZS.readFeatures(gullies, ["NEAR_FID", "NEAR_DIST", "area_sqm"])
+    near = columns["NEAR_DIST"] <= GULLY_DISTANCE
+    near_fid_a = SegmentZS.segmentKeys(columns["NEAR_FID"][near])
+    geoms = [geom for geom, keep in zip(geoms, near) if keep]
 
-    final_a = (area_norm + dist_norm + vh_norm + vc_norm) / 4
+    # mean height and cover of every gully zone in one read of each raster
+    summary = SegmentZS.zoneSummary(near_fid_a, geoms, [height, cover], ["mean"], ["VH", "VC"],
+                                    SegmentZS.featureSRS(gullies))
+    position = np.searchsorted(summary["ID"], near_fid_a)
 
-    near_fid_a = np.asarray(arcpy.da.FeatureClassToNumPyArray(final_gullies, "NEAR_FID"), np.int32)
+    area_norm = StreamNormalize.minMaxScale(columns["area_sqm"][near])
 
-    columns = np.column_stack((near_fid_a, final_a))
-    out_table = scratch + "/gully_table.txt"
-    np.savetxt(out_table, columns, delimiter=",", header="ID, GULLIES", comments="")
+    dist_norm = StreamNormalize.minMaxScale(columns["NEAR_DIST"][near])
 
-    return
+    vh_norm = StreamNormalize.minMaxScale(summary["VH_MEAN"][position])
+
+    vc_norm = StreamNormalize.minMaxScale(summary["VC_MEAN"][position])
+
+    final_a = (area_norm + dist_norm + vh_norm + vc_norm) / 4
+
+    table = AttributeTable.AttributeTable(near_fid_a)
+    table.add("GULLIES", final_a)
+
+    return table
 
 
 if __name__ == '__main__':
@@ -11,12 +11,19 @@
 import arcpy
 from arcpy.sa import *
 import os
-from pygeoprocessing.routing import *
 import numpy as np
+import AttributeTable
+import Corridor
+import FireScenarios
+import GullyEngine
 import RasterOverlap
+import SegmentGeometry
+import SegmentZS
+import StreamNormalize
+import TerrainCache
 import sys
 
-def main(network, evh, evc, dem, firePoly, bps, scratch):
+def main(network, evh, evc, dem, firePoly, bps, scratch, corridor_only=False, id_field=None):
     """"""
 
     arcpy.env.overwriteOutput = True
@@ -32,189 +39,90 @@ def main(network, evh, evc, dem, firePoly, bps, scratch):
     if fireSR.type != "Projected":
         raise Exception("Input wildfire polygon must have a projected coordinate system")
 
-    # create thiessen polygons for analyses
-    midpoints = scratch + "/midpoints.shp"
-    arcpy.FeatureVerticesToPoints_management(network, midpoints, "MID")
-    thiessen = scratch + "/thiessen.shp"
-    arcpy.CreateThiessenPolygons_analysis(midpoints, thiessen)
-    buf_50 = scratch + "/buf_50.shp"
-    arcpy.Buffer_analysis(network, buf_50, "50 Meters", "", "FLAT")
-    thiessen_buf = scratch + "/thiessen_buf.shp"
-    arcpy.Clip_analysis(thiessen, buf_50, thiessen_buf)
+    # thiessen polygons of the segment midpoints clipped to the 50m flat ended buffers, built in memory
+    id_field = id_field or "OID@"
+    segment_ids, segment_geoms = SegmentZS.readSegments(network, id_field)
+    SegmentZS.uniqueKeys(segment_ids, id_field)
+    zones = SegmentGeometry.thiessenZones(segment_geoms, 50)
+    network_srs = SegmentZS.featureSRS(network)
 
     # generate raster that is the overlap between bps lwd species and burned areas, convert to 1s and 0s
     arcpy.AddMessage("fire raster")
-    fire_raster = fire_rasters(firePoly, bps, thiessen_buf, scratch)
+    corridor = None
+    if corridor_only:
+        corridor = Corridor.Corridor(zones, srs=network_srs)
+    fire_raster = fire_rasters(firePoly, bps, zones, scratch, corridor, network_srs)
 
     # summarize the above generated raster onto a table to be merged with network
     arcpy.AddMessage("fire raster to table")
-    rasterToTable(network, fire_raster, thiessen_buf)
-
-    arcpy.AddField_management(network, "BURN_PROP", "DOUBLE")
-    cursor = arcpy.da.UpdateCursor(network, ["BURN_AREA", "AREA", "BURN_PROP"])
-    for row in cursor:
-        row[2] = row[0] / row[1]
-        cursor.updateRow(row)
-        if row[2] > 1:
-            row[2] = 1
-        cursor.updateRow(row)
-    del row
-    del cursor
+    table = rasterToTable(network, fire_raster, segment_ids, zones, network_srs)
+    table.join(AttributeTable.AttributeTable.fromFeatures(network, ["AREA"], id_field))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        table.add("BURN_PROP", np.minimum(table["BURN_AREA"] / table["AREA"], 1))
+    table.write(network, ["BURN_AREA", "BURN_PROP"], id_field)
 
     # identify slide gullies
     arcpy.AddMessage("gullies")
-    slideGullies(dem, network, scratch)
+    slideGullies(dem, network, scratch, id_field=id_field)
 
     # get stats within the gullies
     arcpy.AddMessage("gully stats")
     gullies = os.path.dirname(dem) + "/Gullies/slide_gullies.shp"
     height = os.path.dirname(os.path.dirname(evh)) + "/Height_Rasters/total_height.tif"
     cover = os.path.dirname(os.path.dirname(evc)) + "/Cover/total_cover.tif"
-    gulliesSum(gullies, height, cover, scratch)
+    gully_table = gulliesSum(gullies, height, cover, scratch)
 
-    # merge table onto network
+    # merge table onto network, segments without a gully are left null
     arcpy.AddMessage("merge gully table")
-    gully_table = scratch + "/gully_table.txt"
-    gully_table_out = scratch + "/gully_table_out.dbf"
-    arcpy.CopyRows_management(gully_table, gully_table_out)
-    arcpy.JoinField_management(network, "FID", gully_table_out, "ID", "GULLIES")
+    gully_table.write(network, ["GULLIES"], id_field)
 
     arcpy.CheckInExtension('spatial')
 
     return
 
 
-def fire_rasters(firePoly, bps, thiessen_buf, scratch):
+def fire_rasters(firePoly, bps, zones, scratch, corridor=None, zones_srs=None):
     """Identify areas where wildfire contributes to LWD recruitment"""
 
-    # raster of fire polygon
-    outds = scratch + "/temp_burn_raster.tif"
-    cellsz = arcpy.Describe(bps).meanCellWidth
-    # arcpy.env.extent = network
-    arcpy.PolygonToRaster_conversion(firePoly, "FID", outds, cellsize=cellsz)
-    burn_raster = scratch + "/burn_raster.tif"
-    arcpy.CopyRaster_management(outds, burn_raster, nodata_value=225)
-    arcpy.Delete_management(outds)
-
-    # derive a potential lwd layer from landfire BpS
-    lfevh = arcpy.ListFields(bps, "LWD")
-    if len(lfevh) == 1:
-        arcpy.DeleteField_management(bps, "LWD")
-    arcpy.AddField_management(bps, "LWD", "SHORT")
-    cursor = arcpy.da.UpdateCursor(bps, ["GROUPVEG", "LWD"])
-    for row in cursor:
-        if row[0] == "PerennialIce/Snow":
-            row[1] = 0
-        elif row[0] == "Barren-Rock/Sand/Clay":
-            row[1] = 0
-        elif row[0] == "Conifer":
-            row[1] = 1
-        elif row[0] == "Conifer-Hardwood":
-            row[1] = 1
-        elif row[0] == "Grassland":
-            row[1] = 0
-        elif row[0] == "Hardwood":
-            row[1] = 1
-        elif row[0] == "Hardwood-Conifer":
-            row[1] = 1
-        elif row[0] == "Peatland Forest":
-            row[1] = 0
-        elif row[0] == "Peatland non-forest":
-            row[1] = 0
-        elif row[0] == "Riparian":
-            row[1] = 0
-        elif row[0] == "Savanna":
-            row[1] = 0
-        elif row[0] == "Sparse":
-            row[1] = 0
-        else:
-            row[1] = 0
-        cursor.updateRow(row)
-    del row
-    del cursor
-
-    bps_lookup = Lookup(bps, "LWD")
-    bps_lwd_temp = ExtractByMask(bps_lookup, thiessen_buf)
-    bps_lwd_temp2 = scratch + "/bps_lwd_temp2.tif"
-    arcpy.Clip_management(bps_lwd_temp, "", bps_lwd_temp2, burn_raster,
-                          arcpy.Describe(bps).noDataValue, "", "MAINTAIN_EXTENT")
-
-    bps_lwd_temp3 = SetNull(bps_lwd_temp2, bps_lwd_temp2, "VALUE = 0")
-
-    if not os.path.exists(os.path.dirname(os.path.dirname(bps)) + "/BPS_LWD"):
-        os.mkdir(os.path.dirname(os.path.dirname(bps)) + "/BPS_LWD")
-    bps_lwd_raster = os.path.dirname(os.path.dirname(bps)) + "/BPS_LWD/bps_lwd.tif"
-    arcpy.CopyRaster_management(bps_lwd_temp3, bps_lwd_raster, nodata_value=127)
-
-    # raster overlap output and function
+    # the fire polygons and the thiessen zones are burned in memory on the BpS grid, within the zones'
+    # extent, and combined with the BpS LWD lookup block by block
+    fire_ids, fire_geoms = SegmentZS.readSegments(firePoly)
+
+    # raster overlap output
     if not os.path.exists(os.path.dirname(firePoly) + "/LWD_Burn"):
         os.mkdir(os.path.dirname(firePoly) + "/LWD_Burn")
     bps_burn_overlap = os.path.dirname(firePoly) + "/LWD_Burn/lwd_burn.tif"
 
-    RasterOverlap.RasterOverlap(bps_lwd_raster, burn_raster, bps_burn_overlap)
+    FireScenarios.lwdBurnRaster(bps, fire_geoms, zones, bps_burn_overlap, corridor, SegmentZS.featureSRS(firePoly),
+                                zones_srs)
 
     return bps_burn_overlap
 
 
-def rasterToTable(network, raster, thiessen_buf):
+def rasterToTable(network, raster, segment_ids, zones, zones_srs=None):
     """Applies the overlap raster of bps lwd and burn areas to network after conducting zonal stats"""
 
-    # make nodata values in raster 0s
-    raster = Con(IsNull(raster), 0, raster)
-
     # raster resolution
     rwidth = arcpy.Describe(raster).meanCellWidth
     rheight = arcpy.Describe(raster).meanCellHeight
     resolution = rwidth * rheight
 
-    # zonal stats
-    burn_sum_t = ZonalStatisticsAsTable(thiessen_buf, "Input_FID", raster, "burn_sum_t", statistics_type="SUM")
-    arcpy.AddField_management(burn_sum_t, "BURN_AREA", "DOUBLE")
-    cursor = arcpy.da.UpdateCursor(burn_sum_t, ["SUM", "BURN_AREA"])
-    for row in cursor:
-        row[1] = row[0] * resolution
-        cursor.updateRow(row)
-    del row
-    del cursor
-    arcpy.JoinField_management(network, "FID", burn_sum_t, "Input_FID", "BURN_AREA")
+    # zonal sums over the in-memory thiessen zones, nodata cells add nothing as if they were 0s. The zones
+    # do not overlap so one rasterization covers them all
+    sums, counts = SegmentZS.batchZonalStats(zones, raster, srs=zones_srs)
+    table = AttributeTable.AttributeTable(segment_ids)
+    table.add("BURN_AREA", sums * resolution)
 
-    return
+    return table
 
 
-def slideGullies(dem, network, scratch):
+def slideGullies(dem, network, scratch, search_radius=None, id_field="OID@"):
     """"""
 
-    # find input DEM resolution
-    cellHeight = arcpy.Describe(dem).meanCellHeight
-    cellWidth = arcpy.Describe(dem).meanCellWidth
-    resolution = cellHeight * cellWidth
-    ndvalue = arcpy.Describe(dem).noDataValue
-
-    # derive d-infinity flow accumulation raster from DEM
-    filledDEM = Fill(dem)
-    arcpy.CopyRaster_management(filledDEM, scratch + "/fill.tif", nodata_value=ndvalue)
-
-    fill = scratch + "/fill.tif"
-    fd = scratch + "/fd.tif"
-    fa = scratch + "/fa.tif"
-
-    flow_direction_d_inf(fill, fd)
-    flow_accumulation(fd, fill, fa)
-
-    # convert the flow accumulation raster into drainage area raster
-    fa = Raster(scratch + "/fa.tif")
-    dr_area = fa * resolution / 1000000
-    if not os.path.exists(os.path.dirname(dem) + "/Flow"):
-        os.mkdir(os.path.dirname(dem) + "/Flow")
-    dr_area.save(os.path.dirname(dem) + "/Flow/DrainArea_sqkm.tif")
-
-    # find slope
-    slope_deg = Slope(dem, "DEGREE")
-
-    if not os.path.exists(os.path.dirname(dem) + "/Slope"):
-        os.mkdir(os.path.dirname(dem) + "/Slope")
-    arcpy.CopyRaster_management(slope_deg, os.path.dirname(dem) + "/Slope/slope_deg.tif",
-                                nodata_value=arcpy.Describe(dem).noDataValue)
+    # drainage area and slope come from the terrain cache shared with the other tools
+    terrain = TerrainCache.TerrainCache(dem)
+    dr_area = Raster(terrain.drainageArea())
+    slope_deg = Raster(terrain.slope("DEGREE"))
 
     # reclassify dr area and slope to threshold values
     dr_area_thresh = Reclassify(dr_area, "VALUE", "0 0.045 NODATA; 0.045 100000 1")
@@ -229,80 +137,54 @@ def slideGullies(dem, network, scratch):
     in2 = scratch + "/slope_thresh.tif"
     RasterOverlap.RasterOverlap(in1, in2, scratch + "/overlap.tif")
 
-    # convert landslide raster output to prepared landslide polygons
-    landslide_raster = Raster(scratch + "/overlap.tif")
-    ls_raster = SetNull(landslide_raster, landslide_raster, "VALUE <> 1")
+    # aggregate landslide cells closer than 70m into gullies in raster space, only gullies over 5000m2 are
+    # turned into polygons
+    gully_geoms = GullyEngine.gullyPolygons(scratch + "/overlap.tif", 70, 5000, srs=SegmentZS.featureSRS(network))
 
-    ls_poly = scratch + "/ls_poly.shp"
-    arcpy.RasterToPolygon_conversion(ls_raster, ls_poly, "SIMPLIFY")
-    ag_poly = scratch + "/ag_poly.shp"
-    arcpy.AggregatePolygons_cartography(ls_poly, ag_poly, 70, 5000)
-    arcpy.Near_analysis(ag_poly, network)
+    # gullies are dissolved by their nearest segment, found for all of them at once with an STRtree
+    segment_ids, segment_geoms = SegmentZS.readSegments(network, id_field)
+    gullies, near_fid, near_dist = SegmentGeometry.dissolveByNearest(gully_geoms, segment_geoms, segment_ids,
+                                                                     search_radius)
 
     # generate output file
     if not os.path.exists(os.path.dirname(dem) + "/Gullies"):
         os.mkdir(os.path.dirname(dem) + "/Gullies")
     output = os.path.dirname(dem) + "/Gullies/slide_gullies.shp"
-
-    arcpy.Dissolve_management(ag_poly, output, "NEAR_FID")
-    arcpy.AddField_management(output, "area_sqm", "DOUBLE")
-    arcpy.CalculateField_management(output, "area_sqm", "!SHAPE.AREA@SQUAREMETERS!", "PYTHON_9.3")
-    arcpy.DeleteField_management(output, "NEAR_FID")
-    arcpy.Near_analysis(output, network)
+    SegmentGeometry.writePolygons(output, gullies, network,
+                                  [("area_sqm", np.asarray([gully.area for gully in gullies], np.float64)),
+                                   ("NEAR_FID", near_fid),
+                                   ("NEAR_DIST", near_dist)])
 
     return output
 
 def gulliesSum(gullies, height, cover, scratch):
     """Stats for the variables within the slide gullies"""
 
-    arcpy.MakeFeatureLayer_management(gullies, "gullies_lyr")
-    arcpy.SelectLayerByAttribute_management("gullies_lyr", "NEW_SELECTION", '"NEAR_DIST" <= 250')
-    final_gullies = scratch + "/final_gullies.shp"
-    arcpy.CopyFeatures_management("gullies_lyr", final_gullies)
-
-    height_t = ZonalStatisticsAsTable(final_gullies, "NEAR_FID", height, "height_t", statistics_type="MEAN")
-    arcpy.JoinField_management(final_gullies, "NEAR_FID", height_t, "NEAR_FID", "MEAN")
-    arcpy.AddField_management(final_gullies, "VH_MEAN", "DOUBLE")
-    cursor = arcpy.da.UpdateCursor(final_gullies, ["MEAN", "VH_MEAN"])
-    for row in cursor:
-        row[1] = row[0]
-        cursor.updateRow(row)
-    del row
-    del cursor
-    arcpy.DeleteField_management(final_gullies, "MEAN")
-
-    cover_t = ZonalStatisticsAsTable(final_gullies, "NEAR_FID", cover, "cover_t", statistics_type="MEAN")
-    arcpy.JoinField_management(final_gullies, "NEAR_FID", cover_t, "NEAR_FID", "MEAN")
-    arcpy.AddField_management(final_gullies, "VC_MEAN", "DOUBLE")
-    cursor = arcpy.da.UpdateCursor(final_gullies, ["MEAN", "VC_MEAN"])
-    for row in cursor:
-        row[1] = row[0]
-        cursor.updateRow(row)
-    del row
-    del cursor
-    arcpy.DeleteField_management(final_gullies, "MEAN")
-
-    area_array = np.asarray(arcpy.da.FeatureClassToNumPyArray(final_gullies, "area_sqm"), np.float32)
-    area_norm = (area_array - area_array.min())/(area_array.max() - area_array.min())
-
-    dist_array = np.asarray(arcpy.da.FeatureClassToNumPyArray(final_gullies, "NEAR_DIST"), np.float32)
-    dist_norm = (dist_array - dist_array.min())/(dist_array.max() - dist_array.min())
-
-    vh_array = np.asarray(arcpy.da.FeatureClassToNumPyArray(final_gullies, "VC_MEAN"), np.float32)
-    vh_norm = (vh_array - vh_array.min())/(vh_array.max() - vh_array.min())
-
-    vc_array = np.asarray(arcpy.da.FeatureClassToNumPyArray(final_gullies, "VC_MEAN"), np.float32)
-    vc_norm = (vc_array - vc_array.min())/(vc_array.max() - vc_array.min())
+    # gullies within 250m of the network, selected in memory
+    columns, geoms = SegmentZS.readFeatures(gullies, ["NEAR_FID", "NEAR_DIST", "area_sqm"])
+    near = columns["NEAR_DIST"] <= 250
+    near_fid_a = SegmentZS.segmentKeys(columns["NEAR_FID"][near])
+    geoms = [geom for geom, keep in zip(geoms, near) if keep]
 
-    final_a = (area_norm + dist_norm + vh_norm + vc_norm) / 4
+    # mean height and cover of every gully zone in one read of each raster
+    summary = SegmentZS.zoneSummary(near_fid_a, geoms, [height, cover], ["mean"], ["VH", "VC"],
+                                    SegmentZS.featureSRS(gullies))
+    position = np.searchsorted(summary["ID"], near_fid_a)
 
-    near_fid_a = np.asarray(arcpy.da.FeatureClassToNumPyArray(final_gullies, "NEAR_FID"), np.int32)
+    area_norm = StreamNormalize.minMaxScale(columns["area_sqm"][near])
 
-    columns = np.column_stack((near_fid_a, final_a))
-    out_table = scratch + "/gully_table.txt"
-    np.savetxt(out_table, columns, delimiter=",", header="ID, GULLIES", comments="")
+    dist_norm = StreamNormalize.minMaxScale(columns["NEAR_DIST"][near])
 
-    return
+    vh_norm = StreamNormalize.minMaxScale(summary["VH_MEAN"][position])
+
+    vc_norm = StreamNormalize.minMaxScale(summary["VC_MEAN"][position])
+
+    final_a = (area_norm + dist_norm + vh_norm + vc_norm) / 4
+
+    table = AttributeTable.AttributeTable(near_fid_a)
+    table.add("GULLIES", final_a)
+
+    return table
 
 
 if __name__ == '__main__':
@@ -0,0 +1,133 @@
+# # # Burned LWD area of network segments for one or many fire perimeters # # #
+
+# fire polygons are burned in memory on the BpS grid and combined with the BpS LWD lookup as blocks are
+# read. For many fire perimeters everything that does not depend on the fire (the BpS LWD mask and the
+# segment zones) is prepared once, then each scenario is burned over its own extent of the BpS grid and only
+# the cells of the zone index inside that extent are looked at
+
+from osgeo import gdal
+import io
+import numpy as np
+import Corridor
+import LandfireLUT
+import RasterBlocks
+
+# nodata of the lwd burn raster, as CopyRaster gave the BpS LWD layer before
+LWD_BURN_NODATA = 127
+
+# text type of scenario names, arcpy hands out unicode field values under python 2
+try:
+    TEXT_TYPE = unicode
+except NameError:
+    TEXT_TYPE = str
+
+
+def boundsWindow(geotransform, shape, geoms):
+    """Window of a grid covering the bounding box of some polygons, None if they miss the grid"""
+    rows, cols = shape
+    bounds = np.asarray([geom.bounds for geom in geoms], np.float64).reshape(-1, 4)
+    if len(bounds) == 0:
+        return None
+    x0 = int(np.floor((bounds[:, 0].min() - geotransform[0]) / geotransform[1]))
+    x1 = int(np.ceil((bounds[:, 2].max() - geotransform[0]) / geotransform[1]))
+    y0 = int(np.floor((bounds[:, 3].max() - geotransform[3]) / geotransform[5]))
+    y1 = int(np.ceil((bounds[:, 1].min() - geotransform[3]) / geotransform[5]))
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, cols), min(y1, rows)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def lwdBurnRaster(bps, fire_geoms, mask_geoms, output, corridor=None, fire_srs=None, mask_srs=None):
+    """Writes 1 where a BpS cell can supply LWD, lies inside the mask polygons (the network zones) and
+    burned, nodata everywhere else. The raster covers the mask's extent of the BpS grid and is written in
+    one pass, the fire and mask polygons are burned in memory block by block. Polygons in another coordinate
+    system (fire_srs, mask_srs) are projected to the BpS raster's"""
+    bpsDS = gdal.Open(bps)
+    band = bpsDS.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    gt = bpsDS.GetGeoTransform()
+    projection = bpsDS.GetProjection()
+    lut = LandfireLUT.buildLUT(bps, "GROUPVEG", LandfireLUT.LWD)
+    fire_geoms = RasterBlocks.projectGeoms(fire_geoms, fire_srs, projection)
+    mask_geoms = RasterBlocks.projectGeoms(mask_geoms, mask_srs, projection)
+
+    window = boundsWindow(gt, (bpsDS.RasterYSize, bpsDS.RasterXSize), mask_geoms)
+    if window is None:
+        raise Exception("The network does not overlap the BpS raster")
+    xoff, yoff, xsize, ysize = window
+    out_gt = RasterBlocks.windowTransform(gt, xoff, yoff)
+    outDS = RasterBlocks.createGrid(output, out_gt, projection, xsize, ysize, gdal.GDT_Int16, LWD_BURN_NODATA,
+                                    corridor is not None)
+    outBand = outDS.GetRasterBand(1)
+
+    mask = RasterBlocks.zoneLayer(mask_geoms, np.ones(len(mask_geoms), np.int64), projection)
+    fire = RasterBlocks.zoneLayer(fire_geoms, np.ones(len(fire_geoms), np.int64), projection)
+    for x, y, w, h in Corridor.windows(outDS, corridor):
+        lwd = LandfireLUT.applyLUT(lut, band.ReadAsArray(xoff + x, yoff + y, w, h), nodata) == 1
+        inside = RasterBlocks.rasterizeWindow(mask, out_gt, projection, x, y, w, h) > 0
+        burned = RasterBlocks.rasterizeWindow(fire, out_gt, projection, x, y, w, h) > 0
+        result = np.full((h, w), LWD_BURN_NODATA, np.int16)
+        result[lwd & inside & burned] = 1
+        outBand.WriteArray(result, x, y)
+    outBand.FlushCache()
+
+    return output
+
+
+class FireBatch:
+    """Segment zone index on the BpS grid together with the LWD value of every indexed cell"""
+
+    def __init__(self, index, lwd_raster):
+        self.index = index
+        values, valid = index.gather(lwd_raster)
+        self.lwd = valid & (values == 1)
+        self.zone = index.zoneOf()
+        gt = index.geotransform
+        self.cell_area = abs(gt[1] * gt[5])
+
+    def burnArea(self, geoms, srs=None):
+        """Area of LWD producing cells inside the fire polygons (in the coordinate system srs) for every zone
+        of the index"""
+        n = len(self.index.ids)
+        geoms = RasterBlocks.projectGeoms(geoms, srs, self.index.projection)
+        window = boundsWindow(self.index.geotransform, self.index.shape, geoms)
+        if window is None:
+            return np.zeros(n)
+
+        fire = RasterBlocks.zoneLayer(geoms, np.ones(len(geoms), np.int64), self.index.projection)
+        burned = RasterBlocks.rasterizeWindow(fire, self.index.geotransform, self.index.projection, *window) > 0
+        entries, r, c = self.index.window(*window)
+        hit = entries[burned[r, c] & self.lwd[entries]]
+        sums = np.bincount(self.zone[hit], weights=self.index.weights[hit].astype(np.float64), minlength=n)
+
+        return sums * self.cell_area
+
+
+def writeTable(path, ids, areas, results, layout="wide"):
+    """Writes the BURN_AREA and BURN_PROP of every scenario, a list of (name, burn areas) pairs, as a csv
+    table in UTF-8. wide has one pair of columns per scenario, long one row per segment and scenario"""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        props = [burn / areas for name, burn in results]
+
+    with io.open(path, "w", encoding="utf-8") as f:
+        if layout == "wide":
+            header = ["ID"]
+            for name, burn in results:
+                header += [name + "_BURN_AREA", name + "_BURN_PROP"]
+            f.write(TEXT_TYPE(",".join(header) + "\n"))
+            for i in range(len(ids)):
+                row = [str(ids[i])]
+                for (name, burn), prop in zip(results, props):
+                    row += [repr(float(burn[i])), repr(float(prop[i]))]
+                f.write(TEXT_TYPE(",".join(row) + "\n"))
+        elif layout == "long":
+            f.write(TEXT_TYPE("SCENARIO,ID,BURN_AREA,BURN_PROP\n"))
+            for (name, burn), prop in zip(results, props):
+                for i in range(len(ids)):
+                    f.write(TEXT_TYPE(",".join([name, str(ids[i]), repr(float(burn[i])), repr(float(prop[i]))]) + "\n"))
+        else:
+            raise Exception("Unknown table layout " + layout)
+
+    return path
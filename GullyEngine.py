@@ -0,0 +1,190 @@
+# # # Slide gully delineation in raster space # # #
+
+# candidate gully cells are closed morphologically to join cells closer than the aggregation distance (what
+# AggregatePolygons does to the polygons), labeled into connected components and filtered by area, all on
+# arrays. Only the components that survive are turned into polygons. The raster is worked through in tiles read
+# with a halo of the aggregation distance, components that cross tile edges are joined with a union-find, so
+# memory is bounded by the tile size and not by the raster size
+
+from osgeo import gdal, ogr, osr
+from scipy import ndimage
+from shapely import wkb
+from shapely.ops import unary_union
+import numpy as np
+import RasterBlocks
+
+# side of the tiles the candidate raster is closed and labeled in
+TILE_SIZE = 2048
+
+
+def closeMask(mask, distance, cell_width, cell_height):
+    """Morphological closing of a boolean array with a disk of diameter distance (map units). Done with
+    two euclidean distance transforms so the cost does not grow with the disk size"""
+    radius = distance / 2.0
+    pad = int(np.ceil(radius / min(cell_width, cell_height))) + 1
+    padded = np.pad(mask, pad, mode="constant", constant_values=False)
+    if not padded.any():
+        return mask.copy()
+    dilated = ndimage.distance_transform_edt(~padded, sampling=(cell_height, cell_width)) <= radius
+    del padded
+    closed = ndimage.distance_transform_edt(dilated, sampling=(cell_height, cell_width)) > radius
+    return closed[pad:-pad, pad:-pad] | mask
+
+
+def tileWindows(xsize, ysize, tile_size):
+    """Rows of (xoff, yoff, xsize, ysize) tiles covering a grid"""
+    return [[(xoff, yoff, min(tile_size, xsize - xoff), min(tile_size, ysize - yoff))
+             for xoff in range(0, xsize, tile_size)]
+            for yoff in range(0, ysize, tile_size)]
+
+
+def closedTile(band, nodata, window, distance, cell_width, cell_height):
+    """Closed candidate mask of a tile. It is read with a halo of the closing diameter, so the result is the
+    same as closing the whole raster"""
+    xoff, yoff, xsize, ysize = window
+    halo = int(np.ceil(distance / min(cell_width, cell_height))) + 1
+    x0 = max(xoff - halo, 0)
+    y0 = max(yoff - halo, 0)
+    x1 = min(xoff + xsize + halo, band.XSize)
+    y1 = min(yoff + ysize + halo, band.YSize)
+    values = band.ReadAsArray(x0, y0, x1 - x0, y1 - y0)
+    mask = RasterBlocks.validMask(values, nodata) & (values == 1)
+    del values
+    closed = closeMask(mask, distance, cell_width, cell_height)
+    return closed[yoff - y0:yoff - y0 + ysize, xoff - x0:xoff - x0 + xsize]
+
+
+def edgePairs(a, b):
+    """Pairs of labels 8-connected across a tile edge, a and b being the cells on either side of it"""
+    pairs = []
+    for shift in (-1, 0, 1):
+        x = a[max(shift, 0):len(a) + min(shift, 0)]
+        y = b[max(-shift, 0):len(b) + min(-shift, 0)]
+        hit = (x > 0) & (y > 0)
+        pairs.append(np.stack([x[hit], y[hit]], 1))
+    return np.concatenate(pairs)
+
+
+def gullyTiles(band, cell_width, cell_height, aggregation_distance=70, min_area=2500, tile_size=TILE_SIZE):
+    """Yields (xoff, yoff, labels) for the tiles of a candidate band (cells equal to 1) that hold aggregated
+    gullies of at least min_area. Labels are Int32, numbered from 1 across the whole raster, 0 elsewhere"""
+    nodata = band.GetNoDataValue()
+    structure = np.ones((3, 3), bool)
+    tiles = tileWindows(band.XSize, band.YSize, tile_size)
+
+    # first pass, components of every tile are numbered after those of the tiles before it. Only their cell
+    # counts and the labels along the tile edges are kept
+    offsets = {}
+    sizes = {}
+    counts = [np.zeros(1, np.int64)]
+    edges = {}
+    total = 0
+    for r, row in enumerate(tiles):
+        for c, window in enumerate(row):
+            labels, count = ndimage.label(closedTile(band, nodata, window, aggregation_distance, cell_width,
+                                                     cell_height), structure=structure)
+            offsets[r, c] = total
+            sizes[r, c] = count
+            counts.append(np.bincount(labels.ravel(), minlength=count + 1)[1:])
+            labels = np.where(labels > 0, labels + total, 0)
+            edges[r, c] = (labels[0], labels[-1], labels[:, 0], labels[:, -1])
+            total += count
+
+    # components that touch across a tile edge or corner are joined
+    pairs = [np.zeros((0, 2), np.int64)]
+    for r, c in edges:
+        top, bottom, left, right = edges[r, c]
+        if (r, c + 1) in edges:
+            pairs.append(edgePairs(right, edges[r, c + 1][2]))
+        if (r + 1, c) in edges:
+            pairs.append(edgePairs(bottom, edges[r + 1, c][0]))
+        if (r + 1, c + 1) in edges:
+            pairs.append(edgePairs(bottom[-1:], edges[r + 1, c + 1][0][:1]))
+        if (r + 1, c - 1) in edges:
+            pairs.append(edgePairs(bottom[:1], edges[r + 1, c - 1][0][-1:]))
+    del edges
+
+    parent = np.arange(total + 1)
+
+    def find(label):
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    for a, b in np.unique(np.concatenate(pairs), axis=0).tolist():
+        a = find(a)
+        b = find(b)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+    while True:
+        roots = parent[parent]
+        if np.array_equal(roots, parent):
+            break
+        parent = roots
+
+    areas = np.bincount(parent, weights=np.concatenate(counts), minlength=total + 1) * cell_width * cell_height
+    keep = areas >= min_area
+    keep[0] = False
+    renumber = np.zeros(total + 1, np.int32)
+    renumber[keep] = np.arange(1, keep.sum() + 1)
+    final = renumber[parent]
+
+    # second pass, only the tiles holding surviving components are labeled again
+    for r, row in enumerate(tiles):
+        for c, window in enumerate(row):
+            offset = offsets[r, c]
+            if not final[offset + 1:offset + sizes[r, c] + 1].any():
+                continue
+            labels, count = ndimage.label(closedTile(band, nodata, window, aggregation_distance, cell_width,
+                                                     cell_height), structure=structure)
+            yield window[0], window[1], final[np.where(labels > 0, labels + offset, 0)]
+
+
+def labelParts(labels, geotransform, projection=""):
+    """Polygons of the nonzero labels of an array, as a dict of shapely polygon lists by label"""
+    rows, cols = labels.shape
+    memDS = gdal.GetDriverByName("MEM").Create("", cols, rows, 1, gdal.GDT_Int32)
+    memDS.SetGeoTransform(geotransform)
+    if projection:
+        memDS.SetProjection(projection)
+    band = memDS.GetRasterBand(1)
+    band.WriteArray(labels.astype(np.int32))
+    band.SetNoDataValue(0)
+
+    srs = None
+    if projection:
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(projection)
+    source = ogr.GetDriverByName("Memory").CreateDataSource("gullies")
+    layer = source.CreateLayer("gullies", srs, ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn("GULLY", ogr.OFTInteger))
+    gdal.Polygonize(band, band.GetMaskBand(), layer, 0, ["8CONNECTED=8"])
+
+    parts = {}
+    for feature in layer:
+        parts.setdefault(feature.GetField("GULLY"), []).append(wkb.loads(bytes(feature.GetGeometryRef().ExportToWkb())))
+    source = None
+    memDS = None
+
+    return parts
+
+
+def gullyPolygons(candidates, aggregation_distance=70, min_area=2500, tile_size=TILE_SIZE, srs=None):
+    """Polygons of the aggregated gullies of a candidate raster (cells equal to 1), one (multi)polygon per gully.
+    They are projected to the coordinate system srs when it is given"""
+    candidateDS = gdal.Open(candidates)
+    band = candidateDS.GetRasterBand(1)
+    gt = candidateDS.GetGeoTransform()
+    projection = candidateDS.GetProjection()
+
+    # gullies that cross tile edges are polygonized piece by piece and the pieces unioned
+    parts = {}
+    for xoff, yoff, labels in gullyTiles(band, abs(gt[1]), abs(gt[5]), aggregation_distance, min_area,
+                                         tile_size):
+        for label, polygons in labelParts(labels, RasterBlocks.windowTransform(gt, xoff, yoff),
+                                          projection).items():
+            parts.setdefault(label, []).extend(polygons)
+
+    gullies = [unary_union(parts[label]) for label in sorted(parts)]
+    return RasterBlocks.projectGeoms(gullies, projection, srs)
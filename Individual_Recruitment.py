@@ -14,7 +14,11 @@
 import arcpy
 from arcpy.sa import *
 import numpy as np
+import AttributeTable
+import Checkpoint
+import Corridor
 import SegmentZS
+import ProbabilityKernel
 import os
 import sys
 import datetime
@@ -22,8 +26,10 @@ import uuid
 import projectxml
 
 
-def main(projectFolder, projName, hucID, hucName, network, evh, evc, bankfull, dem, scratch):
-    """Creates a network output for probability of individual LWD recruitment"""
+def main(projectFolder, projName, hucID, hucName, network, evh, evc, bankfull, dem, scratch, corridor_only=False,
+         id_field=None, workers=2, zonal_stats="batched"):
+    """Creates a network output for probability of individual LWD recruitment. zonal_stats is one of
+    SegmentZS.ZONAL_STATS"""
 
     arcpy.env.overwriteOutput = True
     arcpy.CheckOutExtension("spatial")
@@ -40,13 +46,27 @@ def main(projectFolder, projName, hucID, hucName, network, evh, evc, bankfull, d
     if bankfullSR.type != "Projected":
         raise Exception("Input bankfull channel must have a projected coordinate system")
 
+    # how the probability is summarized over the segments, checked before anything runs
+    id_field = id_field or "OID@"
+    options = SegmentZS.zonalStatsOptions(zonal_stats, workers)
+    options["id_field"] = id_field
+
+    # only the 50m segment buffers are summarized, so the rasters can be limited to the tiles they touch
+    corridor = None
+    if corridor_only:
+        network_ids, network_geoms = SegmentZS.readSegments(network)
+        corridor = Corridor.Corridor(SegmentZS.bufferSegments(network_geoms, 50), srs=SegmentZS.featureSRS(network))
+
     # generate raster of individual recruitment probability
     arcpy.AddMessage("Creating probability raster")
-    individual_raster = prob_raster(evh, evc, bankfull, dem, scratch)
+    # stages whose inputs did not change since a run that stopped part way are skipped
+    checkpoints = Checkpoint.Checkpoints(scratch)
+    individual_raster = prob_raster(evh, evc, bankfull, dem, scratch, corridor, workers, checkpoints)
 
     # create a table from raster to merge with network
     arcpy.AddMessage("Creating probability table from raster")
-    rasterToTable(network, individual_raster, scratch)
+    table, skipped = checkpoints.run("probability table", rasterToTable,
+                                     (network, scratch + "/individual_probability.tif", scratch), options)
 
     # merge table with network for final output
     arcpy.AddMessage("Merging table to netwrok")
@@ -55,17 +75,15 @@ def main(projectFolder, projName, hucID, hucName, network, evh, evc, bankfull, d
         j += 1
     os.mkdir(projectFolder + "/02_Analyses/Output_" + str(j))
 
-    table = scratch + "/out_table.txt"
-    out_table = projectFolder + "/02_Analyses/Output_" + str(j) + "/out_table.dbf"
-
     individual_raster.save(projectFolder + "/02_Analyses/Output_" + str(j) + "/probability_raster.tif")
     out_network = projectFolder + "/02_Analyses/Output_" + str(j) + "/recruitment_prob.shp"
     arcpy.CopyFeatures_management(network, out_network)
 
-    arcpy.CopyRows_management(table, out_table)
-    arcpy.JoinField_management(out_network, "FID", out_table, "ID", ["SUM", "AREA", "REL_PROB", "NORM_PROB"])
-
-    arcpy.Delete_management(projectFolder + "/02_Analyses/Output_" + str(j) + "/out_table.dbf")
+    # the copy numbers its features again from 0, object ids of a geodatabase network start at 1 and can
+    # have gaps. Both are read in cursor order, which the copy keeps, and the results moved to the copy's ids
+    if id_field == "OID@":
+        table = table.rekey(AttributeTable.featureIds(network), AttributeTable.featureIds(out_network))
+    table.write(out_network, ["SUM", "AREA", "REL_PROB", "NORM_PROB"], id_field)
 
     arcpy.CheckInExtension("spatial")
 
@@ -119,166 +137,77 @@ def main(projectFolder, projName, hucID, hucName, network, evh, evc, bankfull, d
 
     newxml.write()
 
-    return
-
-
-def prob_raster(evh, evc, bankfull, dem, scratch):
-    """Creates a raster output for probability of individual LWD recruitment"""
-
-    # derive a 10m tree height raster from LANDFIRE EVH layer
-    lfevh = arcpy.ListFields(evh, "MAX_HEIGHT")
-    if len(lfevh) == 1:
-        arcpy.DeleteField_management(evh, "MAX_HEIGHT")
-    arcpy.AddField_management(evh, "MAX_HEIGHT", "SHORT")
-    cursor = arcpy.da.UpdateCursor(evh, ["CLASSNAMES", "MAX_HEIGHT"])
-    for row in cursor:
-        if row[0] == "Forest Height 0 to 5 meters":
-            row[1] = 5
-        elif row[0] == "Forest Height 5 t0 10 meters":
-            row[1] = 10
-        elif row[0] == "Forest Height 10 to 25 meters":
-            row[1] = 25
-        elif row[0] == "Forest Height 25 to 50 meters":
-            row[1] = 50
-        else:
-            row[1] = 0
-        cursor.updateRow(row)
-    del row
-    del cursor
-
-    evh_lookup = Lookup(evh, "MAX_HEIGHT")
+    return out_network
+
+
+def prob_raster(evh, evc, bankfull, dem, scratch, corridor=None, workers=2, checkpoints=None):
+    """Creates a raster output for probability of individual LWD recruitment. The height, distance, cover
+    and slope terms are independent and built side by side on up to workers threads"""
+
+    # the 10m total height and cover rasters are kept next to the LANDFIRE inputs, the slope next to the DEM
     if not os.path.exists(os.path.dirname(os.path.dirname(evh)) + "/Height_Rasters"):
         os.mkdir(os.path.dirname(os.path.dirname(evh)) + "/Height_Rasters")
-    total_height = os.path.dirname(os.path.dirname(evh)) + "/Height_Rasters/total_height.tif"
-    arcpy.Resample_management(evh_lookup, total_height, 10, "BILINEAR")
-
-    # derive an effective height raster from total height and euclidean distance
-    arcpy.env.extent = total_height
-    ed = EucDistance(bankfull, "", 1)
-    ed_10m = scratch + "/ed_10m.tif"
-    arcpy.Resample_management(ed, ed_10m, 10, "BILINEAR")                                                               # revisit - why does it need to be 1m in first place?
-    euclidean = SetNull(ed_10m, ed_10m, "VALUE = 0")
-
-    total_height = Raster(total_height)
-    eh1 = total_height - euclidean
-    effective_height = SetNull(eh1, eh1, "VALUE <= 0")
-
-    # derive a tree density raster from LANDFIRE EVC
-    lfevc = arcpy.ListFields(evc, "MAX_COVER")
-    if len(lfevc) == 1:
-        arcpy.DeleteField_management(evc, "MAX_COVER")
-    arcpy.AddField_management(evc, "MAX_COVER", "SHORT")
-    cursor = arcpy.da.UpdateCursor(evc, ["CLASSNAMES", "MAX_COVER"])
-    for row in cursor:
-        if row[0] == "Tree Cover >= 0 and < 10%":
-            row[1] = 10
-        elif row[0] == "Tree Cover >= 10 and < 20%":
-            row[1] = 20
-        elif row[0] == "Tree Cover >= 20 and < 30%":
-            row[1] = 30
-        elif row[0] == "Tree Cover >= 30 and < 40%":
-            row[1] = 40
-        elif row[0] == "Tree Cover >= 40 and < 50%":
-            row[1] = 50
-        elif row[0] == "Tree Cover >= 50 and < 60%":
-            row[1] = 60
-        elif row[0] == "Tree Cover >= 60 and < 70%":
-            row[1] = 70
-        elif row[0] == "Tree Cover >= 70 and < 80%":
-            row[1] = 80
-        elif row[0] == "Tree Cover >= 80 and < 90%":
-            row[1] = 90
-        elif row[0] == "Tree Cover >= 90 and < 100%":
-            row[1] = 100
-        else:
-            row[1] = 0
-        cursor.updateRow(row)
-    del row
-    del cursor
-
-    evc_lookup = Lookup(evc, "MAX_COVER")
     if not os.path.exists(os.path.dirname(os.path.dirname(evc)) + "/Cover"):
         os.mkdir(os.path.dirname(os.path.dirname(evc)) + "/Cover")
-    cover = os.path.dirname(os.path.dirname(evc)) + "/Cover/total_cover.tif"
-    arcpy.Resample_management(evc_lookup, cover, 10, "BILINEAR")
-
-    # generate the first term of probability eqn
-    prob_term1 = ((effective_height/total_height) / 2)
-
-    # derive the second term  of probability eqn from the unitless slope
-    slope_percent = Slope(dem, "PERCENT_RISE")
-    slope_10m = scratch + "/slope_10m.tif"
-    arcpy.Resample_management(slope_percent, slope_10m, 10, "BILINEAR")
-    slope_clip = scratch + "/slope_clip.tif"
-    arcpy.Clip_management(slope_10m, "", slope_clip, prob_term1, maintain_clipping_extent="MAINTAIN_EXTENT")
-    slope_clip = Raster(slope_clip)
-    slope_unitless = slope_clip / 100
     if not os.path.exists(os.path.dirname(dem) + "/Slope"):
         os.mkdir(os.path.dirname(dem) + "/Slope")
 
-    prob_term2 = (0.5 - (0.5/10**(1.4375*slope_unitless)))/2
-
-    # generate third term of probability eqn
-    cover = Raster(cover)
-    prob_term3 = (cover/100.0)/4
-
-    # final individual probability raster
-    individual_probability = prob_term1 + prob_term2 + prob_term3
-
-    effective_height.save(os.path.dirname(os.path.dirname(evh)) + "/Height_Rasters/effective_height.tif")
-    slope_unitless.save(os.path.dirname(dem) + "/Slope/slope.tif")
-
-    return individual_probability
-
-
-def rasterToTable(network, raster, scratch):
-    """Applies the raster output for individual recruitment probability to a network"""
-
-    # make 0s in probability raster no data
-    raster = Con(IsNull(raster), 0, raster)
-
-    # create arrays for fields in output network
-    lengtharray = np.asarray(arcpy.da.FeatureClassToNumPyArray(network, "FID"), np.int16)
-
-    oid = np.arange(0, len(lengtharray), 1)
-    sum_l = []
-    area_l = []
-
-    # apply segmentZS functions to each segment of network to extract field values from raster
-    cursor = arcpy.da.SearchCursor(network, "SHAPE@")
-    for row in cursor:
-        sval = SegmentZS.segmentSum(row[0], raster, "50 Meters", scratch)
-        aval = SegmentZS.segmentArea(row[0], "50 Meters", scratch)
-
-        sum_l.append(sval)
-        area_l.append(aval)
-
-    del row
-    del cursor
+    bankfull_ids, bankfull_geoms = SegmentZS.readSegments(bankfull)
+    individual_probability = scratch + "/individual_probability.tif"
+    ProbabilityKernel.probabilityRaster(
+        evh, evc, bankfull_geoms, dem, scratch, individual_probability,
+        os.path.dirname(os.path.dirname(evh)) + "/Height_Rasters/total_height.tif",
+        os.path.dirname(os.path.dirname(evc)) + "/Cover/total_cover.tif",
+        {"effective_height": os.path.dirname(os.path.dirname(evh)) + "/Height_Rasters/effective_height.tif",
+         "slope": os.path.dirname(dem) + "/Slope/slope.tif"},
+        corridor, workers, checkpoints, arcpy.AddMessage, SegmentZS.featureSRS(bankfull))
+
+    return Raster(individual_probability)
+
+
+def rasterToTable(network, raster, scratch, batch=True, workers=1, id_field="OID@"):
+    """Applies the raster output for individual recruitment probability to a network. Results are keyed
+    by the segment id field, the object id by default"""
+
+    # the probability raster on disk, the zonal sums skip its nodata cells which adds the same as 0s would
+    prob = str(raster)
+
+    if batch:
+        # segment zones come from zone indexes cached in scratch, one per chunk of segments, neighbouring
+        # buffers share pixels
+        oid, sum_a, count_a, area_a = SegmentZS.chunkedSegmentStats(network, prob, 50, scratch, id_field=id_field)
+    elif workers > 1:
+        # segment by segment on a process pool, each worker in its own scratch folder. The zonal sums skip
+        # nodata cells and a zone over nodata alone sums to 0, the same as the 0 filled raster below
+        oid, sum_a, area_a = SegmentZS.parallelSegmentStats(network, prob, "50 Meters", scratch, workers,
+                                                            id_field=id_field)
+    else:
+        # make 0s in probability raster no data
+        raster = Con(IsNull(raster), 0, raster)
+
+        # apply segmentZS functions to each segment of network to extract field values from raster, saving
+        # progress as it goes
+        oid, sum_a, area_a = SegmentZS.serialSegmentStats(network, raster, "50 Meters", scratch, prob, id_field)
 
     # create and populate probability array
-    sum_a = np.asarray(sum_l, np.float32)
-    area_a = np.asarray(area_l, np.float32)
+    sum_a = np.asarray(sum_a, np.float32)
+    area_a = np.asarray(area_a, np.float32)
     div_a = np.divide(sum_a, area_a)
     div_amax = div_a.max()
     div_amin = div_a.min()
-    rel_prob_a = np.zeros(len(div_a))
     norm_prob_a = np.multiply(div_a, 100)
+    rel_prob_a = (div_a - div_amin)/(div_amax - div_amin)
 
-    for x in range(len(div_a)):
-        rel_prob_a[x] = (div_a[x] - div_amin)/(div_amax - div_amin)
-
-    # generate output table to merge to network
-    columns = np.column_stack((oid, sum_a))
-    columns2 = np.column_stack((columns, area_a))
-    columns3 = np.column_stack((columns2, rel_prob_a))
-    columns4 = np.column_stack((columns3, norm_prob_a))
-    out_table = scratch + "/out_table.txt"
-    np.savetxt(out_table, columns4, delimiter=",", header="ID, SUM, AREA, REL_PROB, NORM_PROB", comments="")
+    # output columns to merge to network
+    table = AttributeTable.AttributeTable(oid)
+    table.add("SUM", sum_a)
+    table.add("AREA", area_a)
+    table.add("REL_PROB", rel_prob_a)
+    table.add("NORM_PROB", norm_prob_a)
 
-    del sum_a, area_a, div_a, rel_prob_a, norm_prob_a, columns, columns2, columns3, columns4
+    del sum_a, area_a, div_a, rel_prob_a, norm_prob_a
 
-    return
+    return table
 
 def getUUID():
     return str(uuid.uuid4()).upper()
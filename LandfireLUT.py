@@ -0,0 +1,210 @@
+# # # Lookup tables from LANDFIRE class names to model values # # #
+
+# the raster attribute table of a LANDFIRE product is read once and turned into a numpy array indexed by
+# raster value, which is then applied to blocks as they are read. Nothing is written to the input rasters so
+# several runs can share one LANDFIRE tile at the same time. Built tables are saved in a LUT_Cache folder of
+# the user's cache directory, named by the product version, so later processes and other tiles of the same
+# product load them instead of reading the attribute table again. Every file there is written whole under a
+# temporary name and renamed, and one that can not be read is a cache miss
+
+import hashlib
+import json
+import os
+import tempfile
+from osgeo import gdal, ogr
+import numpy as np
+import Corridor
+import RasterBlocks
+
+# nodata of the looked up rasters
+LUT_NODATA = -32768
+
+# maximum tree height (m) of each LANDFIRE EVH class
+MAX_HEIGHT = {"Forest Height 0 to 5 meters": 5,
+              "Forest Height 5 to 10 meters": 10,
+              "Forest Height 5 t0 10 meters": 10,
+              "Forest Height 10 to 25 meters": 25,
+              "Forest Height 25 to 50 meters": 50}
+
+# maximum tree cover (%) of each LANDFIRE EVC class
+MAX_COVER = {"Tree Cover >= 0 and < 10%": 10,
+             "Tree Cover >= 10 and < 20%": 20,
+             "Tree Cover >= 20 and < 30%": 30,
+             "Tree Cover >= 30 and < 40%": 40,
+             "Tree Cover >= 40 and < 50%": 50,
+             "Tree Cover >= 50 and < 60%": 60,
+             "Tree Cover >= 60 and < 70%": 70,
+             "Tree Cover >= 70 and < 80%": 80,
+             "Tree Cover >= 80 and < 90%": 90,
+             "Tree Cover >= 90 and < 100%": 100}
+
+# LANDFIRE BpS vegetation groups that can supply large wood
+LWD = {"Conifer": 1,
+       "Conifer-Hardwood": 1,
+       "Hardwood": 1,
+       "Hardwood-Conifer": 1}
+
+# attribute tables by raster path, size and modification time, and lookup tables by product version
+_tables = {}
+_luts = {}
+
+# folder of the user's cache directory that built lookup tables are saved to
+CACHE_FOLDER = "LUT_Cache"
+
+
+def readAttributeTable(raster, field):
+    """Returns (values, classes) of a raster's attribute table. GDAL's own table is used when the driver
+    exposes one, otherwise the ESRI .vat.dbf sidecar is read with OGR"""
+
+    key = (os.path.abspath(raster), os.path.getsize(raster), os.path.getmtime(raster), field)
+    if key in _tables:
+        return _tables[key]
+
+    values = []
+    classes = []
+    rat = gdal.Open(raster).GetRasterBand(1).GetDefaultRAT()
+    if rat is not None and rat.GetRowCount() > 0:
+        names = [rat.GetNameOfCol(i).upper() for i in range(rat.GetColumnCount())]
+        if field.upper() not in names:
+            raise Exception("Attribute table of " + raster + " has no " + field + " field")
+        class_col = names.index(field.upper())
+        value_col = None
+        for i in range(rat.GetColumnCount()):
+            if names[i] == "VALUE" or rat.GetUsageOfCol(i) == gdal.GFU_MinMax:
+                value_col = i
+                break
+        for row in range(rat.GetRowCount()):
+            values.append(rat.GetValueAsInt(row, value_col) if value_col is not None else row)
+            classes.append(rat.GetValueAsString(row, class_col))
+    else:
+        vat = ogr.Open(raster + ".vat.dbf")
+        if vat is None:
+            raise Exception("No attribute table found for " + raster)
+        layer = vat.GetLayer()
+        for feature in layer:
+            values.append(int(feature.GetField("VALUE")))
+            classes.append(feature.GetField(field))
+        vat = None
+
+    _tables[key] = (np.asarray(values, np.int64), classes)
+    return _tables[key]
+
+
+def cacheFolder():
+    """LUT_Cache folder of the user's cache directory, local application data on Windows"""
+    root = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(root, "WRAT", CACHE_FOLDER)
+
+
+def readCached(path, read):
+    """Contents of a cache file read with read(path), None when it is missing or can not be read"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return read(path)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def loadLUT(folder, version):
+    """Lookup table of a product version, from memory or the cache folder. None if it was never built"""
+    if version not in _luts:
+        lut = readCached(os.path.join(folder, version + ".npy"), np.load)
+        if lut is None:
+            return None
+        _luts[version] = lut
+    return _luts[version]
+
+
+def writeCached(folder, name, write):
+    """Writes a cache file with write(path) under a temporary name of its own and renames it into place, so a
+    run reading the cache never sees half a file. A cache that can not be written to only means the table is
+    built again next time"""
+    try:
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        handle, temp = tempfile.mkstemp(suffix=".tmp" + os.path.splitext(name)[1], dir=folder)
+        os.close(handle)
+        write(temp)
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temp, path)
+    except (IOError, OSError):
+        pass
+
+
+def readJSON(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def writeJSON(value):
+    def write(path):
+        with open(path, "w") as f:
+            json.dump(value, f)
+    return write
+
+
+def buildLUT(raster, field, mapping, default=0):
+    """Array indexed by raster value holding mapping[class] for every row of the attribute table, default
+    for classes not in the mapping and LUT_NODATA for values the table does not list"""
+
+    # the version of a raster is remembered per path, size and modification time so a cached table is
+    # found without reading the attribute table. Each raster and mapping has a file of its own, so runs
+    # never rewrite each other's entries
+    folder = cacheFolder()
+    key = json.dumps([os.path.abspath(raster), field, sorted(mapping.items()), default])
+    memo_file = os.path.join(folder, "version_" + hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+    stamp = [os.path.getsize(raster), os.path.getmtime(raster)]
+    entry = readCached(memo_file, readJSON)
+    if isinstance(entry, dict) and entry.get("key") == key and entry.get("stamp") == stamp:
+        lut = loadLUT(folder, entry["version"])
+        if lut is not None:
+            return lut
+
+    values, classes = readAttributeTable(raster, field)
+
+    # the product version is the content of its attribute table, so clipped copies of a tile share a lut
+    version = hashlib.sha1(json.dumps([values.tolist(), classes, sorted(mapping.items()), default])
+                           .encode("utf-8")).hexdigest()
+    lut = loadLUT(folder, version)
+    if lut is None:
+        if len(values) and values.min() < 0:
+            raise Exception("Negative raster values can not index a lookup table")
+        lut = np.full(int(values.max()) + 1 if len(values) else 1, LUT_NODATA, np.int16)
+        lut[values] = [mapping.get(name, default) for name in classes]
+        _luts[version] = lut
+    if not os.path.exists(os.path.join(folder, version + ".npy")):
+        writeCached(folder, version + ".npy", lambda path: np.save(path, lut))
+    writeCached(folder, os.path.basename(memo_file), writeJSON({"key": key, "stamp": stamp, "version": version}))
+    return lut
+
+
+def applyLUT(lut, array, nodata=None):
+    """Looks up every cell of a block. Nodata and values outside the table come back as LUT_NODATA"""
+
+    valid = RasterBlocks.validMask(array, nodata) & (array >= 0) & (array < len(lut))
+    result = np.full(array.shape, LUT_NODATA, np.int16)
+    result[valid] = lut[array[valid].astype(np.int64)]
+    return result
+
+
+def lookupRaster(raster, field, mapping, output, default=0, corridor=None):
+    """Writes the looked up values of a LANDFIRE raster to a new Int16 raster on the same grid, only inside
+    the tiles a corridor touches when one is given"""
+
+    lut = buildLUT(raster, field, mapping, default)
+    rasterDS = gdal.Open(raster)
+    band = rasterDS.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+
+    outDS = RasterBlocks.createLike(output, rasterDS, gdal.GDT_Int16, LUT_NODATA, corridor is not None)
+    outBand = outDS.GetRasterBand(1)
+    for xoff, yoff, xsize, ysize in Corridor.windows(rasterDS, corridor):
+        array = band.ReadAsArray(xoff, yoff, xsize, ysize)
+        outBand.WriteArray(applyLUT(lut, array, nodata), xoff, yoff)
+    outBand.FlushCache()
+
+    return output
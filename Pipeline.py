@@ -0,0 +1,215 @@
+# # # Small stage graph executor that runs independent WRAT stages at the same time # # #
+
+# every stage declares the stages it needs, explicitly or by passing Result placeholders among its
+# arguments (also inside lists, tuples and dicts), and the files it writes. Stages whose inputs are ready
+# run on a thread pool of limited size.
+# GDAL and numpy release the GIL, so stages that only use them overlap without rasters being copied between
+# processes. arcpy and arcpy.env are process wide and not thread safe, stages that call arcpy (geoprocessing
+# tools, cursors, Raster objects) are added with threadsafe=False and never run at the same time as one
+# another. Stages that share an output file or both write to the same feature class must depend on one
+# another. With checkpoints a stage whose arguments and input files are unchanged since it last finished,
+# and whose outputs are intact, is skipped and its recorded result used
+
+import threading
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+
+class Result:
+    """Placeholder for the return value of an earlier stage, or one item of it"""
+
+    def __init__(self, stage, item=None):
+        self.stage = stage
+        self.item = item
+
+    def __getitem__(self, item):
+        return Result(self.stage, item)
+
+    def resolve(self, results):
+        value = results[self.stage]
+        if self.item is not None:
+            value = value[self.item]
+        return value
+
+
+class Stage:
+    """One step of a tool, a function with its arguments, the stages it needs and the files it writes"""
+
+    def __init__(self, name, function, args=(), kwargs=None, requires=(), outputs=(), threadsafe=True):
+        self.name = name
+        self.threadsafe = threadsafe
+        self.function = function
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.outputs = list(outputs)
+        self.requires = list(requires)
+        for value in placeholders(list(self.args) + list(self.kwargs.values())):
+            if value.stage not in self.requires:
+                self.requires.append(value.stage)
+
+    def arguments(self, results):
+        """Arguments of the stage with the results of the stages it needs in place of their placeholders"""
+        args = [resolve(value, results) for value in self.args]
+        kwargs = dict((key, resolve(value, results)) for key, value in self.kwargs.items())
+        return args, kwargs
+
+
+def placeholders(value):
+    """Result placeholders in a value and the lists, tuples and dicts it holds"""
+    if isinstance(value, Result):
+        return [value]
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return [found for item in value for found in placeholders(item)]
+    return []
+
+
+def resolve(value, results):
+    """A value with the results of earlier stages in place of their placeholders, also inside lists, tuples
+    and dicts"""
+    if isinstance(value, Result):
+        return value.resolve(results)
+    if isinstance(value, dict):
+        return dict((key, resolve(item, results)) for key, item in value.items())
+    if isinstance(value, list):
+        return [resolve(item, results) for item in value]
+    if isinstance(value, tuple):
+        return tuple(resolve(item, results) for item in value)
+    return value
+
+
+class Pipeline:
+    """Stage graph run with at most workers stages at a time, in the order stages were added when workers is 1"""
+
+    def __init__(self, workers=2, log=None, checkpoints=None):
+        self.workers = max(int(workers), 1)
+        self.log = log
+        self.checkpoints = checkpoints
+        self.stages = []
+        self.names = {}
+        self.timings = {}
+        # held by stages that are not thread safe while they run
+        self.lock = threading.Lock()
+        # messages of stages on pool threads, passed to log from the thread that runs the pipeline since the
+        # log is usually arcpy.AddMessage
+        self.messages = []
+        self.owner = None
+
+    def add(self, name, function, args=(), kwargs=None, requires=(), outputs=(), threadsafe=True):
+        """Adds a stage and returns the placeholder for its result. Stages that call arcpy are not threadsafe"""
+        if name in self.names:
+            raise Exception("Pipeline stage " + name + " is defined twice")
+        stage = Stage(name, function, args, kwargs, requires, outputs, threadsafe)
+        for required in stage.requires:
+            if required not in self.names:
+                raise Exception("Pipeline stage " + name + " needs " + required + " which is not defined before it")
+        self.names[name] = stage
+        self.stages.append(stage)
+        return Result(name)
+
+    def message(self, text):
+        if self.log is None:
+            return
+        if threading.current_thread() is self.owner:
+            self.log(text)
+        else:
+            self.messages.append(text)
+
+    def flushMessages(self):
+        while self.messages:
+            self.log(self.messages.pop(0))
+
+    def runStage(self, stage, results):
+        """Runs one stage and returns its name, whether it worked and its result or the error"""
+        if stage.threadsafe:
+            return self._runStage(stage, results)
+        with self.lock:
+            return self._runStage(stage, results)
+
+    def _runStage(self, stage, results):
+        start = time.time()
+        try:
+            args, kwargs = stage.arguments(results)
+            self.message(stage.name)
+            if self.checkpoints is None:
+                value = stage.function(*args, **kwargs)
+            else:
+                value, skipped = self.checkpoints.run(stage.name, stage.function, args, kwargs, stage.outputs)
+                if skipped:
+                    self.message(stage.name + " unchanged since the last run, skipped")
+        except Exception as error:
+            self.timings[stage.name] = time.time() - start
+            return stage.name, False, (error, traceback.format_exc())
+        self.timings[stage.name] = time.time() - start
+        return stage.name, True, value
+
+    def run(self):
+        """Runs every stage once its requirements are done and returns the results by stage name. The first
+        failure stops new stages from starting, stages already running finish, then the error is raised"""
+        results = {}
+        self.owner = threading.current_thread()
+        if self.workers == 1:
+            # stages can only require stages added before them, so the order they were added in works
+            for stage in self.stages:
+                name, ok, value = self.runStage(stage, results)
+                if not ok:
+                    raise StageError(name, value[0], value[1])
+                results[name] = value
+            return results
+
+        done = threading.Condition()
+        finished = []
+        pending = list(self.stages)
+        running = set()
+        failure = None
+        pool = ThreadPool(self.workers)
+        try:
+            while pending or running:
+                # start every stage whose requirements are done, the pool holds back the ones over the limit
+                if failure is None:
+                    ready = [stage for stage in pending if all(name in results for name in stage.requires)]
+                    for stage in ready:
+                        pending.remove(stage)
+                        running.add(stage.name)
+                        pool.apply_async(self.runStage, (stage, dict(results)), callback=self._finished(done, finished))
+                if not running:
+                    break
+
+                with done:
+                    while not finished:
+                        done.wait(1)
+                        self.flushMessages()
+                    name, ok, value = finished.pop(0)
+                self.flushMessages()
+                running.discard(name)
+                if ok:
+                    results[name] = value
+                elif failure is None:
+                    failure = StageError(name, value[0], value[1])
+        finally:
+            pool.close()
+            pool.join()
+            self.flushMessages()
+
+        if failure is not None:
+            raise failure
+        return results
+
+    @staticmethod
+    def _finished(done, finished):
+        def callback(outcome):
+            with done:
+                finished.append(outcome)
+                done.notify()
+        return callback
+
+
+class StageError(Exception):
+    """A pipeline stage failed, with the traceback of the thread it ran on"""
+
+    def __init__(self, stage, error, trace):
+        Exception.__init__(self, "Stage " + stage + " failed: " + str(error) + "\n" + trace)
+        self.stage = stage
+        self.error = error
@@ -0,0 +1,115 @@
+# # # Fused evaluation of the individual recruitment probability equation # # #
+
+# ((He/Ht)/2) + ((0.5 - (0.5/10 ^ (1.4375 * B)))/2) + (D/4) is computed block by block from aligned
+# total height, bankfull distance, percent slope and cover rasters, so no intermediate term is written
+# unless it is asked for
+
+from osgeo import gdal
+import numpy as np
+import AnalysisGrid
+import Corridor
+import DistanceTransform
+import LandfireLUT
+import Pipeline
+import RasterBlocks
+import TerrainCache
+
+
+def probabilityTerms(height, distance, slope, cover):
+    """Evaluates the equation on arrays. nan marks cells that SetNull or missing data leave null"""
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        # effective height is null inside the bankfull channel and where the tree cannot reach it
+        effective = height - distance
+        effective[(distance == 0) | ~(effective > 0)] = np.nan
+
+        term1 = (effective / height) / 2
+        unitless = slope / 100.0
+        term2 = (0.5 - (0.5 / 10 ** (1.4375 * unitless))) / 2
+        term3 = (cover / 100.0) / 4
+
+    return {"probability": term1 + term2 + term3,
+            "effective_height": effective,
+            "slope": unitless,
+            "term1": term1,
+            "term2": term2,
+            "term3": term3}
+
+
+def fusedProbability(height, distance, slope, cover, output, extra=None, corridor=None):
+    """Writes the probability raster in one pass over aligned inputs. extra maps any other result of
+    probabilityTerms (effective_height, slope, term1, term2, term3) to a path it is also written to.
+    With a corridor only the tiles it touches are computed and the outputs are sparse"""
+    if extra is None:
+        extra = {}
+
+    inputs = [gdal.Open(path) for path in (height, distance, slope, cover)]
+    if not RasterBlocks.sameGrid(*inputs):
+        raise Exception("Height, distance, slope and cover rasters must share one grid")
+    bands = [ds.GetRasterBand(1) for ds in inputs]
+
+    sparse = corridor is not None
+    outputs = {"probability": RasterBlocks.createLike(output, inputs[0], gdal.GDT_Float32, RasterBlocks.NODATA, sparse)}
+    for name, path in extra.items():
+        outputs[name] = RasterBlocks.createLike(path, inputs[0], gdal.GDT_Float32, RasterBlocks.NODATA, sparse)
+
+    for window in Corridor.windows(inputs[0], corridor):
+        arrays = [RasterBlocks.readFloat(band, *window) for band in bands]
+        results = probabilityTerms(*arrays)
+        for name, outDS in outputs.items():
+            result = results[name]
+            result[np.isnan(result)] = RasterBlocks.NODATA
+            outDS.GetRasterBand(1).WriteArray(result.astype(np.float32), window[0], window[1])
+
+    for outDS in outputs.values():
+        outDS.FlushCache()
+
+    return output
+
+
+def slopeTerm(grid, dem):
+    """Percent slope of the DEM from the terrain cache, warped onto the analysis grid as it is read"""
+    return grid.align(TerrainCache.TerrainCache(dem).slope("PERCENT_RISE"), "bilinear")
+
+
+def probabilityRaster(evh, evc, bankfull_geoms, dem, scratch, output, total_height, cover, extra=None,
+                      corridor=None, workers=2, checkpoints=None, log=None, bankfull_srs=None):
+    """Builds the probability raster from the LANDFIRE EVH and EVC, the bankfull polygons (in the coordinate
+    system bankfull_srs) and the DEM. The height, distance, cover and slope terms are independent and built
+    side by side on up to workers threads. total_height and cover are the 10m aligned rasters kept for the
+    other tools"""
+
+    # every term is read on one 10m grid snapped to the EVH, each input is warped onto it once
+    grid = AnalysisGrid.AnalysisGrid.fromRaster(evh, scratch, 10)
+    template = grid.template()
+    pipeline = Pipeline.Pipeline(workers, log, checkpoints)
+
+    # derive a 10m tree height raster from LANDFIRE EVH layer, the EVH itself is only read
+    evh_lookup = pipeline.add("tree height", LandfireLUT.lookupRaster,
+                              (evh, "CLASSNAMES", LandfireLUT.MAX_HEIGHT, scratch + "/max_height.tif"),
+                              {"corridor": corridor}, outputs=[scratch + "/max_height.tif"])
+    pipeline.add("align tree height", grid.align, (evh_lookup, "bilinear", total_height), outputs=[total_height])
+
+    # distance from the bankfull channel computed directly on the 10m grid, nothing is farther
+    # than the 50m tallest tree class can reach so the transform stops there
+    ed_10m = scratch + "/ed_10m.tif"
+    pipeline.add("bankfull distance", DistanceTransform.distanceRaster, (bankfull_geoms, template, ed_10m),
+                 {"max_distance": 50, "corridor": corridor, "srs": bankfull_srs}, outputs=[ed_10m])
+
+    # derive a tree density raster from LANDFIRE EVC
+    evc_lookup = pipeline.add("tree cover", LandfireLUT.lookupRaster,
+                              (evc, "CLASSNAMES", LandfireLUT.MAX_COVER, scratch + "/max_cover.tif"),
+                              {"corridor": corridor}, outputs=[scratch + "/max_cover.tif"])
+    pipeline.add("align tree cover", grid.align, (evc_lookup, "bilinear", cover), outputs=[cover])
+
+    # percent slope warped onto the grid as it is read
+    slope_percent = pipeline.add("slope", slopeTerm, (grid, dem))
+
+    # evaluate all three terms of the probability eqn in one pass over the aligned rasters
+    extra = extra or {}
+    pipeline.add("probability", fusedProbability,
+                 (total_height, ed_10m, slope_percent, cover, output, extra, corridor),
+                 requires=["align tree height", "bankfull distance", "align tree cover"],
+                 outputs=[output] + sorted(extra.values()))
+    pipeline.run()
+
+    return output
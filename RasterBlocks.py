@@ -0,0 +1,179 @@
+# # # Helpers for reading and writing rasters one block at a time # # #
+
+# windows follow the natural GDAL block layout of the raster so every read touches whole blocks only. Vector
+# geometries are projected to the coordinate system of the grid before they are burned onto it
+
+from osgeo import gdal, ogr, osr
+from shapely import wkb
+import numpy as np
+
+# float nodata used by arcpy map algebra outputs, and by the float rasters written here
+NODATA = -3.4028234663852886e+38
+
+
+def blockWindows(band, max_pixels=4194304):
+    """Yields (xoff, yoff, xsize, ysize) windows aligned to the block size of a raster band.
+    Strip-organized rasters get several strips per window so each read is a useful size"""
+
+    xsize = band.XSize
+    ysize = band.YSize
+    bx, by = band.GetBlockSize()
+
+    # whole-row strips are grouped, tiles are read as they are stored
+    if bx >= xsize:
+        rows = max(by, (max_pixels // max(xsize, 1)) // by * by)
+        for yoff in range(0, ysize, rows):
+            yield 0, yoff, xsize, min(rows, ysize - yoff)
+    else:
+        for yoff in range(0, ysize, by):
+            for xoff in range(0, xsize, bx):
+                yield xoff, yoff, min(bx, xsize - xoff), min(by, ysize - yoff)
+
+
+def validMask(array, *nodata):
+    """Returns a boolean array that is True where a block holds none of the given nodata values"""
+
+    valid = np.ones(array.shape, dtype=bool)
+    for nd in nodata:
+        if nd is None:
+            continue
+        if np.isnan(nd):
+            valid &= ~np.isnan(array)
+        else:
+            valid &= array != nd
+    return valid
+
+
+def windowTransform(geotransform, xoff, yoff):
+    """Returns the geotransform of a window that starts at pixel (xoff, yoff) of a grid"""
+
+    return (geotransform[0] + xoff * geotransform[1] + yoff * geotransform[2], geotransform[1], geotransform[2],
+            geotransform[3] + xoff * geotransform[4] + yoff * geotransform[5], geotransform[4], geotransform[5])
+
+
+def spatialReference(wkt):
+    """osr spatial reference of a WKT string, ESRI WKT included, with x before y. None when it is empty or
+    can not be read"""
+
+    if not wkt:
+        return None
+    srs = osr.SpatialReference()
+    try:
+        if srs.ImportFromWkt(wkt) != 0:
+            return None
+    except RuntimeError:
+        return None
+    if int(gdal.VersionInfo()) < 3000000:
+        srs.MorphFromESRI()
+    if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+def projectGeoms(geoms, source, target):
+    """Shapely geometries in the source coordinate system (WKT) transformed to the target one, normally the
+    projection of the grid they are burned on. They come back as they are when either is unknown or the
+    two are the same"""
+
+    source_srs = spatialReference(source)
+    target_srs = spatialReference(target)
+    if source_srs is None or target_srs is None or source_srs.IsSame(target_srs):
+        return geoms
+    transform = osr.CoordinateTransformation(source_srs, target_srs)
+    projected = []
+    for geom in geoms:
+        ogr_geom = ogr.CreateGeometryFromWkb(geom.wkb)
+        ogr_geom.Transform(transform)
+        projected.append(wkb.loads(bytes(ogr_geom.ExportToWkb())))
+    return projected
+
+
+def zoneLayer(geoms, labels, projection=""):
+    """Builds an in-memory OGR layer of shapely polygons with an integer ZONE field to burn"""
+
+    srs = None
+    if projection:
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(projection)
+    source = ogr.GetDriverByName("Memory").CreateDataSource("zones")
+    layer = source.CreateLayer("zones", srs, ogr.wkbUnknown)
+    layer.CreateField(ogr.FieldDefn("ZONE", ogr.OFTInteger))
+    defn = layer.GetLayerDefn()
+    for geom, label in zip(geoms, labels):
+        feature = ogr.Feature(defn)
+        feature.SetField("ZONE", int(label))
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(geom.wkb))
+        layer.CreateFeature(feature)
+        feature = None
+
+    # the data source has to outlive the layer so both are handed back
+    return source, layer
+
+
+def rasterizeWindow(zones, geotransform, projection, xoff, yoff, xsize, ysize, all_touched=False):
+    """Burns the ZONE field of a zone layer into an Int32 array covering one window of a grid"""
+
+    source, layer = zones
+    memDS = gdal.GetDriverByName("MEM").Create("", xsize, ysize, 1, gdal.GDT_Int32)
+    memDS.SetGeoTransform(windowTransform(geotransform, xoff, yoff))
+    if projection:
+        memDS.SetProjection(projection)
+    options = ["ATTRIBUTE=ZONE"]
+    if all_touched:
+        options.append("ALL_TOUCHED=TRUE")
+    gdal.RasterizeLayer(memDS, [1], layer, options=options)
+    labels = memDS.GetRasterBand(1).ReadAsArray()
+    memDS = None
+
+    return labels
+
+
+def rowWindows(band, max_pixels=4194304):
+    """Yields (yoff, ysize) strips of whole rows whose height is a multiple of the band's block height"""
+
+    bx, by = band.GetBlockSize()
+    rows = max(by, (max_pixels // max(band.XSize, 1)) // by * by)
+    for yoff in range(0, band.YSize, rows):
+        yield yoff, min(rows, band.YSize - yoff)
+
+
+def readFloat(band, xoff, yoff, xsize, ysize):
+    """Reads a window as float64 with nan wherever the band holds its nodata value"""
+
+    array = band.ReadAsArray(xoff, yoff, xsize, ysize).astype(np.float64)
+    array[~validMask(array, band.GetNoDataValue())] = np.nan
+    return array
+
+
+def createLike(path, templateDS, datatype=gdal.GDT_Float32, nodata=None, sparse=False):
+    """Creates a tiled, compressed single band GeoTIFF on the grid of a template dataset. Tiles of a sparse
+    raster that are never written are not stored and read back as nodata"""
+
+    return createGrid(path, templateDS.GetGeoTransform(), templateDS.GetProjection(), templateDS.RasterXSize,
+                      templateDS.RasterYSize, datatype, nodata, sparse)
+
+
+def createGrid(path, geotransform, projection, xsize, ysize, datatype=gdal.GDT_Float32, nodata=None, sparse=False):
+    """createLike for a grid given by its geotransform, projection and size"""
+
+    driver = gdal.GetDriverByName("GTiff")
+    options = ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "COMPRESS=LZW", "BIGTIFF=IF_SAFER"]
+    if sparse:
+        options.append("SPARSE_OK=TRUE")
+    outDS = driver.Create(path, xsize, ysize, 1, datatype, options)
+    outDS.SetProjection(projection)
+    outDS.SetGeoTransform(geotransform)
+    if nodata is not None:
+        outDS.GetRasterBand(1).SetNoDataValue(nodata)
+    return outDS
+
+
+def sameGrid(*datasets):
+    """Checks that datasets share size and geotransform so their windows line up cell for cell"""
+
+    first = datasets[0]
+    for ds in datasets[1:]:
+        if (ds.RasterXSize, ds.RasterYSize) != (first.RasterXSize, first.RasterYSize) or \
+                not np.allclose(ds.GetGeoTransform(), first.GetGeoTransform()):
+            return False
+    return True
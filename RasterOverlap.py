@@ -4,6 +4,10 @@
 
 from osgeo import gdal
 import numpy as np
+import RasterBlocks
+
+# nodata of the Int16 overlap raster, the float nodata of the inputs can not be stored in it
+OVERLAP_NODATA = -32768
 
 
 class RasterOverlap:
@@ -17,30 +21,40 @@ class RasterOverlap:
         self.findOverlap()
 
     def findOverlap(self):
-        # read input rasters, create output raster and apply to funtion to populate it
+        # read input rasters, create output raster and populate it one block at a time
         in1DS = gdal.Open(self.in1)
         in2DS = gdal.Open(self.in2)
-        nodatavalue = in1DS.GetRasterBand(1).GetNoDataValue()
-        nodatavalue2 = in2DS.GetRasterBand(1).GetNoDataValue()
+        band1 = in1DS.GetRasterBand(1)
+        band2 = in2DS.GetRasterBand(1)
+        nodatavalue = band1.GetNoDataValue()
+        nodatavalue2 = band2.GetNoDataValue()
         driver = gdal.GetDriverByName('GTiff')
         outDS = driver.Create(self.out, in1DS.RasterXSize, in1DS.RasterYSize, 1, gdal.GDT_Int16)
         outDS.SetProjection(in1DS.GetProjection())
         outDS.SetGeoTransform(in1DS.GetGeoTransform())
-        outDS.GetRasterBand(1).SetNoDataValue(nodatavalue)
+        outBand = outDS.GetRasterBand(1)
+        outBand.SetNoDataValue(OVERLAP_NODATA)
 
-        overlap_func = np.vectorize(self.func)
+        for xoff, yoff, xsize, ysize in RasterBlocks.blockWindows(band1):
+            array1 = band1.ReadAsArray(xoff, yoff, xsize, ysize)
+            array2 = band2.ReadAsArray(xoff, yoff, xsize, ysize)
+            result = self.overlap(array1, array2, nodatavalue, nodatavalue2)
+            outBand.WriteArray(result, xoff, yoff)
 
-        for i in range(in1DS.RasterYSize):
-            array1 = in1DS.GetRasterBand(1).ReadAsArray(0, i, in1DS.RasterXSize, 1)
-            array2 = in2DS.GetRasterBand(1).ReadAsArray(0, i, in2DS.RasterXSize, 1)
-            result = overlap_func(array1, array2, nodatavalue, nodatavalue2)
-            outDS.GetRasterBand(1).WriteArray(result, 0, i)
+        outBand.FlushCache()
 
         return outDS
 
+    def overlap(self, array1, array2, nodata, nodata2):
+        # array version of func, 1 where both blocks hold data and OVERLAP_NODATA everywhere else
+        valid = RasterBlocks.validMask(array1, nodata, nodata2) & RasterBlocks.validMask(array2, nodata, nodata2)
+        result = np.full(array1.shape, OVERLAP_NODATA, dtype=np.int16)
+        result[valid] = 1
+        return result
+
     def func(self, in1, in2, nodata, nodata2):
         # simple function returns 1 if there is overlap between two raster inputs and nodata if there is no overlap
         if (in1 != nodata and in1 != nodata2) and (in2 != nodata and in2 != nodata2):
             return 1
         else:
-            return nodata
\ No newline at end of file
+            return nodata
@@ -0,0 +1,253 @@
+# # # Bulk geometry operations on network segments # # #
+
+# segment geometries are handled as lists of shapely geometries and worked on all at once, with an STRtree
+# for every spatial join. Works with shapely 1.6 and later, the vectorized 2.x functions are used when present,
+# Thiessen polygons come from scipy where shapely has no voronoi_diagram (before 1.8, as under ArcMap) and
+# nearest segments come from window queries of growing size where STRtree has no nearest (before 1.7)
+
+import os
+import numpy as np
+import shapely
+from osgeo import ogr
+from shapely.geometry import MultiPoint, Polygon, box
+from shapely.ops import unary_union
+from shapely.strtree import STRtree
+from scipy.spatial import Voronoi
+
+try:
+    from shapely.ops import voronoi_diagram
+except ImportError:
+    voronoi_diagram = None
+
+SHAPELY2 = int(shapely.__version__.split(".")[0]) >= 2
+STRTREE_NEAREST = hasattr(STRtree, "nearest")
+
+
+def queryPairs(tree_geoms, query_geoms, predicate="intersects"):
+    """Returns (query index, tree index) arrays of every pair for which query.predicate(tree) holds"""
+    if SHAPELY2:
+        pairs = STRtree(tree_geoms).query(query_geoms, predicate=predicate)
+        return pairs[0], pairs[1]
+
+    # shapely 1.x trees hand back geometries, so positions are recovered from their ids
+    tree = STRtree(tree_geoms)
+    position = dict((id(geom), i) for i, geom in enumerate(tree_geoms))
+    query_index = []
+    tree_index = []
+    for i, geom in enumerate(query_geoms):
+        for candidate in tree.query(geom):
+            if getattr(geom, predicate)(candidate):
+                query_index.append(i)
+                tree_index.append(position[id(candidate)])
+    return np.asarray(query_index, np.int64), np.asarray(tree_index, np.int64)
+
+
+def midpoints(geoms):
+    """Point halfway along each line, the MID vertex of FeatureVerticesToPoints"""
+    if SHAPELY2:
+        return list(shapely.line_interpolate_point(np.asarray(geoms, object), 0.5, normalized=True))
+    return [geom.interpolate(0.5, normalized=True) for geom in geoms]
+
+
+def voronoiCells(points, envelope):
+    """Thiessen polygon of every point, covering at least the envelope. Points at the same location share
+    a cell"""
+    if voronoi_diagram is None:
+        return scipyVoronoiCells(points, envelope)
+    cells = list(voronoi_diagram(MultiPoint(points), envelope=envelope).geoms)
+    cell_index, point_index = queryPairs(points, cells, "contains")
+    result = [None] * len(points)
+    for c, p in zip(cell_index.tolist(), point_index.tolist()):
+        result[p] = cells[c]
+    return result
+
+
+def scipyVoronoiCells(points, envelope):
+    """voronoiCells with scipy. Four points far outside the envelope close every cell of the real points"""
+    coords = [(point.x, point.y) for point in points]
+    unique = sorted(set(coords))
+    minx, miny, maxx, maxy = envelope.bounds
+    xs = [x for x, y in unique] + [minx, maxx]
+    ys = [y for x, y in unique] + [miny, maxy]
+    cx = (min(xs) + max(xs)) / 2.0
+    cy = (min(ys) + max(ys)) / 2.0
+    far = 10 * max(max(xs) - min(xs), max(ys) - min(ys), 1.0)
+    frame = [(cx - far, cy - far), (cx + far, cy - far), (cx + far, cy + far), (cx - far, cy + far)]
+
+    diagram = Voronoi(np.asarray(unique + frame, np.float64))
+    cells = {}
+    for i, coord in enumerate(unique):
+        region = diagram.regions[diagram.point_region[i]]
+        cells[coord] = Polygon(diagram.vertices[region])
+    return [cells[coord] for coord in coords]
+
+
+def clipToZones(geoms, clip_geoms):
+    """Intersects each geometry with the union of the clip geometries it touches, as Clip does"""
+    geom_index, clip_index = queryPairs(clip_geoms, geoms, "intersects")
+    order = np.argsort(geom_index, kind="stable")
+    geom_index = geom_index[order]
+    clip_index = clip_index[order]
+    starts = np.searchsorted(geom_index, np.arange(len(geoms) + 1))
+
+    # pieces of every touching pair are cut at once, only geometries cut by several clip polygons need a union
+    if SHAPELY2:
+        pieces = shapely.intersection(np.asarray(geoms, object)[geom_index], np.asarray(clip_geoms, object)[clip_index])
+    else:
+        pieces = [geoms[i].intersection(clip_geoms[j]) for i, j in zip(geom_index.tolist(), clip_index.tolist())]
+
+    clipped = []
+    for i in range(len(geoms)):
+        count = starts[i + 1] - starts[i]
+        if count == 0:
+            clipped.append(Polygon())
+        elif count == 1:
+            clipped.append(pieces[starts[i]])
+        else:
+            clipped.append(unary_union(list(pieces[starts[i]:starts[i + 1]])))
+    return clipped
+
+
+def thiessenZones(geoms, buf_dist):
+    """Thiessen polygons of the segment midpoints clipped to the flat ended segment buffers, one zone per
+    segment in the order of the segments"""
+    if SHAPELY2:
+        buffers = list(shapely.buffer(np.asarray(geoms, object), buf_dist, cap_style="flat"))
+    else:
+        buffers = [geom.buffer(buf_dist, cap_style=2) for geom in geoms]
+    bounds = np.asarray([geom.bounds for geom in buffers])
+    minx, miny = bounds[:, :2].min(axis=0)
+    maxx, maxy = bounds[:, 2:].max(axis=0)
+    envelope = box(minx - buf_dist, miny - buf_dist, maxx + buf_dist, maxy + buf_dist)
+
+    cells = voronoiCells(midpoints(geoms), envelope)
+    return clipToZones(cells, buffers)
+
+
+def nearestSegments(geoms, segment_geoms, segment_ids, max_distance=None):
+    """Id of and distance to the nearest segment for every geometry, as Near_analysis gives them. Geometries
+    with no segment within max_distance get -1 for both"""
+    near_ids = np.full(len(geoms), -1, np.asarray(segment_ids).dtype)
+    near_dist = np.full(len(geoms), -1.0)
+    if len(geoms) == 0 or len(segment_geoms) == 0:
+        return near_ids, near_dist
+
+    if not STRTREE_NEAREST:
+        nearest, distances = nearestByWindows(geoms, segment_geoms, max_distance)
+        found = nearest >= 0
+        near_ids[found] = np.asarray(segment_ids)[nearest[found]]
+        near_dist[found] = distances[found]
+        return near_ids, near_dist
+
+    if SHAPELY2:
+        # a geometry equally near several segments gets one of them
+        pairs, distances = STRtree(segment_geoms).query_nearest(np.asarray(geoms, object), max_distance=max_distance,
+                                                                 return_distance=True, all_matches=False)
+        near_ids[pairs[0]] = np.asarray(segment_ids)[pairs[1]]
+        near_dist[pairs[0]] = distances
+        return near_ids, near_dist
+
+    # shapely 1.x trees return the nearest geometry itself and have no search radius
+    tree = STRtree(segment_geoms)
+    position = dict((id(geom), i) for i, geom in enumerate(segment_geoms))
+    for i, geom in enumerate(geoms):
+        nearest = tree.nearest(geom)
+        distance = geom.distance(nearest)
+        if max_distance is None or distance <= max_distance:
+            near_ids[i] = segment_ids[position[id(nearest)]]
+            near_dist[i] = distance
+    return near_ids, near_dist
+
+
+def nearestByWindows(geoms, segment_geoms, max_distance=None):
+    """Position of and distance to the nearest segment of every geometry, -1 for both when none is within
+    max_distance. Segments whose boxes touch the geometry's box grown by a radius are candidates, the radius
+    doubles for the geometries with no candidate within it. Any segment within the radius has its box in
+    the window, so the nearest candidate within the radius is the nearest segment"""
+    nearest = np.full(len(geoms), -1, np.int64)
+    distances = np.full(len(geoms), -1.0)
+    bounds = np.asarray([geom.bounds for geom in segment_geoms], np.float64)
+    width = bounds[:, 2].max() - bounds[:, 0].min()
+    height = bounds[:, 3].max() - bounds[:, 1].min()
+    radius = max(np.sqrt(width * height / len(segment_geoms)), width / len(segment_geoms),
+                 height / len(segment_geoms), 1e-9)
+    if max_distance is not None:
+        radius = min(radius, max_distance)
+
+    todo = np.arange(len(geoms))
+    while len(todo):
+        windows = []
+        for i in todo.tolist():
+            minx, miny, maxx, maxy = geoms[i].bounds
+            windows.append(box(minx - radius, miny - radius, maxx + radius, maxy + radius))
+        window_index, segment_index = queryPairs(segment_geoms, windows, "intersects")
+        best = np.full(len(todo), np.inf)
+        best_segment = np.full(len(todo), -1, np.int64)
+        for w, s in zip(window_index.tolist(), segment_index.tolist()):
+            distance = geoms[todo[w]].distance(segment_geoms[s])
+            if distance < best[w] or (distance == best[w] and s < best_segment[w]):
+                best[w] = distance
+                best_segment[w] = s
+
+        done = best <= radius
+        nearest[todo[done]] = best_segment[done]
+        distances[todo[done]] = best[done]
+        todo = todo[~done]
+        if max_distance is not None and radius >= max_distance:
+            break
+        radius *= 2
+        if max_distance is not None:
+            radius = min(radius, max_distance)
+    return nearest, distances
+
+
+def dissolveByNearest(geoms, segment_geoms, segment_ids, max_distance=None):
+    """Dissolves geometries by their nearest segment, then finds the nearest segment of each dissolved
+    geometry. Returns the dissolved geometries with their nearest segment ids and distances. Geometries
+    with no segment within max_distance are dropped"""
+    near_ids, near_dist = nearestSegments(geoms, segment_geoms, segment_ids, max_distance)
+    parts = {}
+    for geom, near_id, distance in zip(geoms, near_ids.tolist(), near_dist.tolist()):
+        if distance >= 0:
+            parts.setdefault(near_id, []).append(geom)
+    dissolved = [unary_union(parts[key]) for key in sorted(parts)]
+    near_ids, near_dist = nearestSegments(dissolved, segment_geoms, segment_ids)
+
+    return dissolved, near_ids, near_dist
+
+
+def writePolygons(path, geoms, template, fields):
+    """Writes polygons and their attribute columns, a list of (name, values) pairs, to a shapefile in the
+    coordinate system of a template feature class. Integer columns become integer fields, others doubles"""
+    templateDS = ogr.Open(template)
+    srs = templateDS.GetLayer().GetSpatialRef()
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    if driver.Open(path) is not None:
+        driver.DeleteDataSource(path)
+    outDS = driver.CreateDataSource(path)
+    layer = outDS.CreateLayer(os.path.splitext(os.path.basename(path))[0], srs, ogr.wkbPolygon)
+
+    columns = []
+    for name, values in fields:
+        values = np.asarray(values)
+        if not np.issubdtype(values.dtype, np.integer):
+            field_type = ogr.OFTReal
+        elif len(values) == 0 or np.abs(values).max() < 2 ** 31:
+            field_type = ogr.OFTInteger
+        else:
+            field_type = ogr.OFTInteger64
+        layer.CreateField(ogr.FieldDefn(name, field_type))
+        columns.append((name, values.tolist()))
+    defn = layer.GetLayerDefn()
+    for i, geom in enumerate(geoms):
+        if geom.is_empty:
+            continue
+        feature = ogr.Feature(defn)
+        for name, values in columns:
+            feature.SetField(name, values[i])
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(geom.wkb))
+        layer.CreateFeature(feature)
+        feature = None
+    outDS = None
+
+    return path
@@ -4,6 +4,19 @@
 
 import arcpy
 from arcpy.sa import *
+from osgeo import gdal
+from shapely import wkb
+from shapely.ops import unary_union
+import numpy as np
+import Checkpoint
+import RasterBlocks
+import ZoneIndex
+import hashlib
+import multiprocessing
+import os
+import shutil
+import sys
+import uuid
 
 
 def segmentSum(feature, raster, buf_size, temp):
@@ -17,11 +30,12 @@ def segmentSum(feature, raster, buf_size, temp):
     table = temp + "/zs_sum.dbf"
     ZonalStatisticsAsTable(buf_raster, "VALUE", raster, table, "DATA", "SUM")
 
+    # a zone over nothing but nodata has no row in the table, it sums to 0 as it would over 0s
+    sum_value = 0
     sumcursor = arcpy.da.SearchCursor(table, "SUM")
     for row in sumcursor:
         sum_value = row[0]
 
-    del row
     del sumcursor
 
     arcpy.Delete_management(buf_raster)
@@ -47,3 +61,343 @@ def segmentArea(feature, buf_size, temp):
 
     return area_value
 
+
+
+# # # Batched zonal statistics for every segment of a network in one pass over the raster # # #
+
+# segments are summarized this many at a time so the zone index of a regional network stays bounded
+CHUNK_SIZE = 50000
+
+# the segment by segment loop saves its partial results every this many segments
+CHECKPOINT_EVERY = 500
+
+# ways the tools can run the segment zonal statistics: one batched pass over the raster, segment by segment
+# on a process pool, or segment by segment with arcpy in this process
+ZONAL_STATS = ("batched", "parallel", "serial")
+
+
+def zonalStatsOptions(method, workers=2):
+    """batch and workers arguments of the tools' rasterToTable for one of the ZONAL_STATS methods"""
+    if method not in ZONAL_STATS:
+        raise Exception("Unknown zonal statistics method " + str(method))
+    return {"batch": method == "batched", "workers": max(workers, 2) if method == "parallel" else 1}
+
+
+def readSegments(network, id_field="OID@"):
+    """Reads the segment ids and shapely geometries of a network feature class. Whole number ids, object
+    ids or id fields stored as doubles alike, come back as 64 bit integers"""
+    ids = []
+    geoms = []
+    cursor = arcpy.da.SearchCursor(network, [id_field, "SHAPE@WKB"])
+    for row in cursor:
+        ids.append(row[0])
+        geoms.append(wkb.loads(bytes(row[1])))
+    del cursor
+
+    return segmentKeys(ids), geoms
+
+
+def featureSRS(features):
+    """WKT of the coordinate system of a feature class, empty when it is unknown. Geometries read from it are
+    projected with it onto the grids they are burned on"""
+    sr = arcpy.Describe(features).spatialReference
+    if sr.name == "Unknown":
+        return ""
+    return sr.exportToString().split(";")[0]
+
+
+def segmentKeys(ids):
+    """Casts ids to 64 bit integer keys when every one of them is a whole number"""
+    ids = np.asarray(ids)
+    if np.issubdtype(ids.dtype, np.integer):
+        return ids.astype(np.int64)
+    if np.issubdtype(ids.dtype, np.floating) and np.all(np.isfinite(ids)) and np.all(ids == np.round(ids)) \
+            and np.all(np.abs(ids) < 2 ** 53):
+        return ids.astype(np.int64)
+    return ids
+
+
+def uniqueKeys(ids, id_field):
+    """Raises an error if the segment ids are not unique, results are joined back on them"""
+    if len(np.unique(ids)) != len(ids):
+        raise Exception("Segment id field " + id_field + " must hold a unique value for every segment")
+    return ids
+
+
+def readFeatures(features, fields):
+    """Reads attribute columns and shapely geometries of a feature class in one cursor pass"""
+    rows = []
+    geoms = []
+    cursor = arcpy.da.SearchCursor(features, list(fields) + ["SHAPE@WKB"])
+    for row in cursor:
+        rows.append(row[:-1])
+        geoms.append(wkb.loads(bytes(row[-1])))
+    del cursor
+
+    columns = {}
+    for i, field in enumerate(fields):
+        columns[field] = np.asarray([row[i] for row in rows])
+    return columns, geoms
+
+
+def bufferSegments(geoms, buf_dist):
+    """Buffers each segment with flat ends, the same zones segmentSum builds one at a time"""
+    return [geom.buffer(buf_dist, cap_style=2) for geom in geoms]
+
+
+def batchZonalStats(zones, raster, overlap=False, srs=None):
+    """Calculates the sum and cell count of a raster for every zone polygon in a single pass.
+    Without overlap a shared pixel goes to the last zone drawn, as with PolygonToRaster. Zones in another
+    coordinate system (srs) are projected to the raster's"""
+    rasterDS = gdal.Open(raster)
+    band = rasterDS.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    geotransform = rasterDS.GetGeoTransform()
+    projection = rasterDS.GetProjection()
+    zones = RasterBlocks.projectGeoms(zones, srs, projection)
+
+    n = len(zones)
+    if overlap:
+        groups = ZoneIndex.overlapLayers(zones)
+    else:
+        groups = [np.arange(n)]
+    # labels are 1 based positions so 0 is left for cells outside every zone
+    layers = [RasterBlocks.zoneLayer([zones[i] for i in group], group + 1, projection) for group in groups]
+
+    sums = np.zeros(n + 1, np.float64)
+    counts = np.zeros(n + 1, np.int64)
+    for window in RasterBlocks.blockWindows(band):
+        values = band.ReadAsArray(*window).astype(np.float64)
+        valid = RasterBlocks.validMask(values, nodata)
+        for layer in layers:
+            labels = RasterBlocks.rasterizeWindow(layer, geotransform, projection, *window)
+            inzone = valid & (labels > 0)
+            if not inzone.any():
+                continue
+            # only the label range present in the block is counted, not every zone of a large network
+            present = labels[inzone]
+            lo = int(present.min())
+            span = int(present.max()) + 1 - lo
+            sums[lo:lo + span] += np.bincount(present - lo, weights=values[inzone], minlength=span)
+            counts[lo:lo + span] += np.bincount(present - lo, minlength=span)
+
+    return sums[1:], counts[1:]
+
+
+def segmentStats(network, raster, buf_dist, overlap=True):
+    """Returns the ids, raster sum, cell count and buffer area of every network segment zone"""
+    ids, geoms = readSegments(network)
+    zones = bufferSegments(geoms, buf_dist)
+    sums, counts = batchZonalStats(zones, raster, overlap, featureSRS(network))
+    areas = np.asarray([zone.area for zone in zones], np.float64)
+
+    return ids, sums, counts, areas
+
+
+def segmentsHash(ids, geoms, srs=""):
+    """Hash of the segment ids, geometries as read and their coordinate system, any edit to either gives
+    another hash"""
+    sha = hashlib.sha1(np.ascontiguousarray(ids).tobytes())
+    sha.update(str(np.asarray(ids).dtype).encode("utf-8"))
+    sha.update(srs.encode("utf-8"))
+    for geom in geoms:
+        sha.update(geom.wkb)
+    return sha.hexdigest()
+
+
+def _indexFile(segments_hash, raster, buf_dist, scratch, overlap, chunk=None):
+    """Scratch path of the cached zone index of a set of segments, or of one chunk of it, on a raster's grid"""
+    rasterDS = gdal.Open(raster)
+    key = repr((segments_hash, rasterDS.GetGeoTransform(), rasterDS.RasterXSize, rasterDS.RasterYSize,
+                rasterDS.GetProjection(), buf_dist, overlap, chunk))
+    return scratch + "/zone_index_" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".npz"
+
+
+def segmentIndex(network, raster, buf_dist, scratch, overlap=True, id_field="OID@"):
+    """Returns the zone index of the network segment buffers on a raster's grid. The index is saved
+    in the scratch folder and reused by every later raster on the same grid and segments"""
+    ids, geoms = readSegments(network, id_field)
+    uniqueKeys(ids, id_field)
+    srs = featureSRS(network)
+    index_file = _indexFile(segmentsHash(ids, geoms, srs), raster, buf_dist, scratch, overlap)
+    if os.path.exists(index_file):
+        return ZoneIndex.ZoneIndex.load(index_file)
+
+    index = ZoneIndex.ZoneIndex.fromRaster(bufferSegments(geoms, buf_dist), ids, raster, overlap, srs=srs)
+    index.save(index_file)
+
+    return index
+
+
+def chunkedSegmentStats(network, raster, buf_dist, scratch, overlap=True, id_field="OID@", chunk_size=CHUNK_SIZE):
+    """Returns the ids, raster sum, cell count and buffer area of every network segment zone. Spatially
+    coherent chunks of at most chunk_size segments get a zone index of their own, each cached in the
+    scratch folder, so memory does not grow with the size of the network. Zones overlapping across chunks
+    count shared cells toward both, as they do in one index with overlap"""
+    ids, geoms = readSegments(network, id_field)
+    uniqueKeys(ids, id_field)
+    chunks = spatialChunks(geoms, int(np.ceil(len(geoms) / float(chunk_size))))
+    srs = featureSRS(network)
+
+    # finished chunks are saved as they complete so a rerun on the same inputs carries on after them
+    segments_hash = segmentsHash(ids, geoms, srs)
+    key = Checkpoint.fingerprint([segments_hash, raster, buf_dist, overlap, chunk_size])
+    progress = Checkpoint.Progress(scratch + "/zonal_progress_" + str(key)[:16] + ".npz", key)
+    saved = progress.load()
+    if saved is not None:
+        sums, counts, areas, done = saved["sums"], saved["counts"], saved["areas"], saved["done"]
+    else:
+        sums = np.zeros(len(ids), np.float64)
+        counts = np.zeros(len(ids), np.float64)
+        areas = np.zeros(len(ids), np.float64)
+        done = np.zeros(len(chunks), bool)
+
+    for number, positions in enumerate(chunks):
+        if done[number]:
+            continue
+        index_file = _indexFile(segments_hash, raster, buf_dist, scratch, overlap, (chunk_size, number))
+        if os.path.exists(index_file):
+            index = ZoneIndex.ZoneIndex.load(index_file)
+        else:
+            zones = bufferSegments([geoms[p] for p in positions], buf_dist)
+            index = ZoneIndex.ZoneIndex.fromRaster(zones, ids[positions], raster, overlap, srs=srs)
+            index.save(index_file)
+        sums[positions], counts[positions] = index.stats(raster)
+        areas[positions] = index.areas
+        done[number] = True
+        progress.save(sums=sums, counts=counts, areas=areas, done=done)
+
+    progress.clear()
+    return ids, sums, counts, areas
+
+
+def serialSegmentStats(network, raster, buf_size, scratch, source, id_field="OID@", area=True,
+                       checkpoint_every=CHECKPOINT_EVERY):
+    """Runs segmentSum, and segmentArea with area, one segment at a time. Partial results are saved every
+    checkpoint_every segments, keyed on the network and the source raster file, so a rerun skips the
+    segments already done"""
+    key = Checkpoint.fingerprint([network, source, buf_size, id_field, area])
+    progress = Checkpoint.Progress(scratch + "/segment_progress_" + str(key)[:16] + ".npz", key)
+    saved = progress.load()
+    id_l, sum_l, area_l = [], [], []
+    if saved is not None:
+        id_l, sum_l, area_l = saved["ids"].tolist(), saved["sums"].tolist(), saved["areas"].tolist()
+    start = len(id_l)
+
+    cursor = arcpy.da.SearchCursor(network, [id_field, "SHAPE@"])
+    for position, row in enumerate(cursor):
+        if position < start:
+            continue
+        id_l.append(row[0])
+        sum_l.append(segmentSum(row[1], raster, buf_size, scratch))
+        if area:
+            area_l.append(segmentArea(row[1], buf_size, scratch))
+        if len(id_l) % checkpoint_every == 0:
+            progress.save(ids=np.asarray(id_l), sums=np.asarray(sum_l, np.float64),
+                          areas=np.asarray(area_l, np.float64))
+    del cursor
+
+    progress.clear()
+    ids = uniqueKeys(segmentKeys(id_l), id_field)
+    return ids, np.asarray(sum_l, np.float64), np.asarray(area_l, np.float64)
+
+
+# # # Process pool version of the segment by segment loop # # #
+
+def spatialChunks(geoms, n_chunks):
+    """Splits segment positions into n_chunks spatially coherent groups along a Z-order curve of the
+    segment centroids, so each worker touches a compact part of the raster"""
+    if len(geoms) == 0:
+        return []
+    xy = np.asarray([geom.centroid.coords[0][:2] for geom in geoms], np.float64).reshape(-1, 2)
+    span = np.maximum(xy.max(axis=0) - xy.min(axis=0), 1e-9)
+    q = ((xy - xy.min(axis=0)) / span * 65535).astype(np.uint64)
+
+    # interleave the bits of the quantized x and y into one morton code
+    code = np.zeros(len(q), np.uint64)
+    for bit in range(16):
+        code |= ((q[:, 0] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit)
+        code |= ((q[:, 1] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + 1)
+    order = np.argsort(code, kind="mergesort")
+
+    return [chunk for chunk in np.array_split(order, min(n_chunks, len(order))) if len(chunk) > 0]
+
+
+def _chunkWorker(args):
+    """Runs segmentSum and segmentArea for one chunk of segments in a scratch folder of its own"""
+    raster, buf_size, scratch, spatial_reference, segments = args
+    temp = os.path.join(scratch, "zs_" + str(os.getpid()) + "_" + uuid.uuid4().hex[:8])
+    os.mkdir(temp)
+    arcpy.env.overwriteOutput = True
+    arcpy.CheckOutExtension("spatial")
+
+    # the chunk's segments come with the task as WKB, the network is never read again in the worker
+    sr = arcpy.SpatialReference()
+    sr.loadFromString(spatial_reference)
+    results = []
+    for position, segment_wkb in segments:
+        feature = arcpy.FromWKB(bytearray(segment_wkb), sr)
+        results.append((position, segmentSum(feature, raster, buf_size, temp), segmentArea(feature, buf_size, temp)))
+
+    arcpy.CheckInExtension("spatial")
+    shutil.rmtree(temp, ignore_errors=True)
+
+    return results
+
+
+def parallelSegmentStats(network, raster, buf_size, scratch, workers=None, chunks_per_worker=4, id_field="OID@"):
+    """Runs the segment by segment sum and area on a process pool. The raster must be saved on disk.
+    Results come back in the order of the network's features"""
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    # inside ArcMap sys.executable is the application, so child processes have to be pointed at python
+    if not os.path.basename(sys.executable).lower().startswith("python"):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "python.exe"))
+
+    ids, geoms = readSegments(network, id_field)
+    uniqueKeys(ids, id_field)
+    chunks = spatialChunks(geoms, workers * chunks_per_worker)
+    spatial_reference = arcpy.Describe(network).spatialReference.exportToString()
+    tasks = [(raster, buf_size, scratch, spatial_reference, [(int(p), geoms[p].wkb) for p in chunk])
+             for chunk in chunks]
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.map(_chunkWorker, tasks, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+    sums, areas = gatherChunks(len(ids), results)
+    return ids, sums, areas
+
+
+def gatherChunks(count, results):
+    """Sum and area arrays in the order of the network's features from the (position, sum, area) lists the
+    chunks return, whatever order the chunks and their segments come in"""
+    sums = np.zeros(count, np.float64)
+    areas = np.zeros(count, np.float64)
+    for result in results:
+        for position, sval, aval in result:
+            sums[position] = sval
+            areas[position] = aval
+    return sums, areas
+
+
+def featureSummary(features, id_field, rasters, statistics=("mean",), names=None):
+    """Summarizes several rasters over the polygons of a feature class in one read of each raster.
+    Polygons sharing an id form one zone, as they do in ZonalStatisticsAsTable"""
+    ids, geoms = readSegments(features, id_field)
+    return zoneSummary(ids, geoms, rasters, statistics, names, featureSRS(features))
+
+
+def zoneSummary(ids, geoms, rasters, statistics=("mean",), names=None, srs=None):
+    """featureSummary for polygons already in memory, in the coordinate system srs"""
+    parts = {}
+    for key, geom in zip(ids.tolist(), geoms):
+        parts.setdefault(key, []).append(geom)
+    keys = sorted(parts)
+    zones = [unary_union(parts[key]) for key in keys]
+
+    return ZoneIndex.zonalSummary(zones, np.asarray(keys, ids.dtype), rasters, statistics, names, srs=srs)
@@ -0,0 +1,115 @@
+# # # Two pass min/max normalization of rasters that never holds more than one block in memory # # #
+
+# the first pass runs through the blocks collecting the range of the values (and a histogram when the scale
+# is clipped to percentiles), the second pass computes the blocks again and writes them rescaled
+
+from osgeo import gdal
+import numpy as np
+import Corridor
+import RasterBlocks
+
+
+class StreamingRange:
+    """Running minimum, maximum and histogram of values seen block by block. The histogram keeps a fixed
+    number of bins and doubles their width whenever new values fall outside its range, so percentiles are
+    good to one bin width without knowing the range in advance"""
+
+    def __init__(self, bins=4096, histogram=False):
+        self.bins = bins
+        self.histogram = histogram
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.count = 0
+        self.counts = np.zeros(bins, np.int64)
+        self.lo = None
+        self.width = None
+
+    def update(self, values):
+        """Adds the finite values of a block"""
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        self.count += len(values)
+        if not self.histogram:
+            return
+
+        if self.lo is None:
+            self.lo = self.minimum
+            self.width = max((self.maximum - self.minimum) / self.bins, 1e-12)
+        while self.minimum < self.lo or self.maximum >= self.lo + self.width * self.bins:
+            merged = self.counts.reshape(-1, 2).sum(axis=1)
+            if self.minimum < self.lo:
+                # old range becomes the upper half
+                self.lo -= self.width * self.bins
+                self.counts = np.concatenate((np.zeros(self.bins // 2, np.int64), merged))
+            else:
+                self.counts = np.concatenate((merged, np.zeros(self.bins // 2, np.int64)))
+            self.width *= 2
+
+        index = np.minimum(((values - self.lo) / self.width).astype(np.int64), self.bins - 1)
+        self.counts += np.bincount(index, minlength=self.bins)
+
+    def percentile(self, q):
+        """Approximate percentile from the histogram, interpolated inside the bin it falls in"""
+        if not self.histogram or self.count == 0:
+            raise Exception("Percentiles need a histogram with data in it")
+        target = q / 100.0 * self.count
+        cumulative = np.cumsum(self.counts)
+        b = int(np.searchsorted(cumulative, target))
+        b = min(b, self.bins - 1)
+        below = cumulative[b - 1] if b > 0 else 0
+        inside = self.counts[b]
+        fraction = (target - below) / inside if inside else 0.0
+        value = self.lo + (b + fraction) * self.width
+        return min(max(value, self.minimum), self.maximum)
+
+
+def rasterSource(raster):
+    """Block function reading a raster as float with nan for nodata"""
+    rasterDS = gdal.Open(raster)
+    band = rasterDS.GetRasterBand(1)
+
+    def read(xoff, yoff, xsize, ysize):
+        return RasterBlocks.readFloat(band, xoff, yoff, xsize, ysize)
+    return read
+
+
+def normalize(source, template, output, new_min=1.0, new_max=10.0, clip=None, corridor=None):
+    """Rescales the values a block function gives for each window of the template's grid to
+    new_min - new_max. clip = (low, high) percentiles clamps the scale to that part of the distribution.
+    The block function is called twice per window, so nothing the size of the raster is kept. With a corridor
+    only the tiles it touches are scaled (by their own range) and written"""
+    templateDS = gdal.Open(template)
+    windows = list(Corridor.windows(templateDS, corridor))
+
+    stats = StreamingRange(histogram=clip is not None)
+    for window in windows:
+        stats.update(source(*window))
+    if stats.count == 0:
+        raise Exception("No data to normalize")
+
+    if clip is None:
+        lo, hi = stats.minimum, stats.maximum
+    else:
+        lo, hi = stats.percentile(clip[0]), stats.percentile(clip[1])
+    scale = (new_max - new_min) / (hi - lo) if hi > lo else 0.0
+
+    outDS = RasterBlocks.createLike(output, templateDS, gdal.GDT_Float32, RasterBlocks.NODATA, corridor is not None)
+    outBand = outDS.GetRasterBand(1)
+    for window in windows:
+        values = source(*window)
+        missing = ~np.isfinite(values)
+        result = new_min + (np.clip(values, lo, hi) - lo) * scale
+        result[missing] = RasterBlocks.NODATA
+        outBand.WriteArray(result.astype(np.float32), window[0], window[1])
+    outBand.FlushCache()
+
+    return output
+
+
+def minMaxScale(array):
+    """Scales an array to 0 - 1 by its own minimum and maximum"""
+    array = np.asarray(array, np.float64)
+    return (array - array.min()) / (array.max() - array.min())
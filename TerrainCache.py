@@ -0,0 +1,170 @@
+# # # Cache of terrain derivatives shared by every WRAT tool that works from the same DEM # # #
+
+# products are keyed on a hash of the DEM's content plus the parameters they were derived with, so a DEM
+# copied into another project still hits the cache and an edited DEM never does. Each product is built under
+# a temporary name and renamed into place, then gets a small .json sidecar, which is what makes an entry
+# valid. The drainage area and degree slope are also copied to Flow/DrainArea_sqkm.tif and
+# Slope/slope_deg.tif next to the DEM, where the tools used to write them and users still look for them
+
+import hashlib
+import json
+import os
+import shutil
+from osgeo import gdal
+import TerrainRouting
+
+# bump when a derivation changes so older cached rasters are not reused
+CACHE_VERSION = 1
+
+# copies of cached products kept next to the DEM, by product and parameters
+LEGACY_OUTPUTS = {("drainarea", (("units", "sqkm"),)): "Flow/DrainArea_sqkm.tif",
+                  ("slope", (("units", "DEGREE"),)): "Slope/slope_deg.tif"}
+
+
+def fileHash(path, chunk_size=1048576):
+    """sha1 of a raster's content. Folder based rasters (ESRI grids) hash every file in the folder"""
+    sha = hashlib.sha1()
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, dirs, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+    for name in files:
+        with open(name, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def replaceFile(temp, path):
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temp, path)
+
+
+def readJSON(path):
+    """Contents of a json file, None when it is missing or can not be read"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def writeJSON(path, value):
+    """Writes a json file under a temporary name and renames it, so it is never read half written"""
+    temp = path + "." + str(os.getpid()) + ".tmp"
+    with open(temp, "w") as f:
+        json.dump(value, f)
+    replaceFile(temp, path)
+
+
+class TerrainCache:
+    """Hands out slope, filled DEM, flow direction, flow accumulation and drainage area rasters for a DEM,
+    building each one only if no valid cached copy exists"""
+
+    def __init__(self, dem, folder=None):
+        self.dem = dem
+        if folder is None:
+            folder = os.path.dirname(dem) + "/Terrain_Cache"
+        self.folder = folder
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        self.dem_hash = self.demHash()
+
+    def demHash(self):
+        """Content hash of the DEM, remembered per path, size and modification time so it is read once"""
+        memo_file = os.path.join(self.folder, "dem_hashes.json")
+        memo = readJSON(memo_file)
+        if not isinstance(memo, dict):
+            memo = {}
+        stamp = [os.path.getsize(self.dem), os.path.getmtime(self.dem)]
+        entry = memo.get(os.path.abspath(self.dem))
+        if entry is not None and entry["stamp"] == stamp:
+            return entry["hash"]
+
+        dem_hash = fileHash(self.dem)
+        memo[os.path.abspath(self.dem)] = {"stamp": stamp, "hash": dem_hash}
+        writeJSON(memo_file, memo)
+        return dem_hash
+
+    def path(self, product, params):
+        """Cache file of a product for this DEM and a set of parameters"""
+        key = json.dumps([CACHE_VERSION, product, sorted(params.items())])
+        param_hash = hashlib.sha1(key.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.folder, product + "_" + param_hash + "_" + self.dem_hash[:12] + ".tif")
+
+    def valid(self, output):
+        """A cached raster is valid if its sidecar matches the file on disk and GDAL can open it"""
+        record = readJSON(output + ".json")
+        if not os.path.exists(output) or not isinstance(record, dict):
+            return False
+        if record.get("dem_hash") != self.dem_hash or record.get("size") != os.path.getsize(output):
+            return False
+        return gdal.Open(output) is not None
+
+    def get(self, product, params, build):
+        """Returns the cached raster of a product, calling build(path) first if there is none. It is built
+        under a temporary name, so a run that stops part way never leaves a raster that looks finished"""
+        output = self.path(product, params)
+        if not self.valid(output):
+            temp = os.path.splitext(output)[0] + "_" + str(os.getpid()) + "_tmp.tif"
+            try:
+                build(temp)
+            except Exception:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
+            replaceFile(temp, output)
+            writeJSON(output + ".json", {"product": product, "params": params, "dem": os.path.abspath(self.dem),
+                                         "dem_hash": self.dem_hash, "size": os.path.getsize(output)})
+
+        legacy = LEGACY_OUTPUTS.get((product, tuple(sorted(params.items()))))
+        if legacy is not None:
+            self.export(output, os.path.join(os.path.dirname(self.dem), legacy))
+        return output
+
+    def export(self, output, path):
+        """Copies a cached raster to a path outside the cache unless the copy there is already current. Copies
+        keep the modification time of the cached raster, so a current one has the same size and time"""
+        if os.path.exists(path) and os.path.getsize(path) == os.path.getsize(output) and \
+                os.path.getmtime(path) == os.path.getmtime(output):
+            return path
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        temp = os.path.splitext(path)[0] + "_" + str(os.getpid()) + "_tmp.tif"
+        shutil.copy2(output, temp)
+        replaceFile(temp, path)
+        return path
+
+    def slope(self, units="DEGREE"):
+        """Slope in DEGREE or PERCENT_RISE"""
+        return self.get("slope", {"units": units},
+                        lambda output: TerrainRouting.slope_raster(self.dem, output, units))
+
+    def filled(self):
+        """Depression filled DEM"""
+        return self.get("fill", {}, lambda output: TerrainRouting.fill_depressions(self.dem, output))
+
+    def flowDirection(self):
+        """D-infinity flow direction of the filled DEM"""
+        fill = self.filled()
+        return self.get("fd", {"method": "dinf"},
+                        lambda output: TerrainRouting.flow_direction_d_inf(fill, output))
+
+    def flowAccumulation(self):
+        """D-infinity flow accumulation in cells"""
+        fill = self.filled()
+        fd = self.flowDirection()
+        return self.get("fa", {"method": "dinf"},
+                        lambda output: TerrainRouting.flow_accumulation(fd, fill, output))
+
+    def drainageArea(self):
+        """Drainage area in square km"""
+        fa = self.flowAccumulation()
+        return self.get("drainarea", {"units": "sqkm"},
+                        lambda output: TerrainRouting.drainage_area(fa, output))
@@ -0,0 +1,614 @@
+# # # Depression filling and D-infinity flow routing on NumPy arrays # # #
+
+# replaces arcpy Fill and the pygeoprocessing 0.5 routing functions. The file level functions keep the names
+# and arguments of pygeoprocessing.routing so fill.tif, fd.tif and fa.tif are produced the same way:
+# fd.tif holds the D-infinity flow angle in radians counter-clockwise from east, fa.tif the number of cells
+# (including the cell itself) that drain through each cell.
+# Depressions are filled with the Planchon-Darboux water level and not with a priority-flood. Both give the
+# same surface, the spill levels with an epsilon rise across flats, but a priority-flood visits cells one at a
+# time from a heap, a Python loop per cell, while here whole rows are updated with numpy. Each round sweeps
+# the grid in four directions, and a drainage path needs about one round for every time it turns back on
+# itself (a spiral or a maze of nested rims), so the worst case is about one round per two rows or columns
+
+from collections import deque
+import os
+from osgeo import gdal
+import numpy as np
+import RasterBlocks
+import StreamNormalize
+
+FD_NODATA = -1.0
+FA_NODATA = -1.0
+
+# grids with more cells than this are filled and accumulated tile by tile. The in-memory versions hold around
+# a dozen float64 arrays of the grid at once, about 400 MB at this size
+MAX_IN_MEMORY_CELLS = 4000000
+
+# neighbor offsets (row, col) in the order of the D-infinity angle, east first and counter-clockwise
+DIRECTIONS = [(0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1), (1, 0), (1, 1)]
+
+# triangular facets of Tarboton (1997): cardinal neighbor, diagonal neighbor, ac, af and whether the
+# cardinal step is along x
+FACETS = [((0, 1), (-1, 1), 0, 1, True),
+          ((-1, 0), (-1, 1), 1, -1, False),
+          ((-1, 0), (-1, -1), 1, 1, False),
+          ((0, -1), (-1, -1), 2, -1, True),
+          ((0, -1), (1, -1), 2, 1, True),
+          ((1, 0), (1, -1), 3, -1, False),
+          ((1, 0), (1, 1), 3, 1, False),
+          ((0, 1), (1, 1), 4, -1, True)]
+
+
+def epsilonStep(z):
+    """Smallest rise used to give filled flats a gradient, at least two float32 steps at any elevation"""
+    return z + abs(z) * 2.4e-7 + 1e-6
+
+
+def edgeCells(valid):
+    """Valid cells next to nodata or to the edge of the array, the outlets the fill drains to"""
+    rows, cols = valid.shape
+    padded = np.pad(valid, 1, "constant")
+    edge = np.zeros((rows, cols), bool)
+    for dy, dx in DIRECTIONS:
+        edge |= ~padded[1 + dy:rows + 1 + dy, 1 + dx:cols + 1 + dx]
+    return edge & valid
+
+
+def _sweep(water, z, update, rows, transpose=False):
+    """One Gauss-Seidel pass of the Planchon-Darboux update over the given rows of a padded grid. Each row
+    takes the lowest neighbor water level plus a step and keeps it unless that is below the ground. Rows see
+    the rows already updated in this pass, so a level can travel the whole grid in one pass"""
+    if transpose:
+        water, z, update = water.T, z.T, update.T
+    step = epsilonStep(water)
+    changed = False
+    for r in rows:
+        if not update[r].any():
+            continue
+        lowest = np.minimum(step[r, :-2], step[r, 2:])
+        for row in (r - 1, r + 1):
+            lowest = np.minimum(lowest, step[row, :-2])
+            lowest = np.minimum(lowest, step[row, 1:-1])
+            lowest = np.minimum(lowest, step[row, 2:])
+        current = water[r, 1:-1]
+        level = np.maximum(z[r, 1:-1], np.minimum(current, lowest))
+        lower = update[r, 1:-1] & (level < current)
+        if lower.any():
+            changed = True
+            current[lower] = level[lower]
+            step[r, 1:-1][lower] = epsilonStep(level[lower])
+    return changed
+
+
+def planchonDarboux(water, z, update):
+    """Lowers the water level of the update cells of a grid padded by one cell until every one of them is on
+    the ground or a step above a neighbor (Planchon and Darboux 2001). Cells outside update keep their level,
+    which is how outlets and the levels of neighboring tiles come in. Sweeps down, up, right and left repeat
+    until a round changes nothing. Returns whether any level changed"""
+    rows = water.shape[0] - 2
+    cols = water.shape[1] - 2
+    changed = False
+    while True:
+        round_changed = _sweep(water, z, update, range(1, rows + 1))
+        round_changed |= _sweep(water, z, update, range(rows, 0, -1))
+        round_changed |= _sweep(water, z, update, range(1, cols + 1), transpose=True)
+        round_changed |= _sweep(water, z, update, range(cols, 0, -1), transpose=True)
+        if not round_changed:
+            return changed
+        changed = True
+
+
+def fillDepressions(dem, valid):
+    """Fills depressions so every valid cell has a strictly downhill path to the grid edge or to nodata.
+    The fill is the Planchon-Darboux water level with an epsilon step on flats, computed with numpy sweeps"""
+    rows, cols = dem.shape
+    z = np.full((rows + 2, cols + 2), np.inf)
+    z[1:-1, 1:-1] = np.where(valid, dem, np.inf)
+    outlets = edgeCells(valid)
+
+    # water starts infinitely high except on the outlets, nodata and the padding never hold water
+    water = np.full((rows + 2, cols + 2), np.inf)
+    water[1:-1, 1:-1][outlets] = dem[outlets]
+    update = np.zeros((rows + 2, cols + 2), bool)
+    update[1:-1, 1:-1] = valid & ~outlets
+    planchonDarboux(water, z, update)
+
+    return np.where(valid, water[1:-1, 1:-1], np.nan)
+
+
+def dinfBlock(z, cell_width, cell_height):
+    """D-infinity flow angle for the interior of a block padded by one cell, nan marks missing cells.
+    Cells without a downhill facet get FD_NODATA"""
+    rows = z.shape[0] - 2
+    cols = z.shape[1] - 2
+    e0 = z[1:-1, 1:-1]
+    best_slope = np.full((rows, cols), -np.inf)
+    best_angle = np.full((rows, cols), FD_NODATA)
+
+    with np.errstate(invalid="ignore"):
+        for (c1, c2, ac, af, along_x) in FACETS:
+            if along_x:
+                d1, d2 = cell_width, cell_height
+            else:
+                d1, d2 = cell_height, cell_width
+            e1 = z[1 + c1[0]:rows + 1 + c1[0], 1 + c1[1]:cols + 1 + c1[1]]
+            e2 = z[1 + c2[0]:rows + 1 + c2[0], 1 + c2[1]:cols + 1 + c2[1]]
+            s1 = (e0 - e1) / d1
+            s2 = (e1 - e2) / d2
+            r = np.arctan2(s2, s1)
+            s = np.hypot(s1, s2)
+
+            # keep the steepest direction inside the facet
+            rmax = np.arctan2(d2, d1)
+            low = r < 0
+            r[low] = 0
+            s[low] = s1[low]
+            high = r > rmax
+            r[high] = rmax
+            s[high] = ((e0 - e2) / np.hypot(d1, d2))[high]
+
+            better = s > best_slope
+            best_slope[better] = s[better]
+            best_angle[better] = af * r[better] + ac * np.pi / 2
+
+        best_angle = np.mod(best_angle, 2 * np.pi)
+        best_angle[~(best_slope > 0) | np.isnan(e0)] = FD_NODATA
+
+    return best_angle
+
+
+def receivers(angles, valid):
+    """Flow graph of a D-infinity angle grid as flat source, destination and proportion arrays"""
+    rows, cols = angles.shape
+    flowing = valid & (angles != FD_NODATA)
+    src = np.flatnonzero(flowing)
+    a = angles.ravel()[src]
+    sector = np.pi / 4
+    k = np.floor(a / sector).astype(np.int64) % 8
+    frac = a / sector - np.floor(a / sector)
+
+    r = src // cols
+    c = src % cols
+    dy = np.asarray([d[0] for d in DIRECTIONS])
+    dx = np.asarray([d[1] for d in DIRECTIONS])
+
+    parts = []
+    for step, weight in ((k, 1 - frac), ((k + 1) % 8, frac)):
+        nr = r + dy[step]
+        nc = c + dx[step]
+        keep = (weight > 1e-9) & (nr >= 0) & (nr < rows) & (nc >= 0) & (nc < cols)
+        dst = nr[keep] * cols + nc[keep]
+        keep_dst = valid.ravel()[dst]
+        parts.append((src[keep][keep_dst], dst[keep_dst], weight[keep][keep_dst]))
+
+    return (np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts]),
+            np.concatenate([p[2] for p in parts]))
+
+
+def accumulate(src, dst, weight, initial):
+    """Propagates initial amounts down a flow graph in topological order, one wavefront of cells whose
+    upstream cells are all done at a time, and returns the accumulated amounts"""
+    n = len(initial)
+    acc = np.asarray(initial, np.float64).copy()
+    order = np.argsort(src, kind="mergesort")
+    src = src[order]
+    dst = dst[order]
+    weight = weight[order]
+    ptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n))))
+    pending = np.bincount(dst, minlength=n)
+
+    frontier = np.flatnonzero(pending == 0)
+    while len(frontier):
+        start = ptr[frontier]
+        count = ptr[frontier + 1] - start
+        frontier = frontier[count > 0]
+        start = start[count > 0]
+        count = count[count > 0]
+        if len(frontier) == 0:
+            break
+        # flat positions of every outgoing edge of the frontier cells
+        edges = np.repeat(start - np.cumsum(np.concatenate(([0], count[:-1]))), count) + np.arange(count.sum())
+        np.add.at(acc, dst[edges], acc[src[edges]] * weight[edges])
+        targets = dst[edges]
+        np.subtract.at(pending, targets, 1)
+        targets = np.unique(targets)
+        frontier = targets[pending[targets] == 0]
+
+    return acc
+
+
+def flowAccumulationDinf(angles, valid):
+    """Number of cells draining through each cell of a D-infinity angle grid, the cell included"""
+    src, dst, weight = receivers(angles, valid)
+    acc = accumulate(src, dst, weight, valid.ravel().astype(np.float64))
+    return acc.reshape(angles.shape)
+
+
+# # # file level functions with the pygeoprocessing.routing names # # #
+
+def fill_depressions(dem_uri, filled_uri, tile_size=None):
+    """Writes a depression filled copy of a DEM with the DEM's nodata value. Grids larger than
+    MAX_IN_MEMORY_CELLS, or any grid when tile_size is given, go through the tiled out-of-core version"""
+    demDS = gdal.Open(dem_uri)
+    if tile_size is not None or demDS.RasterXSize * demDS.RasterYSize > MAX_IN_MEMORY_CELLS:
+        return fill_depressions_tiled(dem_uri, filled_uri, tile_size or 2048)
+
+    band = demDS.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    dem = RasterBlocks.readFloat(band, 0, 0, demDS.RasterXSize, demDS.RasterYSize)
+    valid = ~np.isnan(dem)
+    filled = fillDepressions(dem, valid)
+    del dem
+
+    if nodata is None:
+        nodata = RasterBlocks.NODATA
+    outDS = RasterBlocks.createLike(filled_uri, demDS, gdal.GDT_Float32, nodata)
+    filled[~valid] = nodata
+    outDS.GetRasterBand(1).WriteArray(filled.astype(np.float32))
+    outDS.FlushCache()
+
+    return filled_uri
+
+
+def flow_direction_d_inf(dem_uri, flow_direction_uri, tile_size=1024):
+    """Writes the D-infinity flow angle of a filled DEM tile by tile, each tile read with a one cell halo"""
+    demDS = gdal.Open(dem_uri)
+    band = demDS.GetRasterBand(1)
+    geotransform = demDS.GetGeoTransform()
+    cols = demDS.RasterXSize
+    rows = demDS.RasterYSize
+    outDS = RasterBlocks.createLike(flow_direction_uri, demDS, gdal.GDT_Float32, FD_NODATA)
+    outBand = outDS.GetRasterBand(1)
+
+    for yoff in range(0, rows, tile_size):
+        for xoff in range(0, cols, tile_size):
+            xsize = min(tile_size, cols - xoff)
+            ysize = min(tile_size, rows - yoff)
+            # halo clipped to the grid, anything past the edge is missing
+            x0 = max(xoff - 1, 0)
+            y0 = max(yoff - 1, 0)
+            x1 = min(xoff + xsize + 1, cols)
+            y1 = min(yoff + ysize + 1, rows)
+            z = np.full((ysize + 2, xsize + 2), np.nan)
+            z[y0 - yoff + 1:y1 - yoff + 1, x0 - xoff + 1:x1 - xoff + 1] = \
+                RasterBlocks.readFloat(band, x0, y0, x1 - x0, y1 - y0)
+            angles = dinfBlock(z, abs(geotransform[1]), abs(geotransform[5]))
+            outBand.WriteArray(angles.astype(np.float32), xoff, yoff)
+
+    outBand.FlushCache()
+
+    return flow_direction_uri
+
+
+def flow_accumulation(flow_direction_uri, dem_uri, flow_accumulation_uri, tile_size=None):
+    """Writes the D-infinity flow accumulation (in cells) of a flow direction raster. Grids larger than
+    MAX_IN_MEMORY_CELLS, or any grid when tile_size is given, go through the tiled out-of-core version"""
+    fdDS = gdal.Open(flow_direction_uri)
+    if tile_size is not None or fdDS.RasterXSize * fdDS.RasterYSize > MAX_IN_MEMORY_CELLS:
+        return flow_accumulation_tiled(flow_direction_uri, dem_uri, flow_accumulation_uri, tile_size or 2048)
+
+    demDS = gdal.Open(dem_uri)
+    angles = fdDS.GetRasterBand(1).ReadAsArray().astype(np.float64)
+    valid = ~np.isnan(RasterBlocks.readFloat(demDS.GetRasterBand(1), 0, 0, demDS.RasterXSize, demDS.RasterYSize))
+
+    acc = flowAccumulationDinf(angles, valid)
+    acc[~valid] = FA_NODATA
+    outDS = RasterBlocks.createLike(flow_accumulation_uri, fdDS, gdal.GDT_Float32, FA_NODATA)
+    outDS.GetRasterBand(1).WriteArray(acc.astype(np.float32))
+    outDS.FlushCache()
+
+    return flow_accumulation_uri
+
+
+# # # out-of-core flow accumulation # # #
+
+# the grid is cut into tiles. A tile is routed on its own with a one cell halo, and whatever reaches the halo is
+# flow leaving the tile, which is queued as inflow to the tile that owns those cells. Tiles are revisited with
+# only their new inflow until nothing is left to pass on. Because accumulation is linear in the amounts put in,
+# the sum of all visits equals routing the whole grid at once. Totals live in a memory-mapped grid on disk.
+# Revisits go in rounds, each tile with inflow waiting is routed at most once per round, highest first, so
+# inflow it passes down is often taken up in the same round. Inflow that has crossed k tile edges is routed by
+# round k at the latest, so a tile is visited at most 1 + C times, C being the most tile edges any flow path
+# of the grid crosses
+
+def _readHalo(band, xoff, yoff, xsize, ysize, fill_value, as_float=True):
+    """Reads a window with a one cell halo, cells past the grid edge get fill_value"""
+    x0 = max(xoff - 1, 0)
+    y0 = max(yoff - 1, 0)
+    x1 = min(xoff + xsize + 1, band.XSize)
+    y1 = min(yoff + ysize + 1, band.YSize)
+    out = np.full((ysize + 2, xsize + 2), fill_value, np.float64)
+    if as_float:
+        block = RasterBlocks.readFloat(band, x0, y0, x1 - x0, y1 - y0)
+    else:
+        block = band.ReadAsArray(x0, y0, x1 - x0, y1 - y0).astype(np.float64)
+    out[y0 - yoff + 1:y1 - yoff + 1, x0 - xoff + 1:x1 - xoff + 1] = block
+    return out
+
+
+def _tileGraph(fdBand, demBand, xoff, yoff, xsize, ysize):
+    """Flow graph of one tile and its halo, only tile cells are sources so halo cells collect outflow"""
+    angles = _readHalo(fdBand, xoff, yoff, xsize, ysize, FD_NODATA, as_float=False)
+    valid = ~np.isnan(_readHalo(demBand, xoff, yoff, xsize, ysize, np.nan))
+    interior = np.zeros(valid.shape, bool)
+    interior[1:-1, 1:-1] = True
+    angles[~interior] = FD_NODATA
+    src, dst, weight = receivers(angles, valid)
+    return src, dst, weight, valid, interior
+
+
+def flow_accumulation_tiled(flow_direction_uri, dem_uri, flow_accumulation_uri, tile_size=2048):
+    """Writes the same flow accumulation as flow_accumulation with memory bounded by the tile size"""
+    fdDS = gdal.Open(flow_direction_uri)
+    demDS = gdal.Open(dem_uri)
+    fdBand = fdDS.GetRasterBand(1)
+    demBand = demDS.GetRasterBand(1)
+    cols = fdDS.RasterXSize
+    rows = fdDS.RasterYSize
+    tiles_x = (cols + tile_size - 1) // tile_size
+    tiles_y = (rows + tile_size - 1) // tile_size
+
+    acc_file = flow_accumulation_uri + ".acc.dat"
+    acc = np.memmap(acc_file, np.float64, "w+", shape=(rows, cols))
+
+    # inflow waiting for each tile as lists of (global flat cell, amount) arrays
+    pending = {}
+    # tiles are visited highest first so inflow from above tends to arrive before a tile is routed again
+    top = {}
+
+    def route(tile, initial_cells, initial_amounts, first):
+        ty, tx = tile
+        xoff = tx * tile_size
+        yoff = ty * tile_size
+        xsize = min(tile_size, cols - xoff)
+        ysize = min(tile_size, rows - yoff)
+        src, dst, weight, valid, interior = _tileGraph(fdBand, demBand, xoff, yoff, xsize, ysize)
+        width = xsize + 2
+
+        if first:
+            initial = (valid & interior).ravel().astype(np.float64)
+        else:
+            initial = np.zeros(valid.size, np.float64)
+            local = (initial_cells // cols - yoff + 1) * width + (initial_cells % cols - xoff + 1)
+            np.add.at(initial, local, initial_amounts)
+        result = accumulate(src, dst, weight, initial).reshape(valid.shape)
+
+        acc[yoff:yoff + ysize, xoff:xoff + xsize] += np.where(valid, result, 0)[1:-1, 1:-1]
+
+        # whatever reached the halo leaves the tile
+        halo_r, halo_c = np.nonzero(~interior & (result > 0))
+        global_r = halo_r + yoff - 1
+        global_c = halo_c + xoff - 1
+        amounts = result[halo_r, halo_c]
+        target = (global_r // tile_size) * tiles_x + global_c // tile_size
+        for t in np.unique(target):
+            pick = target == t
+            key = (int(t) // tiles_x, int(t) % tiles_x)
+            pending.setdefault(key, []).append((global_r[pick] * cols + global_c[pick], amounts[pick]))
+
+    for ty in range(tiles_y):
+        for tx in range(tiles_x):
+            xsize = min(tile_size, cols - tx * tile_size)
+            ysize = min(tile_size, rows - ty * tile_size)
+            block = RasterBlocks.readFloat(demBand, tx * tile_size, ty * tile_size, xsize, ysize)
+            top[(ty, tx)] = np.nanmax(block) if (~np.isnan(block)).any() else -np.inf
+    for ty in range(tiles_y):
+        for tx in range(tiles_x):
+            route((ty, tx), None, None, True)
+
+    while pending:
+        for key in sorted(pending, key=lambda tile: -top[tile]):
+            inflow = pending.pop(key, [])
+            if not inflow:
+                continue
+            route(key, np.concatenate([cells for cells, amounts in inflow]),
+                  np.concatenate([amounts for cells, amounts in inflow]), False)
+
+    outDS = RasterBlocks.createLike(flow_accumulation_uri, fdDS, gdal.GDT_Float32, FA_NODATA)
+    outBand = outDS.GetRasterBand(1)
+    for xoff, yoff, xsize, ysize in RasterBlocks.blockWindows(outBand):
+        valid = ~np.isnan(RasterBlocks.readFloat(demBand, xoff, yoff, xsize, ysize))
+        block = np.where(valid, acc[yoff:yoff + ysize, xoff:xoff + xsize], FA_NODATA)
+        outBand.WriteArray(block.astype(np.float32), xoff, yoff)
+    outBand.FlushCache()
+
+    del acc
+    os.remove(acc_file)
+
+    return flow_accumulation_uri
+
+
+# # # slope # # #
+
+def slopeBlock(z, cell_width, cell_height, units="DEGREE"):
+    """Horn (1981) slope of the interior of a block padded by one cell, as arcpy Slope computes it.
+    Missing neighbors take the value of the center cell"""
+    center = z[1:-1, 1:-1]
+    rows, cols = center.shape
+
+    def cell(dy, dx):
+        n = z[1 + dy:rows + 1 + dy, 1 + dx:cols + 1 + dx]
+        return np.where(np.isnan(n), center, n)
+
+    a, b, c = cell(-1, -1), cell(-1, 0), cell(-1, 1)
+    d, f = cell(0, -1), cell(0, 1)
+    g, h, i = cell(1, -1), cell(1, 0), cell(1, 1)
+    dzdx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * cell_width)
+    dzdy = ((g + 2 * h + i) - (a + 2 * b + c)) / (8 * cell_height)
+    rise = np.sqrt(dzdx * dzdx + dzdy * dzdy)
+
+    if units == "PERCENT_RISE":
+        return rise * 100
+    return np.degrees(np.arctan(rise))
+
+
+def slope_raster(dem_uri, slope_uri, units="DEGREE", tile_size=1024):
+    """Writes the slope of a DEM in DEGREE or PERCENT_RISE tile by tile with the DEM's nodata value"""
+    demDS = gdal.Open(dem_uri)
+    band = demDS.GetRasterBand(1)
+    geotransform = demDS.GetGeoTransform()
+    nodata = band.GetNoDataValue()
+    if nodata is None:
+        nodata = RasterBlocks.NODATA
+    outDS = RasterBlocks.createLike(slope_uri, demDS, gdal.GDT_Float32, nodata)
+    outBand = outDS.GetRasterBand(1)
+
+    for yoff in range(0, demDS.RasterYSize, tile_size):
+        for xoff in range(0, demDS.RasterXSize, tile_size):
+            xsize = min(tile_size, demDS.RasterXSize - xoff)
+            ysize = min(tile_size, demDS.RasterYSize - yoff)
+            z = _readHalo(band, xoff, yoff, xsize, ysize, np.nan)
+            result = slopeBlock(z, abs(geotransform[1]), abs(geotransform[5]), units)
+            result[np.isnan(result)] = nodata
+            outBand.WriteArray(result.astype(np.float32), xoff, yoff)
+
+    outBand.FlushCache()
+
+    return slope_uri
+
+
+def drainage_area(flow_accumulation_uri, drainage_area_uri):
+    """Converts a flow accumulation in cells to drainage area in square km"""
+    faDS = gdal.Open(flow_accumulation_uri)
+    band = faDS.GetRasterBand(1)
+    geotransform = faDS.GetGeoTransform()
+    cell_area = abs(geotransform[1] * geotransform[5])
+    outDS = RasterBlocks.createLike(drainage_area_uri, faDS, gdal.GDT_Float32, FA_NODATA)
+    outBand = outDS.GetRasterBand(1)
+
+    for xoff, yoff, xsize, ysize in RasterBlocks.blockWindows(band):
+        fa = RasterBlocks.readFloat(band, xoff, yoff, xsize, ysize)
+        area = fa * cell_area / 1000000
+        area[np.isnan(area)] = FA_NODATA
+        outBand.WriteArray(area.astype(np.float32), xoff, yoff)
+
+    outBand.FlushCache()
+
+    return drainage_area_uri
+
+
+# # # out-of-core depression filling # # #
+
+# the Planchon-Darboux water level is the highest surface that drains, so it can be found tile by tile: a tile
+# is solved with the current levels of the cells around it held fixed, and tiles next to an edge whose levels
+# dropped are solved again until no level changes. Levels only ever go down, from infinitely high, so the tiles
+# settle on the same surface as filling the whole grid at once. Levels live in a memory-mapped grid on disk
+
+def _readLevels(levels, xoff, yoff, xsize, ysize):
+    """Water levels of a tile with a one cell halo, cells past the grid edge are infinitely high"""
+    rows, cols = levels.shape
+    x0 = max(xoff - 1, 0)
+    y0 = max(yoff - 1, 0)
+    x1 = min(xoff + xsize + 1, cols)
+    y1 = min(yoff + ysize + 1, rows)
+    out = np.full((ysize + 2, xsize + 2), np.inf)
+    out[y0 - yoff + 1:y1 - yoff + 1, x0 - xoff + 1:x1 - xoff + 1] = levels[y0:y1, x0:x1]
+    return out
+
+
+def fill_depressions_tiled(dem_uri, filled_uri, tile_size=2048):
+    """Writes the same fill as fill_depressions with memory bounded by the tile size"""
+    demDS = gdal.Open(dem_uri)
+    band = demDS.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    cols = demDS.RasterXSize
+    rows = demDS.RasterYSize
+    tiles_x = (cols + tile_size - 1) // tile_size
+    tiles_y = (rows + tile_size - 1) // tile_size
+
+    def window(tx, ty):
+        xoff = tx * tile_size
+        yoff = ty * tile_size
+        return xoff, yoff, min(tile_size, cols - xoff), min(tile_size, rows - yoff)
+
+    # outlets get their own elevation, every other cell starts infinitely high, nodata stays there
+    levels_file = filled_uri + ".fill.dat"
+    levels = np.memmap(levels_file, np.float64, "w+", shape=(rows, cols))
+    for ty in range(tiles_y):
+        for tx in range(tiles_x):
+            xoff, yoff, xsize, ysize = window(tx, ty)
+            z = _readHalo(band, xoff, yoff, xsize, ysize, np.nan)
+            valid = ~np.isnan(z)
+            z = z[1:-1, 1:-1]
+            outlets = edgeCells(valid)[1:-1, 1:-1]
+            levels[yoff:yoff + ysize, xoff:xoff + xsize] = np.where(outlets, z, np.inf)
+
+    queue = deque((tx, ty) for ty in range(tiles_y) for tx in range(tiles_x))
+    queued = set(queue)
+    while queue:
+        tx, ty = queue.popleft()
+        queued.discard((tx, ty))
+        xoff, yoff, xsize, ysize = window(tx, ty)
+        z = _readHalo(band, xoff, yoff, xsize, ysize, np.nan)
+        valid = ~np.isnan(z)
+        z[~valid] = np.inf
+        water = _readLevels(levels, xoff, yoff, xsize, ysize)
+        before = water[1:-1, 1:-1].copy()
+        update = np.zeros(water.shape, bool)
+        update[1:-1, 1:-1] = valid[1:-1, 1:-1] & (before > z[1:-1, 1:-1])
+        if not planchonDarboux(water, z, update):
+            continue
+        after = water[1:-1, 1:-1]
+        levels[yoff:yoff + ysize, xoff:xoff + xsize] = after
+
+        # neighbors across an edge or corner whose levels dropped have to be solved again
+        dropped = after < before
+        sides = {(0, -1): dropped[0].any(), (0, 1): dropped[-1].any(),
+                 (-1, 0): dropped[:, 0].any(), (1, 0): dropped[:, -1].any(),
+                 (-1, -1): dropped[0, 0], (1, -1): dropped[0, -1],
+                 (-1, 1): dropped[-1, 0], (1, 1): dropped[-1, -1]}
+        for (dx, dy), edge_dropped in sides.items():
+            neighbor = (tx + dx, ty + dy)
+            if edge_dropped and 0 <= neighbor[0] < tiles_x and 0 <= neighbor[1] < tiles_y and \
+                    neighbor not in queued:
+                queue.append(neighbor)
+                queued.add(neighbor)
+
+    if nodata is None:
+        nodata = RasterBlocks.NODATA
+    outDS = RasterBlocks.createLike(filled_uri, demDS, gdal.GDT_Float32, nodata)
+    outBand = outDS.GetRasterBand(1)
+    for ty in range(tiles_y):
+        for tx in range(tiles_x):
+            xoff, yoff, xsize, ysize = window(tx, ty)
+            filled = np.array(levels[yoff:yoff + ysize, xoff:xoff + xsize])
+            filled[np.isinf(filled)] = nodata
+            outBand.WriteArray(filled.astype(np.float32), xoff, yoff)
+    outBand.FlushCache()
+
+    del levels
+    os.remove(levels_file)
+
+    return filled_uri
+
+
+# # # topographic wetness index # # #
+
+def twi_raster(drainage_area_uri, slope_uri, valley_geoms, twi_uri, corridor=None, srs=None):
+    """Writes ln(drainage area / tan(slope)) normalized from 1 to 10 in two streaming passes. Cells inside
+    the valley bottom polygons or with an index above 100 are left out, a slope of 0 counts as 0.0001"""
+    daDS = gdal.Open(drainage_area_uri)
+    slopeDS = gdal.Open(slope_uri)
+    if not RasterBlocks.sameGrid(daDS, slopeDS):
+        raise Exception("Drainage area and slope rasters are not on the same grid")
+    da_band = daDS.GetRasterBand(1)
+    slope_band = slopeDS.GetRasterBand(1)
+    gt = daDS.GetGeoTransform()
+    projection = daDS.GetProjection()
+
+    # valley bottom polygons are burned window by window instead of being extracted as a raster
+    valley_geoms = RasterBlocks.projectGeoms(valley_geoms, srs, projection)
+    zones = RasterBlocks.zoneLayer(valley_geoms, np.ones(len(valley_geoms)), projection)
+
+    def block(xoff, yoff, xsize, ysize):
+        # calculate twi, remove values that are within the valley bottom or above 100
+        area = RasterBlocks.readFloat(da_band, xoff, yoff, xsize, ysize)
+        tan_rad = np.tan(RasterBlocks.readFloat(slope_band, xoff, yoff, xsize, ysize) * 1.570796 / 90)
+        tan_rad[tan_rad == 0] = 0.0001
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ti = np.log(area / tan_rad)
+        in_valley = RasterBlocks.rasterizeWindow(zones, gt, projection, xoff, yoff, xsize, ysize) == 1
+        ti[in_valley | (ti > 100)] = np.nan
+        return ti
+
+    return StreamNormalize.normalize(block, drainage_area_uri, twi_uri, 1, 10, corridor=corridor)
@@ -0,0 +1,298 @@
+# # # Sparse per-zone pixel index that is built once for a grid and reused for every raster on it # # #
+
+# zone cells are kept as CSR style flat arrays: the cells of zone i are cells[indptr[i]:indptr[i + 1]],
+# stored as flat row * columns + column offsets, with the fraction of each cell the zone covers in weights
+
+from osgeo import gdal
+import numpy as np
+import os
+import RasterBlocks
+
+
+def overlapLayers(zones):
+    """Splits zone polygons into groups that share no area so each group can be burned into its
+    own label raster and a pixel under neighbouring zones counts toward all of them"""
+    bounds = np.asarray([zone.bounds for zone in zones], np.float64).reshape(-1, 4)
+    order = np.argsort(bounds[:, 0], kind="mergesort")
+
+    groups = []
+    active = []
+    for i in order:
+        placed = False
+        for k in range(len(groups)):
+            # sweep along x, anything ending before this zone starts can no longer overlap it
+            active[k] = [j for j in active[k] if bounds[j, 2] >= bounds[i, 0]]
+            clash = False
+            for j in active[k]:
+                if bounds[j, 1] <= bounds[i, 3] and bounds[i, 1] <= bounds[j, 3] and \
+                        zones[i].intersects(zones[j]) and not zones[i].touches(zones[j]):
+                    clash = True
+                    break
+            if not clash:
+                groups[k].append(i)
+                active[k].append(i)
+                placed = True
+                break
+        if not placed:
+            groups.append([i])
+            active.append([i])
+
+    return [np.asarray(sorted(group), np.int64) for group in groups]
+
+
+class ZoneIndex:
+    """Maps every zone id to the grid cells it covers so any raster on the grid can be summarized
+    with one read of the raster and a gather and reduce"""
+
+    def __init__(self, ids, indptr, cells, weights, geotransform, shape, projection="", areas=None):
+        self.ids = np.asarray(ids)
+        self.indptr = np.asarray(indptr, np.int64)
+        self.cells = np.asarray(cells, np.int64)
+        self.weights = np.asarray(weights, np.float32)
+        self.geotransform = tuple(float(x) for x in geotransform)
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.projection = str(projection)
+        if areas is None:
+            areas = np.zeros(len(self.ids), np.float64)
+        self.areas = np.asarray(areas, np.float64)
+
+        # cell ordered view so each strip of a raster is read once for all zones
+        self._order = np.argsort(self.cells, kind="mergesort")
+        self._sorted = self.cells[self._order]
+
+    @classmethod
+    def build(cls, zones, ids, geotransform, shape, projection="", overlap=True, supersample=1, srs=None):
+        """Rasterizes zone polygons onto a grid. With overlap a cell belongs to every zone over it,
+        with supersample > 1 each cell is weighted by the share of its sub-cells the zone covers. Zones in
+        another coordinate system (srs, WKT) are projected to the grid's, their areas stay in their own units"""
+        n = len(zones)
+        areas = [zone_geom.area for zone_geom in zones]
+        zones = RasterBlocks.projectGeoms(zones, srs, projection)
+        rows, cols = int(shape[0]), int(shape[1])
+        s = int(supersample)
+        if overlap:
+            groups = overlapLayers(zones)
+        else:
+            groups = [np.arange(n)]
+        # labels are 1 based positions so 0 is left for cells outside every zone
+        layers = [RasterBlocks.zoneLayer([zones[i] for i in group], group + 1, projection) for group in groups]
+        fine = (geotransform[0], geotransform[1] / s, geotransform[2] / s,
+                geotransform[3], geotransform[4] / s, geotransform[5] / s)
+
+        zone_parts = []
+        cell_parts = []
+        weight_parts = []
+        strip = max(1, 4194304 // (cols * s * s))
+        for yoff in range(0, rows, strip):
+            ysize = min(strip, rows - yoff)
+            for layer in layers:
+                labels = RasterBlocks.rasterizeWindow(layer, fine, projection, 0, yoff * s, cols * s, ysize * s)
+                r, c = np.nonzero(labels)
+                if len(r) == 0:
+                    continue
+                zone = labels[r, c].astype(np.int64) - 1
+                cell = (r // s + yoff) * cols + c // s
+                if s > 1:
+                    key, count = np.unique(zone * rows * cols + cell, return_counts=True)
+                    zone = key // (rows * cols)
+                    cell = key % (rows * cols)
+                    weight = count / float(s * s)
+                else:
+                    weight = np.ones(len(cell), np.float32)
+                zone_parts.append(zone)
+                cell_parts.append(cell)
+                weight_parts.append(weight)
+
+        if zone_parts:
+            zone = np.concatenate(zone_parts)
+            cell = np.concatenate(cell_parts)
+            weight = np.concatenate(weight_parts)
+        else:
+            zone = np.zeros(0, np.int64)
+            cell = np.zeros(0, np.int64)
+            weight = np.zeros(0, np.float32)
+
+        order = np.lexsort((cell, zone))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(zone, minlength=n))))
+
+        return cls(ids, indptr, cell[order], weight[order], geotransform, (rows, cols), projection, areas)
+
+    @classmethod
+    def fromRaster(cls, zones, ids, raster, overlap=True, supersample=1, srs=None):
+        """Builds the index on the grid of an existing raster"""
+        rasterDS = gdal.Open(raster)
+        return cls.build(zones, ids, rasterDS.GetGeoTransform(), (rasterDS.RasterYSize, rasterDS.RasterXSize),
+                         rasterDS.GetProjection(), overlap, supersample, srs)
+
+    def save(self, path):
+        """Writes the index to a .npz file"""
+        np.savez(path, ids=self.ids, indptr=self.indptr, cells=self.cells, weights=self.weights,
+                 geotransform=np.asarray(self.geotransform), shape=np.asarray(self.shape),
+                 projection=np.asarray(self.projection), areas=self.areas)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written by save"""
+        data = np.load(path, allow_pickle=False)
+        return cls(data["ids"], data["indptr"], data["cells"], data["weights"], data["geotransform"],
+                   data["shape"], str(data["projection"]), data["areas"])
+
+    def matches(self, rasterDS):
+        """Checks that a raster is on the grid the index was built for"""
+        return (rasterDS.RasterYSize, rasterDS.RasterXSize) == self.shape and \
+            np.allclose(rasterDS.GetGeoTransform(), self.geotransform)
+
+    def zoneOf(self):
+        """Returns the zone position of every entry in the flat cell arrays"""
+        return np.repeat(np.arange(len(self.ids)), np.diff(self.indptr))
+
+    def gather(self, raster):
+        """Reads the raster once, strip by strip, and returns the value of every indexed cell and
+        whether it holds data"""
+        rasterDS = gdal.Open(raster)
+        if not self.matches(rasterDS):
+            raise Exception("Raster " + raster + " is not on the grid of the zone index")
+        band = rasterDS.GetRasterBand(1)
+        nodata = band.GetNoDataValue()
+        cols = self.shape[1]
+
+        values = np.zeros(len(self.cells), np.float64)
+        valid = np.zeros(len(self.cells), bool)
+        for yoff, ysize in RasterBlocks.rowWindows(band):
+            lo = np.searchsorted(self._sorted, yoff * cols, "left")
+            hi = np.searchsorted(self._sorted, (yoff + ysize) * cols, "left")
+            if lo == hi:
+                continue
+            local = self._sorted[lo:hi] - yoff * cols
+            r = local // cols
+            c = local % cols
+            # only the columns the zones reach in this strip are read
+            x0 = int(c.min())
+            block = band.ReadAsArray(x0, yoff, int(c.max()) + 1 - x0, ysize)
+            v = block[r, c - x0]
+            entries = self._order[lo:hi]
+            values[entries] = v
+            valid[entries] = RasterBlocks.validMask(v, nodata)
+
+        return values, valid
+
+    def window(self, xoff, yoff, xsize, ysize):
+        """Returns the flat entries of the indexed cells inside a window with their window row and column"""
+        cols = self.shape[1]
+        lo = np.searchsorted(self._sorted, yoff * cols, "left")
+        hi = np.searchsorted(self._sorted, (yoff + ysize) * cols, "left")
+        local = self._sorted[lo:hi]
+        r = local // cols - yoff
+        c = local % cols - xoff
+        inside = (c >= 0) & (c < xsize)
+
+        return self._order[lo:hi][inside], r[inside], c[inside]
+
+    def stats(self, raster):
+        """Returns the coverage weighted sum and cell count of a raster for every zone"""
+        values, valid = self.gather(raster)
+        zone = self.zoneOf()[valid]
+        weights = self.weights[valid]
+        sums = np.bincount(zone, weights=values[valid] * weights, minlength=len(self.ids))
+        counts = np.bincount(zone, weights=weights, minlength=len(self.ids))
+
+        return sums, counts
+
+    def summarize(self, rasters, statistics=("mean",), names=None):
+        """Reads each raster once and returns one wide table with a column per raster and statistic.
+        Statistics are sum, mean, count, min, max, std and percentiles written as p<q>, e.g. p90.
+        Sum, mean, count and std use the coverage weights, zones with no data get NaN"""
+        if names is None:
+            names = [os.path.splitext(os.path.basename(raster))[0] for raster in rasters]
+        n = len(self.ids)
+        zone_all = self.zoneOf()
+
+        columns = [("ID", self.ids.dtype)]
+        for name in names:
+            for stat in statistics:
+                columns.append((str(name + "_" + stat).upper(), np.float64))
+        table = np.zeros(n, dtype=columns)
+        table["ID"] = self.ids
+
+        for raster, name in zip(rasters, names):
+            values, valid = self.gather(raster)
+            zone = zone_all[valid]
+            v = values[valid]
+            w = self.weights[valid].astype(np.float64)
+            counts = np.bincount(zone, weights=w, minlength=n)
+            sums = np.bincount(zone, weights=v * w, minlength=n)
+            empty = counts == 0
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means = sums / counts
+
+            # sorted values per zone give min, max and percentiles without a loop over zones
+            ordered = None
+            if [stat for stat in statistics if stat in ("min", "max") or stat.startswith("p")]:
+                order = np.lexsort((v, zone))
+                ordered = v[order]
+                n_valid = np.bincount(zone, minlength=n)
+                start = np.concatenate(([0], np.cumsum(n_valid)[:-1]))
+                last = np.maximum(start + n_valid - 1, 0)
+
+            for stat in statistics:
+                if stat == "sum":
+                    result = sums
+                elif stat == "count":
+                    result = counts
+                elif stat == "mean":
+                    result = means
+                elif stat == "std":
+                    squares = np.bincount(zone, weights=v * v * w, minlength=n)
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        result = np.sqrt(np.maximum(squares / counts - means * means, 0))
+                elif stat in ("min", "max") or stat.startswith("p"):
+                    if len(ordered) == 0:
+                        result = np.zeros(n)
+                    elif stat == "min":
+                        result = ordered[np.minimum(start, len(ordered) - 1)]
+                    elif stat == "max":
+                        result = ordered[last]
+                    else:
+                        # linear interpolation between closest ranks, as np.percentile does
+                        pos = float(stat[1:]) / 100 * np.maximum(n_valid - 1, 0)
+                        lo = np.floor(pos).astype(np.int64)
+                        hi = np.ceil(pos).astype(np.int64)
+                        below = ordered[np.minimum(start + lo, len(ordered) - 1)]
+                        above = ordered[np.minimum(start + hi, len(ordered) - 1)]
+                        result = below + (above - below) * (pos - lo)
+                else:
+                    raise Exception("Unknown zonal statistic " + stat)
+                result = np.asarray(result, np.float64).copy()
+                if stat != "count" and stat != "sum":
+                    result[empty] = np.nan
+                table[str(name + "_" + stat).upper()] = result
+
+        return table
+
+
+def zonalSummary(zones, ids, rasters, statistics=("mean",), names=None, overlap=False, srs=None):
+    """Summarizes several rasters over one set of zone polygons in a single read of each raster.
+    One index is built per distinct grid among the rasters"""
+    if names is None:
+        names = [os.path.splitext(os.path.basename(raster))[0] for raster in rasters]
+
+    indexes = {}
+    table = None
+    for raster, name in zip(rasters, names):
+        rasterDS = gdal.Open(raster)
+        grid = (rasterDS.GetGeoTransform(), rasterDS.RasterXSize, rasterDS.RasterYSize, rasterDS.GetProjection())
+        if grid not in indexes:
+            indexes[grid] = ZoneIndex.fromRaster(zones, ids, raster, overlap, srs=srs)
+        part = indexes[grid].summarize([raster], statistics, [name])
+        if table is None:
+            table = part
+        else:
+            fields = [field for field in part.dtype.names if field != "ID"]
+            merged = np.zeros(len(table), dtype=table.dtype.descr + [(f, np.float64) for f in fields])
+            for field in table.dtype.names:
+                merged[field] = table[field]
+            for field in fields:
+                merged[field] = part[field]
+            table = merged
+
+    return table
@@ -0,0 +1,259 @@
+# # # Benchmarks of the WRAT hot paths on synthetic data # # #
+
+# times RasterOverlap, the segment zonal stats, TWI generation, the individual recruitment probability raster,
+# gully delineation and the LWD burn raster on data from SyntheticData. Only the arcpy free engine modules are
+# used, so the suite runs on any machine with GDAL, NumPy, SciPy and shapely. Every benchmark runs in a child
+# process of its own so its peak resident memory is measured on its own. Results are written as json with the
+# seconds, cells and segments per second and peak memory of each benchmark
+#
+# usage: python benchmarks/Benchmark.py --preset medium --output results.json
+#        python benchmarks/Benchmark.py --cells 50000000 --segments 20000 --only twi prob
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from osgeo import gdal
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import FireScenarios
+import GullyEngine
+import ProbabilityKernel
+import RasterOverlap
+import SegmentGeometry
+import SyntheticData
+import TerrainCache
+import TerrainRouting
+import ZoneIndex
+
+# DEM cells and network segments of each preset
+PRESETS = {"small": (10 ** 6, 1000),
+           "medium": (10 ** 7, 10000),
+           "large": (10 ** 8, 50000),
+           "huge": (10 ** 9, 100000)}
+
+
+def rasterCells(path):
+    rasterDS = gdal.Open(path)
+    return rasterDS.RasterXSize * rasterDS.RasterYSize
+
+
+def coldCache(dem):
+    """Removes the terrain products of the DEM so a benchmark derives them as a first run would"""
+    folder = os.path.dirname(dem) + "/Terrain_Cache"
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+
+
+def overlapBenchmark(data, scratch, workers):
+    RasterOverlap.RasterOverlap(data["mask_a"], data["mask_b"], scratch + "/overlap.tif")
+    return {"cells": rasterCells(data["mask_a"])}
+
+
+def zonalBenchmark(data, scratch, workers):
+    """The 50m flat ended segment buffers of SegmentZS summarized over the DEM"""
+    stages = {}
+    start = time.time()
+    zones = [geom.buffer(50, cap_style=2) for geom in data["segments"]]
+    stages["buffer"] = time.time() - start
+
+    start = time.time()
+    index = ZoneIndex.ZoneIndex.fromRaster(zones, data["segment_ids"], data["dem"], overlap=True)
+    stages["index"] = time.time() - start
+
+    start = time.time()
+    index.summarize([data["dem"]], ("sum", "mean", "count"), ["DEM"])
+    stages["summarize"] = time.time() - start
+
+    return {"cells": rasterCells(data["dem"]), "segments": len(data["segments"]), "stages": stages}
+
+
+def twiBenchmark(data, scratch, workers):
+    """Slope, filled DEM, D-infinity routing, drainage area and the normalized TWI from a cold terrain cache"""
+    coldCache(data["dem"])
+    terrain = TerrainCache.TerrainCache(data["dem"])
+    stages = {}
+    start = time.time()
+    slope = terrain.slope("DEGREE")
+    stages["slope"] = time.time() - start
+
+    start = time.time()
+    drainage_area = terrain.drainageArea()
+    stages["drainage_area"] = time.time() - start
+
+    start = time.time()
+    TerrainRouting.twi_raster(drainage_area, slope, data["bankfull"], scratch + "/twi_norm.tif")
+    stages["twi"] = time.time() - start
+
+    return {"cells": rasterCells(data["dem"]), "stages": stages}
+
+
+def probBenchmark(data, scratch, workers):
+    """The individual recruitment probability raster on the 10m grid from a cold terrain cache"""
+    coldCache(data["dem"])
+    output = scratch + "/individual_probability.tif"
+    ProbabilityKernel.probabilityRaster(data["evh"], data["evc"], data["bankfull"], data["dem"], scratch, output,
+                                        scratch + "/total_height.tif", scratch + "/total_cover.tif",
+                                        workers=workers)
+    return {"cells": rasterCells(output)}
+
+
+def gullyBenchmark(data, scratch, workers):
+    """Aggregation of candidate cells into gullies and their dissolve by nearest segment"""
+    stages = {}
+    start = time.time()
+    gully_geoms = GullyEngine.gullyPolygons(data["candidates"], 70, 5000)
+    stages["polygons"] = time.time() - start
+
+    start = time.time()
+    gullies, near_fid, near_dist = SegmentGeometry.dissolveByNearest(gully_geoms, data["segments"],
+                                                                     data["segment_ids"])
+    stages["dissolve"] = time.time() - start
+
+    return {"cells": rasterCells(data["candidates"]), "segments": len(data["segments"]),
+            "gullies": len(gully_geoms), "stages": stages}
+
+
+def burnBenchmark(data, scratch, workers):
+    """LWD burn raster of the fire perimeters within the segment buffers on the BpS grid"""
+    zones = [geom.buffer(50, cap_style=2) for geom in data["segments"]]
+    FireScenarios.lwdBurnRaster(data["bps"], data["fires"], zones, scratch + "/lwd_burn.tif")
+    return {"cells": rasterCells(scratch + "/lwd_burn.tif"), "segments": len(data["segments"])}
+
+
+# benchmarks in the order they run
+BENCHMARKS = [("overlap", overlapBenchmark),
+              ("zonal_stats", zonalBenchmark),
+              ("twi", twiBenchmark),
+              ("prob", probBenchmark),
+              ("gullies", gullyBenchmark),
+              ("lwd_burn", burnBenchmark)]
+
+
+def residentMB():
+    """Current resident memory of the process"""
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() / 1048576.0
+
+
+def child(connection, function, data, scratch, workers):
+    """Runs one benchmark and sends back its timing, counts and peak memory"""
+    try:
+        base = residentMB()
+        start = time.time()
+        result = function(data, scratch, workers)
+        result["seconds"] = time.time() - start
+        # ru_maxrss is in kilobytes on Linux. A forked child starts from the parent's resident memory, which
+        # is given as base_rss_mb
+        result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        result["base_rss_mb"] = base
+        connection.send((True, result))
+    except Exception:
+        connection.send((False, traceback.format_exc()))
+    connection.close()
+
+
+def runBenchmark(name, function, data, folder, workers):
+    """Runs a benchmark in a forked process with a scratch folder of its own"""
+    scratch = os.path.join(folder, name)
+    if os.path.exists(scratch):
+        shutil.rmtree(scratch)
+    os.makedirs(scratch)
+
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(False)
+    process = context.Process(target=child, args=(sender, function, data, scratch, workers))
+    process.start()
+    sender.close()
+    try:
+        ok, result = receiver.recv()
+    except EOFError:
+        # the process died before sending anything, a crash in GDAL or the out of memory killer
+        process.join()
+        ok, result = False, "benchmark process exited with code " + str(process.exitcode)
+    process.join()
+
+    if not ok:
+        return {"error": result}
+    if result.get("cells"):
+        result["cells_per_s"] = result["cells"] / result["seconds"]
+    if result.get("segments"):
+        result["segments_per_s"] = result["segments"] / result["seconds"]
+    return result
+
+
+def main(cells, segments, output, folder=None, cell_size=10.0, workers=2, only=None, seed=0, keep=False,
+         preset=None):
+    """Builds the synthetic data, runs the benchmarks and writes the results to output"""
+    temporary = folder is None
+    if temporary:
+        folder = tempfile.mkdtemp(prefix="wrat_benchmark_")
+
+    report = {"preset": preset, "cells": cells, "segments": segments, "cell_size": cell_size, "workers": workers,
+              "seed": seed, "host": platform.node(), "python": platform.python_version(),
+              "gdal": gdal.__version__, "numpy": np.__version__, "benchmarks": {}}
+    try:
+        start = time.time()
+        data = SyntheticData.build(os.path.join(folder, "data"), cells, segments, cell_size, seed)
+        report["synthetic_seconds"] = time.time() - start
+        report["dem_cells"] = rasterCells(data["dem"])
+        if keep:
+            SyntheticData.writeFeatures(os.path.join(folder, "data", "network.gpkg"), data["segments"],
+                                        data["segment_ids"])
+            SyntheticData.writeFeatures(os.path.join(folder, "data", "bankfull.gpkg"), data["bankfull"])
+            SyntheticData.writeFeatures(os.path.join(folder, "data", "fires.gpkg"), data["fires"])
+
+        for name, function in BENCHMARKS:
+            if only and name not in only:
+                continue
+            print(name)
+            result = runBenchmark(name, function, data, folder, workers)
+            report["benchmarks"][name] = result
+            if "error" in result:
+                print(result["error"])
+            else:
+                print("  %.1f s, %.0f cells/s, peak %.0f MB" % (result["seconds"], result.get("cells_per_s", 0),
+                                                                  result["peak_rss_mb"]))
+    finally:
+        if temporary and not keep:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of the WRAT hot paths on synthetic data")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--cells", type=int, help="DEM cells, overrides the preset")
+    parser.add_argument("--segments", type=int, help="network segments, overrides the preset")
+    parser.add_argument("--cell-size", type=float, default=10.0, help="DEM cell size in meters")
+    parser.add_argument("--workers", type=int, default=2, help="threads of the probability raster stages")
+    parser.add_argument("--only", nargs="+", choices=[name for name, function in BENCHMARKS])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--folder", help="where the data and outputs are written, a temporary folder by default")
+    parser.add_argument("--keep", action="store_true", help="keep the data and write the vectors as GeoPackages")
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    preset_cells, preset_segments = PRESETS[args.preset]
+    main(args.cells or preset_cells,
+         args.segments or preset_segments,
+         args.output,
+         args.folder,
+         args.cell_size,
+         args.workers,
+         args.only,
+         args.seed,
+         args.keep,
+         args.preset)
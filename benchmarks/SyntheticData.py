@@ -0,0 +1,246 @@
+# # # Synthetic WRAT inputs for benchmarking # # #
+
+# a DEM, LANDFIRE-like EVH, EVC and BpS class rasters with attribute tables, a branching stream network, bankfull
+# polygons and fire perimeters, all on one projected extent. Rasters are written strip by strip and the noise they
+# are made of is interpolated from a small coarse grid, so a 10^9 cell DEM never has to fit in memory. The same
+# seed always gives the same data
+
+import math
+import os
+import sys
+from collections import deque
+from osgeo import gdal, ogr, osr
+from scipy import ndimage
+from shapely.geometry import LineString, Polygon
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import LandfireLUT
+import RasterBlocks
+
+# UTM zone 11N (NAD83), where the tools are usually run
+EPSG = 26911
+ORIGIN = (500000.0, 5200000.0)
+
+# nodata of the synthetic rasters
+DEM_NODATA = -9999.0
+CLASS_NODATA = -9999
+MASK_NODATA = -128
+
+# classes of the LANDFIRE products that the tools give no value to
+OTHER_HEIGHT = ["Herb Height 0 to 0.5 meters", "Shrub Height 0.5 to 1.0 meters"]
+OTHER_COVER = ["Herb Cover >= 10 and < 20%", "Shrub Cover >= 20 and < 30%"]
+OTHER_GROUPVEG = ["Grassland", "Shrubland", "Sparse"]
+
+
+def projection():
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+    return srs.ExportToWkt()
+
+
+def gridShape(cells):
+    """Side of the square grid closest to the requested number of cells"""
+    side = max(int(round(math.sqrt(cells))), 16)
+    return side, side
+
+
+def extent(shape, cell_size):
+    """(minx, miny, maxx, maxy) of a grid at the origin"""
+    rows, cols = shape
+    return ORIGIN[0], ORIGIN[1] - rows * cell_size, ORIGIN[0] + cols * cell_size, ORIGIN[1]
+
+
+def coarseField(shape, spacing, rng):
+    """Random values on a grid of one point every spacing cells, with a margin for interpolation"""
+    return rng.random((shape[0] // spacing + 4, shape[1] // spacing + 4))
+
+
+def sampleField(field, spacing, yoff, ysize, xsize, order=3):
+    """Values of a coarse field interpolated onto rows yoff to yoff + ysize of the fine grid"""
+    rows, cols = np.mgrid[yoff:yoff + ysize, 0:xsize].astype(np.float32)
+    return ndimage.map_coordinates(field, [rows / spacing + 1, cols / spacing + 1], order=order, mode="nearest")
+
+
+def createRaster(path, shape, cell_size, datatype, nodata):
+    gt = (ORIGIN[0], cell_size, 0.0, ORIGIN[1], 0.0, -cell_size)
+    return RasterBlocks.createGrid(path, gt, projection(), shape[1], shape[0], datatype, nodata)
+
+
+def demRaster(path, cells, cell_size=10.0, seed=0):
+    """Terrain rising away from an outlet at the middle of the bottom edge, with hills interpolated from a
+    coarse random field and a little cell noise"""
+    rng = np.random.default_rng(seed)
+    shape = gridShape(cells)
+    hills = coarseField(shape, 64, rng)
+    outDS = createRaster(path, shape, cell_size, gdal.GDT_Float32, DEM_NODATA)
+    band = outDS.GetRasterBand(1)
+    cx = shape[1] / 2.0
+    xsize = band.XSize
+    for yoff, ysize in RasterBlocks.rowWindows(band):
+        rows, cols = np.mgrid[yoff:yoff + ysize, 0:xsize]
+        distance = np.hypot(cols - cx, shape[0] - rows) * cell_size
+        z = 1000 + 0.08 * distance + 150 * sampleField(hills, 64, yoff, ysize, xsize)
+        z += rng.random(z.shape) * 0.5
+        band.WriteArray(z.astype(np.float32), 0, yoff)
+    band.FlushCache()
+    outDS = None
+    return path
+
+
+def classRaster(path, cells, cell_size, field, classes, seed=0, patch=16):
+    """Patches of random classes with a raster attribute table holding the class names in field. Values are
+    1 to the number of classes"""
+    rng = np.random.default_rng(seed)
+    shape = gridShape(cells)
+    patches = coarseField(shape, patch, rng) * len(classes)
+    outDS = createRaster(path, shape, cell_size, gdal.GDT_Int16, CLASS_NODATA)
+    band = outDS.GetRasterBand(1)
+    xsize = band.XSize
+    for yoff, ysize in RasterBlocks.rowWindows(band):
+        values = np.floor(sampleField(patches, patch, yoff, ysize, xsize, order=0)).astype(np.int16) + 1
+        band.WriteArray(np.minimum(values, len(classes)), 0, yoff)
+
+    rat = gdal.RasterAttributeTable()
+    rat.CreateColumn("VALUE", gdal.GFT_Integer, gdal.GFU_MinMax)
+    rat.CreateColumn(field, gdal.GFT_String, gdal.GFU_Name)
+    rat.SetRowCount(len(classes))
+    for row, name in enumerate(classes):
+        rat.SetValueAsInt(row, 0, row + 1)
+        rat.SetValueAsString(row, 1, name)
+    band.SetDefaultRAT(rat)
+    band.FlushCache()
+    outDS = None
+    return path
+
+
+def maskRaster(path, cells, cell_size, fraction, seed=0, patch=8):
+    """Clumps of 1s covering about fraction of the grid, nodata elsewhere, like the thresholded slope and
+    drainage area rasters the gullies are found in"""
+    rng = np.random.default_rng(seed)
+    shape = gridShape(cells)
+    field = coarseField(shape, patch, rng)
+    # linear interpolation narrows the spread of the values, the threshold is taken from a sample of them
+    threshold = np.quantile(sampleField(field, patch, 0, min(shape[0], 256), shape[1], order=1), 1 - fraction)
+    outDS = createRaster(path, shape, cell_size, gdal.GDT_Int16, MASK_NODATA)
+    band = outDS.GetRasterBand(1)
+    xsize = band.XSize
+    for yoff, ysize in RasterBlocks.rowWindows(band):
+        values = sampleField(field, patch, yoff, ysize, xsize, order=1)
+        band.WriteArray(np.where(values > threshold, 1, MASK_NODATA).astype(np.int16), 0, yoff)
+    band.FlushCache()
+    outDS = None
+    return path
+
+
+def streamNetwork(bounds, segments, seed=0, vertices=6):
+    """Branching network grown upstream from an outlet at the middle of the bottom edge. Returns the segment
+    ids, LineStrings and the number of confluences between each segment and the outlet"""
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = bounds
+    length = math.sqrt((maxx - minx) * (maxy - miny) / segments)
+    step = length / (vertices - 1)
+    # a tributary joins at one segment in about 2 sqrt(segments) / ln(segments), so the longest path is some
+    # sqrt(segments) segments and the network spreads across the extent instead of fanning out near the outlet
+    branching = min(0.5 * math.log(segments) / math.sqrt(segments), 0.6) if segments > 1 else 0
+    cx = (minx + maxx) / 2.0
+    cy = (miny + maxy) / 2.0
+
+    geoms = []
+    depths = []
+    queue = deque([((cx, miny + step), math.pi / 2, 0)])
+    while len(geoms) < segments:
+        (x, y), heading, depth = queue.popleft()
+        points = [(x, y)]
+        for i in range(vertices - 1):
+            heading += rng.normal(0, 0.15)
+            x += step * math.cos(heading)
+            y += step * math.sin(heading)
+            if not (minx < x < maxx and miny < y < maxy):
+                # turned back towards the middle of the extent at the edges
+                x = min(max(x, minx + step), maxx - step)
+                y = min(max(y, miny + step), maxy - step)
+                heading = math.atan2(cy - y, cx - x)
+            points.append((x, y))
+        geoms.append(LineString(points))
+        depths.append(depth)
+        for i in range(2 if rng.random() < branching else 1):
+            queue.append(((x, y), heading + rng.uniform(-0.6, 0.6), depth + 1))
+
+    return np.arange(1, segments + 1, dtype=np.int64), geoms, np.asarray(depths)
+
+
+def bankfullPolygons(geoms, depths, max_width=30.0, min_width=3.0):
+    """Channel polygons around the segments, narrowing upstream"""
+    widths = np.maximum(max_width * 0.85 ** np.asarray(depths, np.float64), min_width)
+    return [geom.buffer(width / 2) for geom, width in zip(geoms, widths)]
+
+
+def firePerimeters(bounds, count, coverage=0.2, seed=0, vertices=48):
+    """Irregular blobs scattered over the extent, covering roughly coverage of it"""
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = bounds
+    radius = math.sqrt(coverage * (maxx - minx) * (maxy - miny) / count / math.pi)
+    angles = np.linspace(0, 2 * math.pi, vertices, endpoint=False)
+    geoms = []
+    for i in range(count):
+        x = rng.uniform(minx, maxx)
+        y = rng.uniform(miny, maxy)
+        r = radius * rng.uniform(0.5, 1.5)
+        wobble = np.ones(vertices)
+        for k in (2, 3, 5):
+            wobble += rng.uniform(0, 0.3) * np.sin(k * angles + rng.uniform(0, 2 * math.pi))
+        geoms.append(Polygon(zip(x + r * wobble * np.cos(angles), y + r * wobble * np.sin(angles))).buffer(0))
+    return geoms
+
+
+def writeFeatures(path, geoms, ids=None):
+    """Writes geometries with an ID field to a GeoPackage layer, for running the tools on the synthetic data"""
+    if ids is None:
+        ids = np.arange(1, len(geoms) + 1)
+    driver = ogr.GetDriverByName("GPKG")
+    if os.path.exists(path):
+        driver.DeleteDataSource(path)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+    outDS = driver.CreateDataSource(path)
+    layer = outDS.CreateLayer(os.path.splitext(os.path.basename(path))[0], srs)
+    layer.CreateField(ogr.FieldDefn("ID", ogr.OFTInteger64))
+    layer.StartTransaction()
+    for geom_id, geom in zip(np.asarray(ids).tolist(), geoms):
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField("ID", geom_id)
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(geom.wkb))
+        layer.CreateFeature(feature)
+    layer.CommitTransaction()
+    outDS = None
+    return path
+
+
+def build(folder, cells, segments, cell_size=10.0, seed=0, fires=None):
+    """Writes the synthetic rasters to a folder and returns them with the network, bankfull polygons and
+    fire perimeters. The DEM has about cells cells, the LANDFIRE rasters are at three times its cell size"""
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    if fires is None:
+        fires = max(segments // 500, 4)
+
+    data = {"cell_size": cell_size}
+    data["dem"] = demRaster(os.path.join(folder, "dem.tif"), cells, cell_size, seed)
+    landfire = max(cells // 9, 256)
+    data["evh"] = classRaster(os.path.join(folder, "evh.tif"), landfire, cell_size * 3, "CLASSNAMES",
+                              sorted(LandfireLUT.MAX_HEIGHT) + OTHER_HEIGHT, seed + 1)
+    data["evc"] = classRaster(os.path.join(folder, "evc.tif"), landfire, cell_size * 3, "CLASSNAMES",
+                              sorted(LandfireLUT.MAX_COVER) + OTHER_COVER, seed + 2)
+    data["bps"] = classRaster(os.path.join(folder, "bps.tif"), landfire, cell_size * 3, "GROUPVEG",
+                              sorted(LandfireLUT.LWD) + OTHER_GROUPVEG, seed + 3)
+    data["mask_a"] = maskRaster(os.path.join(folder, "mask_a.tif"), cells, cell_size, 0.3, seed + 4)
+    data["mask_b"] = maskRaster(os.path.join(folder, "mask_b.tif"), cells, cell_size, 0.3, seed + 5)
+    data["candidates"] = maskRaster(os.path.join(folder, "candidates.tif"), cells, cell_size, 0.05, seed + 6, 4)
+
+    bounds = extent(gridShape(cells), cell_size)
+    data["segment_ids"], data["segments"], depths = streamNetwork(bounds, segments, seed + 7)
+    data["bankfull"] = bankfullPolygons(data["segments"], depths)
+    data["fires"] = firePerimeters(bounds, fires, seed=seed + 8)
+
+    return data
@@ -0,0 +1,29 @@
+# # # Shared pytest setup, the tool modules live at the top of the repository # # #
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def raster(tmp_path):
+    """Writes an array to a single band GeoTIFF in the test folder and returns its path"""
+    pytest.importorskip("osgeo")
+    from osgeo import gdal
+    import RasterBlocks
+
+    datatypes = {"float32": gdal.GDT_Float32, "float64": gdal.GDT_Float64, "int16": gdal.GDT_Int16,
+                 "int32": gdal.GDT_Int32}
+
+    def write(name, array, nodata=None, geotransform=(0.0, 10.0, 0.0, 0.0, 0.0, -10.0)):
+        path = str(tmp_path / name)
+        rows, cols = array.shape
+        outDS = RasterBlocks.createGrid(path, geotransform, "", cols, rows, datatypes[array.dtype.name], nodata)
+        outDS.GetRasterBand(1).WriteArray(array)
+        outDS.FlushCache()
+        outDS = None
+        return path
+
+    return write
@@ -0,0 +1,66 @@
+# # # Tests that a rerun on the same analysis grid skips every stage # # #
+
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+import AnalysisGrid
+import Checkpoint
+import Pipeline
+
+GT = (0.0, 30.0, 0.0, 300.0, 0.0, -30.0)
+
+
+def distanceStage(template, output):
+    with open(output, "w") as f:
+        f.write(template)
+    return output
+
+
+def probabilityStage(distance, slope, output):
+    with open(output, "w") as f:
+        f.write(distance + slope)
+    return output
+
+
+def runAnalysis(source, scratch, log):
+    # laid out as the probability raster is, a stage on the template and one on an aligned virtual raster
+    grid = AnalysisGrid.AnalysisGrid.fromRaster(source, scratch, 10)
+    template = grid.template()
+    pipeline = Pipeline.Pipeline(1, log, Checkpoint.Checkpoints(scratch))
+    distance = scratch + "/distance.txt"
+    pipeline.add("distance", distanceStage, (template, distance), outputs=[distance])
+    slope = pipeline.add("slope", grid.align, (source, "bilinear"))
+    output = scratch + "/probability.txt"
+    pipeline.add("probability", probabilityStage, (distance, slope, output), requires=["distance"],
+                 outputs=[output])
+    pipeline.run()
+
+
+def test_template_of_the_same_grid_is_not_rewritten(raster, tmp_path):
+    source = raster("source.tif", np.ones((10, 10), np.float32), geotransform=GT)
+    template = AnalysisGrid.AnalysisGrid.fromRaster(source, str(tmp_path), 10).template()
+    os.utime(template, (1000000000, 1000000000))
+
+    assert AnalysisGrid.AnalysisGrid.fromRaster(source, str(tmp_path), 10).template() == template
+    assert os.path.getmtime(template) == 1000000000
+    assert not os.path.exists(template + ".tmp")
+
+    AnalysisGrid.AnalysisGrid.fromRaster(source, str(tmp_path), 15).template()
+    assert os.path.getmtime(template) != 1000000000
+
+
+def test_rerun_skips_every_stage(raster, tmp_path):
+    source = raster("source.tif", np.ones((10, 10), np.float32), geotransform=GT)
+    scratch = str(tmp_path / "scratch")
+    os.mkdir(scratch)
+
+    first = []
+    runAnalysis(source, scratch, first.append)
+    assert not [message for message in first if "skipped" in message]
+
+    second = []
+    runAnalysis(source, scratch, second.append)
+    skipped = [message.split(" unchanged")[0] for message in second if "skipped" in message]
+    assert sorted(skipped) == ["distance", "probability", "slope"]
@@ -0,0 +1,95 @@
+# # # Tests of the columnar attribute table # # #
+
+import numpy as np
+import pytest
+
+pytest.importorskip("arcpy")
+pytest.importorskip("osgeo")
+import AttributeTable
+
+
+def test_ids_must_be_unique():
+    with pytest.raises(Exception):
+        AttributeTable.AttributeTable([1, 2, 2])
+
+
+def test_lookup():
+    table = AttributeTable.AttributeTable([30, 10, 20])
+    position, found = table.lookup([20, 40, 30, 10])
+    assert found.tolist() == [True, False, True, True]
+    assert position[found].tolist() == [2, 0, 1]
+
+
+def test_lookup_on_an_empty_table():
+    position, found = AttributeTable.AttributeTable([]).lookup([1, 2])
+    assert found.tolist() == [False, False]
+
+
+def test_add_aligned_column_checks_length():
+    table = AttributeTable.AttributeTable([1, 2, 3])
+    table.add("A", [4, 5, 6])
+    assert table["A"].tolist() == [4, 5, 6]
+    with pytest.raises(Exception):
+        table.add("B", [1, 2])
+
+
+def test_add_by_ids_fills_missing_with_default():
+    table = AttributeTable.AttributeTable([1, 2, 3])
+    column = table.add("A", [20.0, 30.0, 90.0], ids=[2, 3, 9])
+    assert np.isnan(column[0])
+    assert column[1:].tolist() == [20.0, 30.0]
+    column = table.add("B", [7, 8], ids=[3, 1], default=0)
+    assert column.tolist() == [8, 0, 7]
+
+
+def test_join():
+    table = AttributeTable.AttributeTable([1, 2, 3])
+    other = AttributeTable.AttributeTable([3, 1])
+    other.add("A", [0.3, 0.1])
+    other.add("B", [30, 10])
+    table.join(other, ["A"])
+    assert "A" in table and "B" not in table
+    assert table["A"][[0, 2]].tolist() == [0.1, 0.3]
+    assert np.isnan(table["A"][1])
+
+
+def test_records_field_types():
+    table = AttributeTable.AttributeTable(np.array([1, 2 ** 40], np.int64))
+    table.add("SMALL", np.array([1, 2], np.int64))
+    table.add("VALUE", np.array([0.5, 1.5], np.float32))
+    records = table.records()
+    assert records.dtype["ID"] == np.int64
+    assert records.dtype["SMALL"] == np.int32
+    assert records.dtype["VALUE"] == np.float64
+    assert records["ID"].tolist() == [1, 2 ** 40]
+
+
+def test_save_load_and_fingerprint(tmp_path):
+    table = AttributeTable.AttributeTable([5, 6])
+    table.add("A", [1.5, 2.5])
+    table.save(str(tmp_path / "table.npz"))
+    loaded = AttributeTable.AttributeTable.load(str(tmp_path / "table.npz"))
+    assert loaded.ids.tolist() == [5, 6]
+    assert loaded["A"].tolist() == [1.5, 2.5]
+    assert loaded.fingerprint() == table.fingerprint()
+    loaded.add("A", [1.5, 3.5])
+    assert loaded.fingerprint() != table.fingerprint()
+
+
+def test_rekey_moves_rows_onto_a_copy_with_new_object_ids():
+    # geodatabase object ids with gaps, in the cursor order of the input, and the 0 based ids of its copy
+    input_ids = np.array([1, 3, 7, 8, 12])
+    copy_ids = np.arange(5)
+    table = AttributeTable.AttributeTable([12, 7, 1, 8, 3])
+    table.add("REL_PROB", [0.12, 0.07, 0.01, 0.08, 0.03])
+    moved = table.rekey(input_ids, copy_ids)
+    assert moved.ids.tolist() == [0, 1, 2, 3, 4]
+    assert moved["REL_PROB"].tolist() == [0.01, 0.03, 0.07, 0.08, 0.12]
+
+
+def test_rekey_leaves_out_rows_without_a_new_id():
+    table = AttributeTable.AttributeTable([5, 9])
+    table.add("A", [1.0, 2.0])
+    moved = table.rekey([9, 4], [0, 1])
+    assert moved.ids.tolist() == [0]
+    assert moved["A"].tolist() == [2.0]
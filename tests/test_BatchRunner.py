@@ -0,0 +1,163 @@
+# # # Tests of the job table of the multi-HUC batch runner # # #
+
+import json
+import socket
+import subprocess
+import sys
+import time
+import types
+import pytest
+import BatchRunner
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Job table holding the jobs of two HUCs"""
+    path = str(tmp_path / "jobs.sqlite")
+    BatchRunner.createTable(path)
+    BatchRunner.loadJobs(path, [{"huc": "1701", "steps": [{"tool": "individual", "params": {}}]},
+                                {"huc": "1702", "steps": [{"tool": "episodic", "params": {}}]}])
+    return path
+
+
+@pytest.fixture
+def tools(monkeypatch):
+    """Tools of a module of the test's own, recording the parameters of every call"""
+    calls = []
+    module = types.ModuleType("batch_tools")
+
+    def first(value):
+        calls.append(("first", {"value": value}))
+        return value + "/network.shp"
+
+    def second(network, workers=2):
+        calls.append(("second", {"network": network, "workers": workers}))
+        if module.fail:
+            raise ValueError("broken")
+        return 3
+
+    module.first = first
+    module.second = second
+    module.fail = False
+    monkeypatch.setitem(sys.modules, "batch_tools", module)
+    monkeypatch.setattr(BatchRunner, "TOOLS", {"first": ("batch_tools", "first"),
+                                               "second": ("batch_tools", "second")})
+    monkeypatch.setattr(BatchRunner, "SERIAL_TOOLS", ["second"])
+    return module, calls
+
+
+def job(database, huc, *columns):
+    connection = BatchRunner.connect(database)
+    row = connection.execute("SELECT " + ", ".join(columns) + " FROM jobs WHERE huc = ?", (huc,)).fetchone()
+    connection.close()
+    return row
+
+
+def setJob(database, huc, **values):
+    connection = BatchRunner.connect(database)
+    with connection:
+        connection.execute("UPDATE jobs SET " + ", ".join(key + " = ?" for key in values) + " WHERE huc = ?",
+                           list(values.values()) + [huc])
+    connection.close()
+
+
+def deadPid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_reloading_the_manifest_keeps_the_status_of_jobs(database):
+    setJob(database, "1701", status="done")
+    BatchRunner.loadJobs(database, [{"huc": "1701", "steps": []}, {"huc": "1703", "steps": []}])
+    assert BatchRunner.pendingJobs(database) == ["1702", "1703"]
+    assert job(database, "1701", "status") == ("done",)
+
+
+def test_manifest_with_a_duplicate_huc_or_unknown_tool_is_rejected(tmp_path):
+    for jobs in ([{"huc": 1701, "steps": []}, {"huc": "1701", "steps": []}],
+                 [{"huc": "1701", "steps": [{"tool": "unknown"}]}]):
+        manifest = str(tmp_path / "manifest.json")
+        with open(manifest, "w") as f:
+            json.dump(jobs, f)
+        with pytest.raises(Exception):
+            BatchRunner.readManifest(manifest)
+
+
+def test_a_job_is_claimed_once(database):
+    assert BatchRunner.claimJob(database, "1701")
+    assert not BatchRunner.claimJob(database, "1701")
+    status, attempts, host, pid = job(database, "1701", "status", "attempts", "host", "pid")
+    assert (status, attempts, host) == ("running", 1, socket.gethostname())
+    assert BatchRunner.pendingJobs(database) == ["1702"]
+
+
+def test_process_alive():
+    assert BatchRunner.processAlive(BatchRunner.os.getpid())
+    assert not BatchRunner.processAlive(deadPid())
+
+
+def test_interrupted_jobs_go_back_to_pending(database):
+    here = socket.gethostname()
+    now = time.time()
+    BatchRunner.loadJobs(database, [{"huc": huc, "steps": []} for huc in ("1703", "1704", "1705")])
+    # dead process of this host, live process of this host, expired and fresh lease of another host
+    setJob(database, "1701", status="running", host=here, pid=deadPid(), heartbeat=now, next_step=1)
+    setJob(database, "1702", status="running", host=here, pid=BatchRunner.os.getpid(), heartbeat=now)
+    setJob(database, "1703", status="running", host="elsewhere", pid=1, heartbeat=now - 100)
+    setJob(database, "1704", status="running", host="elsewhere", pid=1, heartbeat=now - 10)
+    # a job that never recorded a heartbeat falls back to when it started
+    setJob(database, "1705", status="running", host="elsewhere", pid=1, started=now - 100)
+
+    assert BatchRunner.resetInterrupted(database, lease=50) == 3
+    assert BatchRunner.pendingJobs(database) == ["1701", "1703", "1705"]
+    # the job resumes at the step it was on
+    assert job(database, "1701", "next_step", "pid") == (1, None)
+    assert job(database, "1704", "status") == ("running",)
+
+
+def test_previous_results_are_passed_on(database, tools):
+    module, calls = tools
+    steps = [{"tool": "first", "params": {"value": "huc"}}, {"tool": "second", "params": {"network": "@previous"}}]
+    BatchRunner.loadJobs(database, [{"huc": "1703", "steps": steps}])
+    BatchRunner.claimJob(database, "1703")
+
+    assert BatchRunner.runJob((database, "1703")) == ("1703", True)
+    # tools that are not thread safe get a single worker
+    assert calls == [("first", {"value": "huc"}), ("second", {"network": "huc/network.shp", "workers": 1})]
+    status, next_step, results = job(database, "1703", "status", "next_step", "results")
+    assert (status, next_step, json.loads(results)) == ("done", 2, ["huc/network.shp", 3])
+    assert [timing["tool"] for timing in BatchRunner.summary(database)["details"][2]["timings"]] == ["first", "second"]
+
+
+def test_failed_jobs_are_retried_from_the_failed_step(database, tools):
+    module, calls = tools
+    steps = [{"tool": "first", "params": {"value": "huc"}},
+             {"tool": "second", "params": {"network": "@previous", "workers": 4}}]
+    BatchRunner.loadJobs(database, [{"huc": "1703", "steps": steps}])
+    module.fail = True
+
+    for attempt in range(2):
+        BatchRunner.claimJob(database, "1703")
+        assert BatchRunner.runJob((database, "1703")) == ("1703", False)
+        assert "ValueError: broken" in job(database, "1703", "error")[0]
+        BatchRunner.settleErrors(database, max_attempts=2)
+    assert job(database, "1703", "status", "attempts", "next_step") == ("failed", 2, 1)
+    assert BatchRunner.summary(database)["failed"] == ["1703"]
+
+    module.fail = False
+    assert BatchRunner.retryFailed(database) == 1
+    BatchRunner.claimJob(database, "1703")
+    assert BatchRunner.runJob((database, "1703")) == ("1703", True)
+    # the first step ran once, the second got its result and kept the workers it was given
+    assert [name for name, params in calls] == ["first", "second", "second", "second"]
+    assert calls[-1] == ("second", {"network": "huc/network.shp", "workers": 4})
+    assert job(database, "1703", "status", "error") == ("done", None)
+
+
+def test_crashed_worker_is_recorded_as_an_error(database):
+    BatchRunner.claimJob(database, "1701")
+    BatchRunner.markCrashed(database, "1701", -11)
+    assert job(database, "1701", "status", "error") == ("error", "worker exited with code -11")
+    BatchRunner.settleErrors(database, max_attempts=1)
+    assert BatchRunner.jobStatus(database, "1701") == "failed"
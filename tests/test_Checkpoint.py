@@ -0,0 +1,113 @@
+# # # Tests of stage checkpoints # # #
+
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+import Checkpoint
+
+calls = []
+
+
+def copyStage(source, output, factor=1):
+    """Copies a text file, repeated factor times"""
+    calls.append(source)
+    with open(source) as f:
+        text = f.read()
+    with open(output, "w") as f:
+        f.write(text * factor)
+    return len(text) * factor
+
+
+def writeText(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+
+@pytest.fixture
+def stage(tmp_path):
+    del calls[:]
+    source = writeText(str(tmp_path / "source.txt"), "abc")
+    output = str(tmp_path / "output.txt")
+    checkpoints = Checkpoint.Checkpoints(str(tmp_path / "scratch"))
+
+    def run(factor=1, function=copyStage):
+        return checkpoints.run("copy", function, (source, output), {"factor": factor}, [output])
+
+    return run, source, output
+
+
+def test_unchanged_stage_is_skipped(stage):
+    run, source, output = stage
+    assert run() == (3, False)
+    assert run() == (3, True)
+    assert len(calls) == 1
+
+
+def test_changed_argument_reruns(stage):
+    run, source, output = stage
+    run()
+    assert run(factor=2) == (6, False)
+    assert len(calls) == 2
+
+
+def test_changed_input_file_reruns(stage):
+    run, source, output = stage
+    run()
+    writeText(source, "abcd")
+    assert run() == (4, False)
+
+
+def test_changed_or_missing_output_reruns(stage):
+    run, source, output = stage
+    run()
+    writeText(output, "something else")
+    assert run() == (3, False)
+    os.remove(output)
+    assert run() == (3, False)
+    assert len(calls) == 3
+
+
+def test_lambda_is_never_skipped(stage):
+    run, source, output = stage
+    function = lambda source, output, factor=1: copyStage(source, output, factor)
+    run(function=function)
+    run(function=function)
+    assert len(calls) == 2
+
+
+def test_function_fingerprint_follows_its_code():
+    first = {}
+    second = {}
+    exec("def stage(x):\n    return x + 1\n", first)
+    exec("def stage(x):\n    return x + 2\n", second)
+    assert Checkpoint.fingerprint(first["stage"]) != Checkpoint.fingerprint(second["stage"])
+    assert Checkpoint.fingerprint(copyStage) == Checkpoint.fingerprint(copyStage)
+
+
+def test_fingerprint_of_arrays_and_unknown_objects():
+    assert Checkpoint.fingerprint(np.arange(3)) != Checkpoint.fingerprint(np.arange(3, dtype=np.int32))
+    assert Checkpoint.fingerprint([1, object()]) is None
+
+
+def test_feature_class_in_a_geodatabase_follows_the_geodatabase(tmp_path):
+    gdb = tmp_path / "data.gdb"
+    gdb.mkdir()
+    table = writeText(str(gdb / "a0000000a.gdbtable"), "rows")
+    feature_class = os.path.join(str(gdb), "network")
+    assert Checkpoint.geodatabase(feature_class) == str(gdb)
+    before = Checkpoint.fingerprint(feature_class)
+    writeText(table, "more rows")
+    assert Checkpoint.fingerprint(feature_class) != before
+    assert Checkpoint.fingerprint(os.path.join(str(tmp_path), "connection.sde", "network")) is None
+
+
+def test_progress_is_tied_to_its_key(tmp_path):
+    path = str(tmp_path / "progress.npz")
+    Checkpoint.Progress(path, "key").save(done=np.arange(4))
+    assert Checkpoint.Progress(path, "key").load()["done"].tolist() == [0, 1, 2, 3]
+    assert Checkpoint.Progress(path, "other").load() is None
+    Checkpoint.Progress(path, "key").clear()
+    assert Checkpoint.Progress(path, "key").load() is None
@@ -0,0 +1,63 @@
+# # # Tests of the euclidean distance raster # # #
+
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+from shapely.geometry import box
+import DistanceTransform
+import RasterBlocks
+
+GT = (0.0, 10.0, 0.0, 200.0, 0.0, -10.0)
+
+
+def test_distance_block_uses_the_cell_size():
+    sources = np.zeros((3, 4), bool)
+    sources[0, 0] = True
+    distance = DistanceTransform.distanceBlock(sources, 10.0, 20.0)
+    assert distance[0, 3] == 30.0
+    assert distance[2, 0] == 40.0
+    assert distance[2, 3] == 50.0
+
+
+def test_distance_block_without_sources():
+    assert np.isinf(DistanceTransform.distanceBlock(np.zeros((2, 2), bool), 1.0, 1.0)).all()
+
+
+def readDistance(raster, geoms, max_distance=None, tile_size=1024):
+    from osgeo import gdal
+
+    template = raster("template.tif", np.zeros((20, 20), np.float32), geotransform=GT)
+    output = DistanceTransform.distanceRaster(geoms, template, template[:-4] + "_distance.tif", max_distance,
+                                              tile_size)
+    return gdal.Open(output).GetRasterBand(1).ReadAsArray()
+
+
+def test_distance_raster_and_cutoff(raster):
+    # a strip over the two left columns, cell centers farther right are 10 m apart
+    geoms = [box(0.5, 0.5, 19.5, 199.5)]
+    expected = np.maximum(np.arange(20) - 1, 0) * 10.0
+
+    distance = readDistance(raster, geoms)
+    assert np.allclose(distance, expected[None, :])
+
+    distance = readDistance(raster, geoms, max_distance=55, tile_size=4)
+    inside = expected <= 55
+    assert np.allclose(distance[:, inside], expected[None, inside])
+    assert (distance[:, ~inside] == np.float32(RasterBlocks.NODATA)).all()
+
+
+def test_tiles_match_the_whole_grid(raster):
+    geoms = [box(40, 150, 60, 170), box(150, 20, 160, 30)]
+    whole = readDistance(raster, geoms)
+    tiled = readDistance(raster, geoms, max_distance=300, tile_size=3)
+    assert np.allclose(tiled, whole)
+
+
+def test_polygon_narrower_than_a_cell_is_burned(raster):
+    # 2 m wide channel inside the fifth column, it covers no cell center
+    distance = readDistance(raster, [box(42, 0, 44, 200)], max_distance=30)
+    expected = np.abs(np.arange(20) - 4) * 10.0
+    inside = expected <= 30
+    assert np.allclose(distance[:, inside], expected[None, inside])
+    assert (distance[:, ~inside] == np.float32(RasterBlocks.NODATA)).all()
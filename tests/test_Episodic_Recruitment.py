@@ -0,0 +1,47 @@
+# # # Tests of reading the fire scenarios of the episodic recruitment batch # # #
+
+import numpy as np
+import pytest
+
+pytest.importorskip("arcpy")
+pytest.importorskip("osgeo")
+from shapely.geometry import box
+import Episodic_Recruitment
+import FireScenarios
+import SegmentZS
+
+FIRES = {"fires/perimeters.shp": ([u"north", u"s\u00fcd", u"north"], [box(0, 0, 1, 1), box(2, 2, 3, 3),
+                                                                      box(4, 4, 5, 5)]),
+         "fires/north.shp": ([u"north"], [box(0, 0, 1, 1)]),
+         "fires/2012.shp": ([u"2012"], [box(6, 6, 7, 7)])}
+
+
+@pytest.fixture(autouse=True)
+def features(monkeypatch):
+    """Feature classes read from FIRES instead of through arcpy"""
+    def readFeatures(fire, fields):
+        names, geoms = FIRES[fire]
+        return dict((field, np.asarray(names)) for field in fields), geoms
+
+    monkeypatch.setattr(SegmentZS, "featureSRS", lambda fire: "srs of " + fire)
+    monkeypatch.setattr(SegmentZS, "readFeatures", readFeatures)
+    monkeypatch.setattr(SegmentZS, "readSegments", lambda fire: (np.arange(len(FIRES[fire][1])), FIRES[fire][1]))
+
+
+def test_scenarios_by_field_group_the_features():
+    scenarios = Episodic_Recruitment.readScenarios(["fires/perimeters.shp"], "NAME")
+    assert [(name, len(geoms), srs) for name, geoms, srs in scenarios] == [
+        (u"north", 2, "srs of fires/perimeters.shp"), (u"s\u00fcd", 1, "srs of fires/perimeters.shp")]
+    assert all(isinstance(name, FireScenarios.TEXT_TYPE) for name, geoms, srs in scenarios)
+    assert scenarios[0][1][1].equals(box(4, 4, 5, 5))
+
+
+def test_scenarios_without_a_field_are_named_after_the_file():
+    scenarios = Episodic_Recruitment.readScenarios(["fires/north.shp", "fires/2012.shp"])
+    assert [(name, len(geoms), srs) for name, geoms, srs in scenarios] == [
+        ("north", 1, "srs of fires/north.shp"), ("2012", 1, "srs of fires/2012.shp")]
+
+
+def test_scenario_names_must_be_unique():
+    with pytest.raises(Exception):
+        Episodic_Recruitment.readScenarios(["fires/perimeters.shp", "fires/north.shp"], "NAME")
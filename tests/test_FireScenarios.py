@@ -0,0 +1,141 @@
+# # # Tests of the LWD burn raster, the burned LWD area of fire scenarios and their table # # #
+
+import io
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+from osgeo import gdal
+from shapely.geometry import LineString, Point, Polygon, box
+import Corridor
+import FireScenarios
+import LandfireLUT
+import RasterOverlap
+import ZoneIndex
+
+GT = (0.0, 10.0, 0.0, 0.0, 0.0, -10.0)
+
+# LWD value of a 4 x 4 grid, 127 is nodata
+LWD = np.array([[1, 1, 0, 1],
+                [1, 127, 1, 1],
+                [0, 1, 1, 0],
+                [1, 1, 1, 1]], np.int16)
+
+# BpS classes 1 Conifer, 2 Grassland, 3 Hardwood and 4 Riparian on a 12 x 12 grid, -9999 is nodata
+BPS_GT = (1000.0, 10.0, 0.0, 2120.0, 0.0, -10.0)
+BPS_LUT = np.array([LandfireLUT.LUT_NODATA, 1, 0, 1, 0], np.int16)
+
+
+@pytest.fixture
+def batch(raster):
+    """Two zones, the left and the right half of the grid"""
+    index = ZoneIndex.ZoneIndex.build([box(0, -40, 20, 0), box(20, -40, 40, 0)], [7, 8], GT, (4, 4))
+    return FireScenarios.FireBatch(index, raster("lwd.tif", LWD, 127))
+
+
+def bruteBurnArea(rows, cols):
+    """Area of LWD cells in the left and right half of the grid within some rows and columns"""
+    burned = np.zeros(LWD.shape, bool)
+    burned[rows, cols] = True
+    lwd = burned & (LWD == 1)
+    return [lwd[:, :2].sum() * 100.0, lwd[:, 2:].sum() * 100.0]
+
+
+def test_burn_area_counts_lwd_cells_inside_the_fire(batch):
+    # the top two rows, and a fire over the middle four cells
+    assert batch.burnArea([box(0, -20, 40, 0)]).tolist() == bruteBurnArea(slice(0, 2), slice(0, 4))
+    assert batch.burnArea([box(10, -30, 30, -10)]).tolist() == bruteBurnArea(slice(1, 3), slice(1, 3))
+    # several polygons of one scenario burn together
+    two = batch.burnArea([box(0, -10, 10, 0), box(30, -40, 40, -30)])
+    assert two.tolist() == [100.0, 100.0]
+
+
+def test_burn_area_of_fires_off_the_grid(batch):
+    assert batch.burnArea([box(100, 100, 200, 200)]).tolist() == [0.0, 0.0]
+    assert batch.burnArea([]).tolist() == [0.0, 0.0]
+
+
+def centresInside(geom, shape, gt):
+    """Cells of a grid whose centres are inside a polygon"""
+    inside = np.zeros(shape, bool)
+    for row, col in np.ndindex(shape):
+        inside[row, col] = geom.contains(Point(gt[0] + (col + 0.5) * gt[1], gt[3] + (row + 0.5) * gt[5]))
+    return inside
+
+
+def oldLwdBurn(bps, fire_geoms, mask_geoms, scratch, raster):
+    """The arcpy steps lwdBurnRaster replaces on the BpS grid: PolygonToRaster of the fire (FID values, 225
+    nodata), Lookup of LWD, ExtractByMask with the buffered network, SetNull of 0 copied with 127 nodata, then
+    RasterOverlap of the two. Both tools take the cells whose centres are inside a polygon"""
+    burn = np.full(bps.shape, 225, np.int16)
+    for fid, geom in enumerate(fire_geoms):
+        burn[centresInside(geom, bps.shape, BPS_GT)] = fid
+    inside = np.zeros(bps.shape, bool)
+    for geom in mask_geoms:
+        inside |= centresInside(geom, bps.shape, BPS_GT)
+    lwd = np.full(bps.shape, 127, np.int16)
+    lwd[inside & (bps != -9999) & (BPS_LUT[np.maximum(bps, 0)] == 1)] = 1
+
+    output = scratch + "/old_overlap.tif"
+    RasterOverlap.RasterOverlap(raster("bps_lwd.tif", lwd, 127, BPS_GT), raster("burn.tif", burn, 225, BPS_GT),
+                                output)
+    return gdal.Open(output).GetRasterBand(1).ReadAsArray() == 1
+
+
+@pytest.mark.parametrize("tiled", [False, True])
+def test_lwd_burn_raster_matches_the_arcpy_steps(raster, tmp_path, monkeypatch, tiled):
+    rng = np.random.RandomState(0)
+    bps = rng.randint(1, 5, (12, 12)).astype(np.int32)
+    bps[5, 2:6] = -9999
+    path = raster("bps.tif", bps, -9999, BPS_GT)
+    monkeypatch.setattr(LandfireLUT, "buildLUT", lambda *args: BPS_LUT)
+    fire_geoms = [Polygon([(1005, 2115), (1070, 2060), (1040, 2005)]), box(1090, 2030, 1200, 2090)]
+    mask_geoms = [LineString([(1020, 2100), (1060, 2050), (1110, 2030)]).buffer(22)]
+    corridor = Corridor.Corridor(mask_geoms, tile_size=4) if tiled else None
+
+    output = FireScenarios.lwdBurnRaster(path, fire_geoms, mask_geoms, str(tmp_path / "lwd_burn.tif"), corridor)
+
+    expected = oldLwdBurn(bps, fire_geoms, mask_geoms, str(tmp_path), raster)
+    outDS = gdal.Open(output)
+    assert outDS.GetRasterBand(1).GetNoDataValue() == FireScenarios.LWD_BURN_NODATA
+    # the new raster covers the network's extent of the BpS grid, nothing outside of it burned before either
+    xoff = int(round((outDS.GetGeoTransform()[0] - BPS_GT[0]) / BPS_GT[1]))
+    yoff = int(round((outDS.GetGeoTransform()[3] - BPS_GT[3]) / BPS_GT[5]))
+    window = (slice(yoff, yoff + outDS.RasterYSize), slice(xoff, xoff + outDS.RasterXSize))
+    assert expected.sum() > 5
+    assert expected[window].sum() == expected.sum()
+    np.testing.assert_array_equal(outDS.GetRasterBand(1).ReadAsArray() == 1, expected[window])
+
+
+def readTable(path):
+    with io.open(path, encoding="utf-8") as f:
+        return [line.rstrip("\n").split(",") for line in f]
+
+
+def test_wide_table_has_columns_per_scenario(tmp_path):
+    path = str(tmp_path / "burn.csv")
+    results = [(u"north", np.array([10.0, 0.0])), (u"s\u00fcd", np.array([5.0, 20.0]))]
+    FireScenarios.writeTable(path, np.array([1, 2]), np.array([20.0, 40.0]), results, "wide")
+
+    rows = readTable(path)
+    assert rows[0] == ["ID", "north_BURN_AREA", "north_BURN_PROP", u"s\u00fcd_BURN_AREA", u"s\u00fcd_BURN_PROP"]
+    assert [[float(value) for value in row] for row in rows[1:]] == [[1, 10.0, 0.5, 5.0, 0.25],
+                                                                      [2, 0.0, 0.0, 20.0, 0.5]]
+
+
+def test_long_table_has_rows_per_scenario_and_segment(tmp_path):
+    path = str(tmp_path / "burn.csv")
+    results = [(u"north", np.array([10.0, 0.0])), (u"s\u00fcd", np.array([5.0, 20.0]))]
+    FireScenarios.writeTable(path, np.array([1, 2]), np.array([20.0, 0.0]), results, "long")
+
+    rows = readTable(path)
+    assert rows[0] == ["SCENARIO", "ID", "BURN_AREA", "BURN_PROP"]
+    assert [row[:3] for row in rows[1:]] == [["north", "1", "10.0"], ["north", "2", "0.0"],
+                                             [u"s\u00fcd", "1", "5.0"], [u"s\u00fcd", "2", "20.0"]]
+    assert [row[3] for row in rows[1:]] == ["0.5", "nan", "0.25", "inf"]
+
+
+def test_unknown_table_layout(tmp_path):
+    with pytest.raises(Exception):
+        FireScenarios.writeTable(str(tmp_path / "burn.csv"), np.array([1]), np.array([1.0]),
+                                 [("a", np.array([1.0]))], "tall")
@@ -0,0 +1,52 @@
+# # # Tests of the raster space gully delineation # # #
+
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+from scipy import ndimage
+import GullyEngine
+
+
+def candidates(shape=(90, 70), seed=0):
+    """Int16 candidate raster values, clumps of 1s and nodata (-128) elsewhere"""
+    rng = np.random.default_rng(seed)
+    field = ndimage.zoom(rng.random((shape[0] // 4 + 1, shape[1] // 4 + 1)), 4, order=1)[:shape[0], :shape[1]]
+    return np.where(field > 0.75, 1, -128).astype(np.int16)
+
+
+def test_closing_matches_binary_closing_with_a_disk():
+    mask = candidates() == 1
+    radius = 3
+    y, x = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    disk = x * x + y * y <= radius * radius
+    padded = np.pad(mask, radius + 1)
+    expected = ndimage.binary_closing(padded, disk)[radius + 1:-radius - 1, radius + 1:-radius - 1] | mask
+    assert (GullyEngine.closeMask(mask, 60, 10.0, 10.0) == expected).all()
+
+
+def test_closing_of_an_empty_mask():
+    assert not GullyEngine.closeMask(np.zeros((4, 5), bool), 70, 10.0, 10.0).any()
+
+
+def test_tiles_give_the_components_of_the_whole_raster(raster):
+    from osgeo import gdal
+
+    values = candidates()
+    band = gdal.Open(raster("candidates.tif", values, -128)).GetRasterBand(1)
+
+    closed = GullyEngine.closeMask(values == 1, 70, 10.0, 10.0)
+    labels, count = ndimage.label(closed, structure=np.ones((3, 3), bool))
+    keep = np.bincount(labels.ravel()) * 100.0 >= 2500
+    keep[0] = False
+    expected = np.where(keep[labels], labels, 0)
+    assert keep.sum() > 1
+
+    for tile_size in (13, 40, 1000):
+        tiled = np.zeros(values.shape, np.int32)
+        for xoff, yoff, part in GullyEngine.gullyTiles(band, 10.0, 10.0, 70, 2500, tile_size):
+            tiled[yoff:yoff + part.shape[0], xoff:xoff + part.shape[1]] = part
+        assert ((tiled > 0) == (expected > 0)).all()
+        # one tiled label for every whole raster label and the other way round
+        pairs = set(zip(tiled[expected > 0].tolist(), expected[expected > 0].tolist()))
+        assert len(pairs) == keep.sum() == len(np.unique(tiled)) - 1
@@ -0,0 +1,122 @@
+# # # Tests of the LANDFIRE lookup tables and their cache # # #
+
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+import LandfireLUT
+
+EVH_CLASSES = [(0, "Fill-NoData"), (3, "Forest Height 0 to 5 meters"), (4, "Forest Height 5 t0 10 meters"),
+               (7, "Forest Height 25 to 50 meters"), (9, "Herb Height 0 to 0.5 meters")]
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    """A cache folder of the test's own and no tables left in memory by other tests"""
+    monkeypatch.setenv("LOCALAPPDATA", str(tmp_path / "cache"))
+    monkeypatch.setattr(LandfireLUT, "_luts", {})
+    monkeypatch.setattr(LandfireLUT, "_tables", {})
+    return LandfireLUT.cacheFolder()
+
+
+@pytest.fixture
+def table(tmp_path, monkeypatch):
+    """A raster file whose attribute table is EVH_CLASSES, counting how often the table is read"""
+    raster = str(tmp_path / "evh" / "evh.tif")
+    os.mkdir(os.path.dirname(raster))
+    with open(raster, "wb") as f:
+        f.write(b"evh")
+    reads = []
+
+    def readAttributeTable(path, field):
+        reads.append(path)
+        return np.asarray([value for value, name in EVH_CLASSES], np.int64), [name for value, name in EVH_CLASSES]
+
+    monkeypatch.setattr(LandfireLUT, "readAttributeTable", readAttributeTable)
+    return raster, reads
+
+
+def expectedHeights(lut):
+    assert lut.tolist() == [0, -32768, -32768, 5, 10, -32768, -32768, 50, -32768, 0]
+
+
+def test_lut_maps_classes_and_the_misspelled_class(table):
+    raster, reads = table
+    expectedHeights(LandfireLUT.buildLUT(raster, "CLASSNAMES", LandfireLUT.MAX_HEIGHT))
+
+
+def test_cached_lut_is_found_without_reading_the_table(table, cache, monkeypatch):
+    raster, reads = table
+    first = LandfireLUT.buildLUT(raster, "CLASSNAMES", LandfireLUT.MAX_HEIGHT)
+    monkeypatch.setattr(LandfireLUT, "_luts", {})
+    second = LandfireLUT.buildLUT(raster, "CLASSNAMES", LandfireLUT.MAX_HEIGHT)
+
+    assert len(reads) == 1
+    assert second.tolist() == first.tolist()
+    # the cache is in the user's folder, nothing is written next to the input raster
+    assert os.listdir(os.path.dirname(raster)) == ["evh.tif"]
+    assert not [name for name in os.listdir(cache) if ".tmp" in name]
+
+
+def test_unreadable_cache_files_are_a_miss(table, cache, monkeypatch):
+    raster, reads = table
+    LandfireLUT.buildLUT(raster, "CLASSNAMES", LandfireLUT.MAX_HEIGHT)
+    for name in os.listdir(cache):
+        with open(os.path.join(cache, name), "w") as f:
+            f.write("{half a fi")
+    monkeypatch.setattr(LandfireLUT, "_luts", {})
+
+    expectedHeights(LandfireLUT.buildLUT(raster, "CLASSNAMES", LandfireLUT.MAX_HEIGHT))
+    assert len(reads) == 2
+
+
+def test_changed_raster_reads_the_table_again(table, monkeypatch):
+    raster, reads = table
+    LandfireLUT.buildLUT(raster, "CLASSNAMES", LandfireLUT.MAX_HEIGHT)
+    with open(raster, "ab") as f:
+        f.write(b"more")
+    LandfireLUT.buildLUT(raster, "CLASSNAMES", LandfireLUT.MAX_HEIGHT)
+    assert len(reads) == 2
+
+
+def test_apply_lut_leaves_nodata_and_unlisted_values_out():
+    lut = np.asarray([1, 2, 3], np.int16)
+    result = LandfireLUT.applyLUT(lut, np.asarray([[0, 2, 5], [-1, 255, 1]]), nodata=255)
+    assert result.tolist() == [[1, 3, -32768], [-32768, -32768, 2]]
+
+
+def test_lut_from_the_raster_attribute_table(raster):
+    from osgeo import gdal
+
+    path = raster("evh.tif", np.asarray([[3, 4], [7, 9]], np.int32))
+    rat = gdal.RasterAttributeTable()
+    rat.CreateColumn("VALUE", gdal.GFT_Integer, gdal.GFU_MinMax)
+    rat.CreateColumn("CLASSNAMES", gdal.GFT_String, gdal.GFU_Generic)
+    rat.SetRowCount(len(EVH_CLASSES))
+    for row, (value, name) in enumerate(EVH_CLASSES):
+        rat.SetValueAsInt(row, 0, value)
+        rat.SetValueAsString(row, 1, name)
+    rasterDS = gdal.Open(path, gdal.GA_Update)
+    rasterDS.GetRasterBand(1).SetDefaultRAT(rat)
+    rasterDS = None
+
+    expectedHeights(LandfireLUT.buildLUT(path, "CLASSNAMES", LandfireLUT.MAX_HEIGHT))
+
+
+def test_lut_from_the_vat_dbf_sidecar(raster):
+    from osgeo import ogr
+
+    path = raster("evh.tif", np.asarray([[3, 4], [7, 9]], np.int32))
+    vat = ogr.GetDriverByName("ESRI Shapefile").CreateDataSource(path + ".vat.dbf")
+    layer = vat.CreateLayer("evh.tif.vat", None, ogr.wkbNone)
+    layer.CreateField(ogr.FieldDefn("VALUE", ogr.OFTInteger))
+    layer.CreateField(ogr.FieldDefn("CLASSNAMES", ogr.OFTString))
+    for value, name in EVH_CLASSES:
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField("VALUE", value)
+        feature.SetField("CLASSNAMES", name)
+        layer.CreateFeature(feature)
+    vat = None
+
+    expectedHeights(LandfireLUT.buildLUT(path, "CLASSNAMES", LandfireLUT.MAX_HEIGHT))
@@ -0,0 +1,211 @@
+# # # Tests of the stage graph executor # # #
+
+import threading
+import time
+import pytest
+import Pipeline
+
+
+def test_serial_run_keeps_the_order_stages_were_added_in():
+    order = []
+    pipeline = Pipeline.Pipeline(workers=1)
+    for name in ("a", "b", "c"):
+        pipeline.add(name, order.append, (name,))
+    pipeline.run()
+    assert order == ["a", "b", "c"]
+
+
+def test_results_and_items_are_passed_on():
+    for workers in (1, 3):
+        pipeline = Pipeline.Pipeline(workers=workers)
+        pair = pipeline.add("pair", lambda: (2, 3))
+        total = pipeline.add("total", lambda a, b: a + b, (pair[0], pair[1]))
+        pipeline.add("double", lambda value, factor=1: value * factor, (total,), {"factor": 2})
+        results = pipeline.run()
+        assert results == {"pair": (2, 3), "total": 5, "double": 10}
+
+
+def test_stages_wait_for_their_requirements():
+    finished = []
+
+    def stage(name, delay):
+        time.sleep(delay)
+        finished.append(name)
+
+    pipeline = Pipeline.Pipeline(workers=3)
+    pipeline.add("slow", stage, ("slow", 0.2))
+    pipeline.add("fast", stage, ("fast", 0))
+    pipeline.add("after", stage, ("after", 0), requires=["slow"])
+    pipeline.run()
+    assert finished.index("after") > finished.index("slow")
+    assert finished.index("fast") < finished.index("slow")
+
+
+def test_undefined_and_duplicate_stages_are_rejected():
+    pipeline = Pipeline.Pipeline()
+    pipeline.add("a", len, ([],))
+    with pytest.raises(Exception):
+        pipeline.add("a", len, ([],))
+    with pytest.raises(Exception):
+        pipeline.add("b", len, ([],), requires=["missing"])
+
+
+def test_failure_stops_dependent_stages():
+    ran = []
+
+    def fail():
+        raise ValueError("broken")
+
+    for workers in (1, 2):
+        pipeline = Pipeline.Pipeline(workers=workers)
+        pipeline.add("fail", fail)
+        pipeline.add("after", ran.append, ("after",), requires=["fail"])
+        with pytest.raises(Pipeline.StageError) as error:
+            pipeline.run()
+        assert error.value.stage == "fail"
+        assert isinstance(error.value.error, ValueError)
+    assert ran == []
+
+
+def test_stages_that_are_not_threadsafe_never_overlap():
+    state = {"running": 0, "most": 0}
+    lock = threading.Lock()
+
+    def stage():
+        with lock:
+            state["running"] += 1
+            state["most"] = max(state["most"], state["running"])
+        time.sleep(0.05)
+        with lock:
+            state["running"] -= 1
+
+    pipeline = Pipeline.Pipeline(workers=4)
+    for i in range(4):
+        pipeline.add("stage" + str(i), stage, threadsafe=False)
+    pipeline.run()
+    assert state["most"] == 1
+
+
+def test_messages_are_logged_from_the_running_thread():
+    threads = []
+    pipeline = Pipeline.Pipeline(workers=2, log=lambda text: threads.append(threading.current_thread()))
+    pipeline.add("a", time.sleep, (0.01,))
+    pipeline.add("b", time.sleep, (0.01,))
+    pipeline.run()
+    assert len(threads) == 2
+    assert all(thread is threading.current_thread() for thread in threads)
+
+
+def test_results_inside_lists_tuples_and_dicts_are_substituted():
+    for workers in (1, 3):
+        pipeline = Pipeline.Pipeline(workers=workers)
+        pair = pipeline.add("pair", lambda: {"low": 2, "high": 3})
+        names = pipeline.add("names", lambda: ["a", "b"])
+        nested = pipeline.add("nested", lambda values, options=None: (values, options),
+                              ([pair["low"], (pair["high"], 4)],), {"options": {"name": names[1], "all": names}})
+        results = pipeline.run()
+        assert results["nested"] == ([2, (3, 4)], {"name": "b", "all": ["a", "b"]})
+        assert pipeline.names["nested"].requires == ["pair", "names"]
+
+
+def test_stages_wait_for_results_inside_lists():
+    finished = []
+
+    def slow():
+        time.sleep(0.2)
+        finished.append("slow")
+        return 1
+
+    pipeline = Pipeline.Pipeline(workers=3)
+    value = pipeline.add("slow", slow)
+    pipeline.add("after", lambda values: finished.append(values), ([value],))
+    pipeline.run()
+    assert finished == ["slow", [1]]
+
+
+def test_failure_lets_running_stages_finish_and_starts_no_new_ones():
+    ran = []
+
+    def fail():
+        time.sleep(0.05)
+        raise ValueError("broken")
+
+    def slow():
+        time.sleep(0.2)
+        ran.append("slow")
+
+    pipeline = Pipeline.Pipeline(workers=2)
+    pipeline.add("fail", fail)
+    pipeline.add("slow", slow)
+    pipeline.add("after slow", ran.append, ("after slow",), requires=["slow"])
+    with pytest.raises(Pipeline.StageError) as error:
+        pipeline.run()
+    assert error.value.stage == "fail"
+    assert ran == ["slow"]
+
+
+CALLS = []
+
+
+def build(name, value):
+    CALLS.append(name)
+    return value * 2
+
+
+def test_checkpointed_stages_are_skipped_on_a_rerun(tmp_path):
+    pytest.importorskip("osgeo")
+    import Checkpoint
+
+    for workers in (1, 3):
+        scratch = tmp_path / str(workers)
+        scratch.mkdir()
+        del CALLS[:]
+
+        def run():
+            messages = []
+            pipeline = Pipeline.Pipeline(workers, messages.append, Checkpoint.Checkpoints(str(scratch)))
+            first = pipeline.add("first", build, ("first", 2))
+            pipeline.add("second", build, ("second", first))
+            return pipeline.run(), messages
+
+        results, messages = run()
+        assert results == {"first": 4, "second": 8}
+        assert sorted(CALLS) == ["first", "second"]
+        results, messages = run()
+        assert results == {"first": 4, "second": 8}
+        assert sorted(CALLS) == ["first", "second"]
+        assert sorted(message for message in messages if "skipped" in message) == [
+            "first unchanged since the last run, skipped", "second unchanged since the last run, skipped"]
+
+
+STATE = {}
+
+
+def flaky():
+    STATE["calls"] += 1
+    if STATE["fail"]:
+        raise ValueError("broken")
+    return "done"
+
+
+def test_failed_checkpointed_stage_is_not_skipped_on_a_rerun(tmp_path):
+    pytest.importorskip("osgeo")
+    import Checkpoint
+
+    for workers in (1, 3):
+        scratch = tmp_path / str(workers)
+        scratch.mkdir()
+        STATE.update(fail=True, calls=0)
+
+        def run():
+            pipeline = Pipeline.Pipeline(workers, None, Checkpoint.Checkpoints(str(scratch)))
+            pipeline.add("stage", flaky)
+            return pipeline.run()
+
+        with pytest.raises(Pipeline.StageError):
+            run()
+        STATE["fail"] = False
+        assert run() == {"stage": "done"}
+        assert run() == {"stage": "done"}
+        # the failure left no checkpoint, the first success did
+        assert STATE["calls"] == 2
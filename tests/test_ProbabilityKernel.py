@@ -0,0 +1,88 @@
+# # # Tests of the fused probability equation against its closed form # # #
+
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+from osgeo import gdal
+import ProbabilityKernel
+import RasterBlocks
+
+
+def closedForm(height, distance, slope, cover):
+    """((He/Ht)/2) + ((0.5 - (0.5/10 ^ (1.4375 * B)))/2) + (D/4) for one cell, None where it is null"""
+    effective = height - distance
+    if distance == 0 or effective <= 0:
+        return None
+    return (effective / height) / 2 + (0.5 - 0.5 / 10 ** (1.4375 * slope / 100.0)) / 2 + (cover / 100.0) / 4
+
+
+# height, distance, percent slope and percent cover of a 2 x 4 grid. The second row is null: inside the
+# channel, a tree of no height, a negative height from nodata interpolation and a tree that cannot reach
+HEIGHT = np.array([[50.0, 25.0, 10.0, 5.0], [30.0, 0.0, -5.0, 10.0]])
+DISTANCE = np.array([[10.0, 1.0, 9.5, 0.5], [0.0, 3.0, 3.0, 10.0]])
+SLOPE = np.array([[0.0, 12.5, 40.0, 200.0], [10.0, 10.0, 10.0, 10.0]])
+COVER = np.array([[85.0, 0.0, 100.0, 15.0], [50.0, 50.0, 50.0, 50.0]])
+
+
+def expectedProbability():
+    expected = np.full(HEIGHT.shape, np.nan)
+    for index in np.ndindex(HEIGHT.shape):
+        value = closedForm(HEIGHT[index], DISTANCE[index], SLOPE[index], COVER[index])
+        if value is not None:
+            expected[index] = value
+    return expected
+
+
+def test_terms_match_the_closed_form():
+    terms = ProbabilityKernel.probabilityTerms(HEIGHT.copy(), DISTANCE.copy(), SLOPE.copy(), COVER.copy())
+    np.testing.assert_allclose(terms["probability"], expectedProbability())
+    assert np.isnan(terms["probability"][1]).all()
+    assert np.isnan(terms["effective_height"][1]).all()
+    np.testing.assert_allclose(terms["effective_height"][0], [40.0, 24.0, 0.5, 4.5])
+    np.testing.assert_allclose(terms["slope"], SLOPE / 100.0)
+    np.testing.assert_allclose(terms["term3"], COVER / 400.0)
+    np.testing.assert_allclose(terms["term1"] + terms["term2"] + terms["term3"], terms["probability"])
+
+
+def test_missing_inputs_are_null():
+    nan = np.full((1, 1), np.nan)
+    one = np.full((1, 1), 10.0)
+    for arrays in ((nan, one, one, one), (one * 2, nan, one, one), (one * 2, one / 2, nan, one),
+                   (one * 2, one / 2, one, nan)):
+        assert np.isnan(ProbabilityKernel.probabilityTerms(*[a.copy() for a in arrays])["probability"]).all()
+
+
+def test_fused_raster_matches_the_closed_form(raster, tmp_path):
+    paths = [raster(name + ".tif", array.astype(np.float32), -9999)
+             for name, array in (("height", HEIGHT), ("distance", DISTANCE), ("slope", SLOPE), ("cover", COVER))]
+    output = str(tmp_path / "probability.tif")
+    term1 = str(tmp_path / "term1.tif")
+
+    assert ProbabilityKernel.fusedProbability(*paths, output=output, extra={"term1": term1}) == output
+
+    result = gdal.Open(output).GetRasterBand(1).ReadAsArray().astype(np.float64)
+    expected = expectedProbability()
+    null = np.isnan(expected)
+    assert (result[null] == np.float32(RasterBlocks.NODATA)).all()
+    np.testing.assert_allclose(result[~null], expected[~null], rtol=1e-6)
+    first = gdal.Open(term1).GetRasterBand(1).ReadAsArray().astype(np.float64)
+    np.testing.assert_allclose(first[0], (HEIGHT[0] - DISTANCE[0]) / HEIGHT[0] / 2, rtol=1e-6)
+
+
+def test_fused_raster_reads_nodata_as_null(raster, tmp_path):
+    height = raster("height.tif", np.array([[-9999, 20]], np.float32), -9999)
+    rest = [raster(name + ".tif", np.array([[1, 1]], np.float32), -9999) for name in ("distance", "slope", "cover")]
+    output = str(tmp_path / "probability.tif")
+    ProbabilityKernel.fusedProbability(height, *rest, output=output)
+
+    result = gdal.Open(output).GetRasterBand(1).ReadAsArray().astype(np.float64)
+    assert result[0, 0] == np.float32(RasterBlocks.NODATA)
+    assert result[0, 1] == pytest.approx(closedForm(20.0, 1.0, 1.0, 1.0), rel=1e-6)
+
+
+def test_fused_raster_rejects_inputs_on_other_grids(raster, tmp_path):
+    paths = [raster(name + ".tif", np.ones((2, 2), np.float32)) for name in ("height", "distance", "slope")]
+    cover = raster("cover.tif", np.ones((3, 3), np.float32))
+    with pytest.raises(Exception):
+        ProbabilityKernel.fusedProbability(*paths + [cover], output=str(tmp_path / "probability.tif"))
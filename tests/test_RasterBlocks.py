@@ -0,0 +1,28 @@
+# # # Tests of projecting vector geometries onto a grid's coordinate system # # #
+
+import pytest
+
+pytest.importorskip("osgeo")
+from osgeo import osr
+from shapely.geometry import Point, box
+import RasterBlocks
+
+
+def wkt(epsg):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    return srs.ExportToWkt()
+
+
+def test_geometries_are_projected_to_the_target():
+    # on the equator at the central meridian of UTM zone 11 (117 W)
+    projected = RasterBlocks.projectGeoms([Point(-117.0, 0.0)], wkt(4326), wkt(32611))
+    assert projected[0].x == pytest.approx(500000.0, abs=1e-3)
+    assert projected[0].y == pytest.approx(0.0, abs=1e-3)
+
+
+def test_same_or_unknown_systems_are_left_alone():
+    geoms = [box(0, 0, 10, 10)]
+    assert RasterBlocks.projectGeoms(geoms, wkt(32611), wkt(32611)) is geoms
+    assert RasterBlocks.projectGeoms(geoms, "", wkt(32611)) is geoms
+    assert RasterBlocks.projectGeoms(geoms, None, wkt(32611)) is geoms
@@ -0,0 +1,44 @@
+# # # Tests of the overlap of two rasters # # #
+
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+import RasterBlocks
+import RasterOverlap
+
+
+def overlap(array1, array2, nodata, nodata2):
+    # the block function alone, without running the whole raster
+    instance = RasterOverlap.RasterOverlap.__new__(RasterOverlap.RasterOverlap)
+    return instance.overlap(array1, array2, nodata, nodata2)
+
+
+def test_float_nodata_inputs_give_int16_nodata(raster, tmp_path):
+    from osgeo import gdal
+
+    nodata = RasterBlocks.NODATA
+    first = np.asarray([[1, 1, nodata], [1, nodata, 1]], np.float32)
+    second = np.asarray([[1, nodata, 1], [1, nodata, 1]], np.float32)
+    output = str(tmp_path / "overlap.tif")
+    RasterOverlap.RasterOverlap(raster("first.tif", first, nodata), raster("second.tif", second, nodata), output)
+
+    band = gdal.Open(output).GetRasterBand(1)
+    assert band.GetNoDataValue() == RasterOverlap.OVERLAP_NODATA
+    result = band.ReadAsArray()
+    assert result.dtype == np.int16
+    assert result.tolist() == [[1, -32768, -32768], [1, -32768, 1]]
+
+
+def test_overlap_of_integer_blocks_with_two_nodata_values():
+    first = np.asarray([[-128, 1, 1, 0]], np.int16)
+    second = np.asarray([[1, 255, 1, 1]], np.int16)
+    result = overlap(first, second, -128, 255)
+    assert result.dtype == np.int16
+    assert result.tolist() == [[-32768, -32768, 1, 1]]
+
+
+def test_inputs_without_nodata():
+    block = np.ones((2, 2), np.float32)
+    result = overlap(block, block, None, None)
+    assert result.tolist() == [[1, 1], [1, 1]]
@@ -0,0 +1,125 @@
+# # # Tests of the bulk segment geometry operations against brute force # # #
+
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+from shapely.geometry import LineString, Point, box
+from shapely.ops import unary_union
+import SegmentGeometry
+
+
+def randomSegments(count, seed=0):
+    rng = np.random.RandomState(seed)
+    starts = rng.uniform(0, 1000, (count, 2))
+    ends = starts + rng.uniform(-80, 80, (count, 2))
+    return [LineString([tuple(a), tuple(b)]) for a, b in zip(starts, ends)]
+
+
+def randomPolygons(count, seed=1):
+    rng = np.random.RandomState(seed)
+    corners = rng.uniform(-200, 1200, (count, 2))
+    sizes = rng.uniform(1, 30, (count, 2))
+    return [box(x, y, x + w, y + h) for (x, y), (w, h) in zip(corners, sizes)]
+
+
+def bruteNearest(geoms, segment_geoms, segment_ids, max_distance=None):
+    near_ids = []
+    near_dist = []
+    for geom in geoms:
+        distances = np.asarray([geom.distance(segment) for segment in segment_geoms])
+        i = int(np.argmin(distances))
+        if max_distance is None or distances[i] <= max_distance:
+            near_ids.append(segment_ids[i])
+            near_dist.append(distances[i])
+        else:
+            near_ids.append(-1)
+            near_dist.append(-1.0)
+    return np.asarray(near_ids), np.asarray(near_dist)
+
+
+@pytest.fixture(params=["tree", "windows"])
+def nearest_path(request, monkeypatch):
+    """Runs a test with the STRtree nearest search and with the window fallback of shapely before 1.7"""
+    if request.param == "windows":
+        monkeypatch.setattr(SegmentGeometry, "STRTREE_NEAREST", False)
+    return request.param
+
+
+@pytest.mark.parametrize("max_distance", [None, 40.0, 5.0])
+def test_nearest_segments_match_brute_force(nearest_path, max_distance):
+    segments = randomSegments(60)
+    ids = np.arange(60) * 3 + 5
+    geoms = randomPolygons(80)
+
+    near_ids, near_dist = SegmentGeometry.nearestSegments(geoms, segments, ids, max_distance)
+    expected_ids, expected_dist = bruteNearest(geoms, segments, ids, max_distance)
+
+    np.testing.assert_allclose(near_dist, expected_dist)
+    # random coordinates leave no ties, so the segments are the same too
+    np.testing.assert_array_equal(near_ids, expected_ids)
+
+
+def test_nearest_segments_far_from_every_segment(nearest_path):
+    segments = [LineString([(0, 0), (1, 0)]), LineString([(0, 5), (1, 5)])]
+    near_ids, near_dist = SegmentGeometry.nearestSegments([Point(1e6, 2.0)], segments, np.asarray([1, 2]))
+    assert near_ids.tolist() == [1]
+    assert near_dist[0] == pytest.approx(Point(1e6, 2.0).distance(segments[0]))
+
+
+def test_dissolve_by_nearest_groups_by_the_brute_force_segment(nearest_path):
+    segments = randomSegments(30, seed=2)
+    ids = np.arange(30) + 100
+    geoms = randomPolygons(50, seed=3)
+
+    dissolved, near_ids, near_dist = SegmentGeometry.dissolveByNearest(geoms, segments, ids, 60.0)
+
+    first_ids, first_dist = bruteNearest(geoms, segments, ids, 60.0)
+    kept = sorted(set(first_ids[first_ids >= 0].tolist()))
+    assert len(dissolved) == len(kept)
+    for geom, key in zip(dissolved, kept):
+        parts = [g for g, near in zip(geoms, first_ids.tolist()) if near == key]
+        assert geom.symmetric_difference(unary_union(parts)).area < 1e-6
+    expected_ids, expected_dist = bruteNearest(dissolved, segments, ids)
+    np.testing.assert_array_equal(near_ids, expected_ids)
+    np.testing.assert_allclose(near_dist, expected_dist)
+
+
+@pytest.fixture(params=["shapely", "scipy"])
+def voronoi_path(request, monkeypatch):
+    """Runs a test with shapely's voronoi_diagram and with the scipy cells used before shapely 1.8"""
+    if request.param == "scipy":
+        monkeypatch.setattr(SegmentGeometry, "voronoi_diagram", None)
+    return request.param
+
+
+def test_thiessen_zones_cover_the_buffers_without_overlaps(voronoi_path):
+    segments = randomSegments(40, seed=6)
+    zones = SegmentGeometry.thiessenZones(segments, 50)
+    buffers = unary_union([segment.buffer(50, cap_style=2) for segment in segments])
+
+    assert len(zones) == len(segments)
+    assert unary_union(zones).symmetric_difference(buffers).area < 1e-6 * buffers.area
+    for i in range(len(zones)):
+        for j in range(i + 1, len(zones)):
+            assert zones[i].intersection(zones[j]).area < 1e-6
+
+
+def test_thiessen_zones_hold_points_nearest_their_own_midpoint(voronoi_path):
+    segments = randomSegments(25, seed=4)
+    zones = SegmentGeometry.thiessenZones(segments, 50)
+    mids = np.asarray([[point.x, point.y] for point in SegmentGeometry.midpoints(segments)])
+
+    rng = np.random.RandomState(5)
+    checked = 0
+    for x, y in rng.uniform(-100, 1100, (2000, 2)):
+        point = Point(x, y)
+        inside = [i for i, zone in enumerate(zones) if zone.contains(point)]
+        if not inside:
+            continue
+        checked += 1
+        assert len(inside) == 1
+        distances = np.hypot(mids[:, 0] - x, mids[:, 1] - y)
+        assert distances[inside[0]] == pytest.approx(distances.min())
+        assert point.distance(segments[inside[0]].buffer(50, cap_style=2)) == 0
+    assert checked > 100
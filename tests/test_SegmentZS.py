@@ -0,0 +1,62 @@
+# # # Tests of the chunking and ordering of the segment zonal statistics # # #
+
+import numpy as np
+import pytest
+
+pytest.importorskip("arcpy")
+pytest.importorskip("osgeo")
+from shapely.geometry import LineString
+import SegmentZS
+
+
+def gridSegments(side):
+    """Short segments on a side x side grid of points 100 m apart, in row major order"""
+    return [LineString([(x * 100.0, y * 100.0), (x * 100.0 + 10, y * 100.0)])
+            for y in range(side) for x in range(side)]
+
+
+def test_chunks_hold_every_segment_once():
+    geoms = gridSegments(10)
+    chunks = SegmentZS.spatialChunks(geoms, 7)
+    assert len(chunks) == 7
+    positions = np.concatenate(chunks)
+    assert sorted(positions.tolist()) == list(range(len(geoms)))
+    assert max(len(chunk) for chunk in chunks) - min(len(chunk) for chunk in chunks) <= 1
+
+
+def test_chunks_follow_the_z_order_curve():
+    # on an 8 x 8 grid four chunks along the Z-order curve are the four 4 x 4 quadrants
+    geoms = gridSegments(8)
+    chunks = SegmentZS.spatialChunks(geoms, 4)
+    quadrants = set()
+    for chunk in chunks:
+        x = chunk % 8 // 4
+        y = chunk // 8 // 4
+        assert len(set(zip(x.tolist(), y.tolist()))) == 1
+        quadrants.add((int(x[0]), int(y[0])))
+    assert len(quadrants) == 4
+
+
+def test_chunks_of_few_or_no_segments():
+    assert SegmentZS.spatialChunks([], 4) == []
+    chunks = SegmentZS.spatialChunks(gridSegments(1), 4)
+    assert [chunk.tolist() for chunk in chunks] == [[0]]
+
+
+def test_chunk_results_come_back_in_network_order():
+    geoms = gridSegments(6)
+    chunks = SegmentZS.spatialChunks(geoms, 5)
+    # chunks finish in any order, and the segments of a chunk are in curve order
+    results = [[(int(p), p * 2.0, p + 0.5) for p in chunk] for chunk in reversed(chunks)]
+    sums, areas = SegmentZS.gatherChunks(len(geoms), results)
+    assert sums.tolist() == [p * 2.0 for p in range(len(geoms))]
+    assert areas.tolist() == [p + 0.5 for p in range(len(geoms))]
+
+
+def test_zonal_stats_options():
+    assert SegmentZS.zonalStatsOptions("batched", 4) == {"batch": True, "workers": 1}
+    assert SegmentZS.zonalStatsOptions("parallel", 4) == {"batch": False, "workers": 4}
+    assert SegmentZS.zonalStatsOptions("parallel", 1) == {"batch": False, "workers": 2}
+    assert SegmentZS.zonalStatsOptions("serial", 4) == {"batch": False, "workers": 1}
+    with pytest.raises(Exception):
+        SegmentZS.zonalStatsOptions("fast", 4)
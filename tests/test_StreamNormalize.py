@@ -0,0 +1,59 @@
+# # # Tests of the streaming min/max normalization # # #
+
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+import StreamNormalize
+
+
+def test_range_over_blocks_ignores_missing_values():
+    stats = StreamNormalize.StreamingRange()
+    stats.update(np.array([3.0, np.nan, 5.0]))
+    stats.update(np.array([np.inf, -np.inf]))
+    stats.update(np.array([[-2.0, 4.0], [7.5, 0.0]]))
+    assert stats.minimum == -2.0
+    assert stats.maximum == 7.5
+    assert stats.count == 6
+
+
+def test_percentiles_are_good_to_a_bin_width_as_the_range_grows():
+    rng = np.random.default_rng(0)
+    blocks = [rng.normal(0, 1, 1000), rng.normal(50, 5, 1000), rng.normal(-80, 10, 1000)]
+    stats = StreamNormalize.StreamingRange(bins=1024, histogram=True)
+    for block in blocks:
+        stats.update(block)
+    values = np.concatenate(blocks)
+    for q in (1, 25, 50, 75, 99):
+        assert abs(stats.percentile(q) - np.percentile(values, q)) <= 2 * stats.width
+    assert stats.percentile(0) >= values.min()
+    assert stats.percentile(100) <= values.max()
+
+
+def test_percentile_needs_a_histogram():
+    stats = StreamNormalize.StreamingRange()
+    stats.update(np.arange(5.0))
+    with pytest.raises(Exception):
+        stats.percentile(50)
+
+
+def test_normalize_scales_to_the_new_range(raster):
+    from osgeo import gdal
+    import RasterBlocks
+
+    values = np.array([[2, 4, -9], [6, 8, 10]], np.float32)
+    path = raster("values.tif", values, -9)
+    output = StreamNormalize.normalize(StreamNormalize.rasterSource(path), path, path[:-4] + "_norm.tif")
+    result = gdal.Open(output).GetRasterBand(1).ReadAsArray()
+    assert result[0, 2] == np.float32(RasterBlocks.NODATA)
+    assert np.allclose(result[values != -9], [1.0, 3.25, 5.5, 7.75, 10.0])
+
+
+def test_normalize_without_data(raster):
+    path = raster("empty.tif", np.full((2, 2), -9, np.float32), -9)
+    with pytest.raises(Exception):
+        StreamNormalize.normalize(StreamNormalize.rasterSource(path), path, path[:-4] + "_norm.tif")
+
+
+def test_min_max_scale():
+    assert StreamNormalize.minMaxScale([2, 4, 6]).tolist() == [0.0, 0.5, 1.0]
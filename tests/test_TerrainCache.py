@@ -0,0 +1,82 @@
+# # # Tests of the terrain derivative cache # # #
+
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+import RasterBlocks
+import TerrainCache
+
+
+def writeRaster(path, array):
+    from osgeo import gdal
+
+    outDS = RasterBlocks.createGrid(path, (0.0, 10.0, 0.0, 0.0, 0.0, -10.0), "", array.shape[1], array.shape[0],
+                                   gdal.GDT_Float32, -9999)
+    outDS.GetRasterBand(1).WriteArray(array)
+    outDS.FlushCache()
+    outDS = None
+
+
+@pytest.fixture
+def dem(raster):
+    return raster("dem.tif", np.arange(20, dtype=np.float32).reshape(4, 5), -9999)
+
+
+def test_second_get_is_a_cache_hit(dem):
+    built = []
+
+    def build(output):
+        built.append(output)
+        writeRaster(output, np.ones((4, 5), np.float32))
+
+    cache = TerrainCache.TerrainCache(dem)
+    first = cache.get("product", {"units": "m"}, build)
+    second = TerrainCache.TerrainCache(dem).get("product", {"units": "m"}, build)
+
+    assert first == second
+    assert len(built) == 1
+    # built under a temporary name and renamed, only the raster and its sidecar are left
+    assert built[0] != first
+    assert sorted(name for name in os.listdir(cache.folder) if name.startswith("product")) == \
+        [os.path.basename(first), os.path.basename(first) + ".json"]
+
+
+def test_changed_dem_gets_a_new_hash(dem):
+    cache = TerrainCache.TerrainCache(dem)
+    before = cache.dem_hash
+    path = cache.path("product", {})
+
+    writeRaster(dem, np.zeros((4, 5), np.float32))
+    os.utime(dem, (1000000000, 1000000000))
+    after = TerrainCache.TerrainCache(dem)
+    assert after.dem_hash != before
+    assert after.path("product", {}) != path
+
+
+def test_failed_build_leaves_no_cached_raster(dem):
+    def build(output):
+        writeRaster(output, np.ones((4, 5), np.float32))
+        raise RuntimeError("stopped part way")
+
+    cache = TerrainCache.TerrainCache(dem)
+    with pytest.raises(RuntimeError):
+        cache.get("product", {}, build)
+    assert not [name for name in os.listdir(cache.folder) if name.startswith("product")]
+
+
+def test_drainage_area_and_slope_are_copied_next_to_the_dem(dem):
+    def build(output):
+        writeRaster(output, np.full((4, 5), 2.0, np.float32))
+
+    cache = TerrainCache.TerrainCache(dem)
+    drainage = cache.get("drainarea", {"units": "sqkm"}, build)
+    slope = cache.get("slope", {"units": "DEGREE"}, build)
+    cache.get("slope", {"units": "PERCENT_RISE"}, build)
+
+    folder = os.path.dirname(dem)
+    for cached, legacy in ((drainage, "Flow/DrainArea_sqkm.tif"), (slope, "Slope/slope_deg.tif")):
+        with open(cached, "rb") as a, open(os.path.join(folder, legacy), "rb") as b:
+            assert a.read() == b.read()
+    assert os.listdir(os.path.join(folder, "Slope")) == ["slope_deg.tif"]
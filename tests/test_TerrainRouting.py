@@ -0,0 +1,170 @@
+# # # Tests of the depression fill # # #
+
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+import TerrainRouting
+
+
+def drains(filled, valid):
+    """Whether every valid cell that is not an outlet has a strictly lower valid neighbor"""
+    rows, cols = filled.shape
+    padded = np.pad(np.where(valid, filled, np.inf), 1, "constant", constant_values=np.inf)
+    lowest = np.full((rows, cols), np.inf)
+    for dy, dx in TerrainRouting.DIRECTIONS:
+        lowest = np.minimum(lowest, padded[1 + dy:rows + 1 + dy, 1 + dx:cols + 1 + dx])
+    inner = valid & ~TerrainRouting.edgeCells(valid)
+    return bool((lowest[inner] < filled[inner]).all())
+
+
+def test_pit_is_filled_to_its_spill_level():
+    dem = np.full((7, 7), 10.0)
+    dem[2:5, 2:5] = 8.0
+    dem[3, 3] = 1.0
+    # the bowl spills over a saddle at 9 in its rim to an outlet on the right edge
+    dem[3, 5] = 9.0
+    dem[3, 6] = 8.5
+    valid = np.ones(dem.shape, bool)
+    filled = TerrainRouting.fillDepressions(dem, valid)
+
+    bowl = np.zeros(dem.shape, bool)
+    bowl[2:5, 2:5] = True
+    assert (filled[~bowl] == dem[~bowl]).all()
+    assert (filled[bowl] > 9.0).all() and (filled[bowl] < 9.01).all()
+    assert drains(filled, valid)
+
+
+def test_surface_without_pits_is_unchanged():
+    rows, cols = np.mgrid[0:6, 0:8]
+    dem = (rows + cols).astype(np.float64)
+    valid = np.ones(dem.shape, bool)
+    assert (TerrainRouting.fillDepressions(dem, valid) == dem).all()
+
+
+def test_nodata_drains_the_cells_around_it():
+    dem = np.full((5, 5), 10.0)
+    dem[2, 2] = np.nan
+    dem[2, 1] = 5.0
+    valid = ~np.isnan(dem)
+    filled = TerrainRouting.fillDepressions(dem, valid)
+    assert filled[2, 1] == 5.0
+    assert np.isnan(filled[2, 2])
+    assert drains(filled, valid)
+
+
+def test_tiled_fill_matches_the_whole_grid(raster):
+    from osgeo import gdal
+
+    rng = np.random.default_rng(0)
+    dem = (rng.random((40, 50)) * 20).astype(np.float32)
+    dem[5:10, 30:45] = -9
+    path = raster("dem.tif", dem, -9)
+    whole = TerrainRouting.fill_depressions(path, path[:-4] + "_whole.tif")
+    tiled = TerrainRouting.fill_depressions(path, path[:-4] + "_tiled.tif", tile_size=16)
+    whole = gdal.Open(whole).GetRasterBand(1).ReadAsArray()
+    tiled = gdal.Open(tiled).GetRasterBand(1).ReadAsArray()
+    assert (whole == tiled).all()
+    assert (whole[dem == -9] == -9).all()
+    valid = dem != -9
+    assert (whole[valid] >= dem[valid]).all()
+    assert drains(whole.astype(np.float64), valid)
+
+
+def serpentine(rows, cols):
+    """DEM of one channel that winds across the grid row by row, every second row is a wall except for the
+    cell where the channel turns"""
+    dem = np.full((rows, cols), 1000.0)
+    level = float(rows * cols)
+    for r in range(0, rows, 2):
+        order = range(cols) if r // 2 % 2 == 0 else range(cols - 1, -1, -1)
+        for c in order:
+            dem[r, c] = level
+            level -= 1
+        if r + 1 < rows:
+            dem[r + 1, c] = level
+            level -= 1
+    return dem
+
+
+def test_tiled_accumulation_matches_the_whole_grid(raster):
+    from osgeo import gdal
+
+    # the channel crosses the 4 cell tiles back and forth on every channel row
+    dem = serpentine(15, 22)
+    dem_path = raster("dem.tif", dem.astype(np.float32), -9999)
+    fd = TerrainRouting.flow_direction_d_inf(dem_path, dem_path[:-4] + "_fd.tif")
+    whole = TerrainRouting.flow_accumulation(fd, dem_path, dem_path[:-4] + "_whole.tif")
+    tiled = TerrainRouting.flow_accumulation(fd, dem_path, dem_path[:-4] + "_tiled.tif", tile_size=4)
+    whole = gdal.Open(whole).GetRasterBand(1).ReadAsArray()
+    tiled = gdal.Open(tiled).GetRasterBand(1).ReadAsArray()
+
+    assert np.allclose(tiled, whole)
+    # the channel ends in the bottom left corner, every cell of the grid passes through it
+    assert whole[14, 0] == pytest.approx(dem.size, rel=1e-5)
+
+
+def nestedRims(size):
+    """DEM of nested square rims around a central pit, each with one gap on the side opposite the last, so
+    the way out of the pit turns back on itself at every rim"""
+    dem = np.full((size, size), 10.0)
+    rims = 0
+    for offset in range(1, size // 2, 2):
+        a, b = offset, size - 1 - offset
+        if a >= b:
+            break
+        dem[a, a:b + 1] = dem[b, a:b + 1] = dem[a:b + 1, a] = dem[a:b + 1, b] = 100.0
+        dem[a if rims % 2 == 0 else b, (a + b) // 2] = 10.0
+        rims += 1
+    dem[size // 2, size // 2] = 0.0
+    return dem, rims
+
+
+def test_fill_of_nested_rims_needs_a_round_per_rim(monkeypatch):
+    dem, rims = nestedRims(41)
+    sweeps = []
+    sweep = TerrainRouting._sweep
+
+    def counted(*args, **kwargs):
+        sweeps.append(1)
+        return sweep(*args, **kwargs)
+
+    monkeypatch.setattr(TerrainRouting, "_sweep", counted)
+    valid = np.ones(dem.shape, bool)
+    filled = TerrainRouting.fillDepressions(dem, valid)
+
+    # four sweeps a round, one round per rim and one that finds nothing left to change
+    assert len(sweeps) <= 4 * (rims + 2)
+    assert (filled[dem == 100.0] == 100.0).all()
+    floor = dem < 100.0
+    assert (filled[floor] >= 10.0).all() and (filled[floor] < 10.01).all()
+    assert drains(filled, valid)
+
+
+def plane(angle, cell_width, cell_height):
+    """3x3 block of a plane falling along angle (radians counter-clockwise from east), padded by one cell"""
+    rows, cols = np.mgrid[0:5, 0:5]
+    x = cols * cell_width
+    y = -rows * cell_height
+    return -(np.cos(angle) * x + np.sin(angle) * y)
+
+
+@pytest.mark.parametrize("cell_height", [10.0, 20.0])
+@pytest.mark.parametrize("angle", [0.0, np.pi / 2, np.pi, 3 * np.pi / 2,
+                                   np.pi / 4, 3 * np.pi / 4, 5 * np.pi / 4, 7 * np.pi / 4,
+                                   0.3, 2.0, 3.5, 5.9])
+def test_dinf_angle_of_planes(angle, cell_height):
+    # cardinal, diagonal and in between aspects, with square and rectangular cells
+    z = plane(angle, 10.0, cell_height)
+    angles = TerrainRouting.dinfBlock(z, 10.0, cell_height)
+    assert angles.shape == (3, 3)
+    assert np.allclose(np.cos(angles), np.cos(angle), atol=1e-9)
+    assert np.allclose(np.sin(angles), np.sin(angle), atol=1e-9)
+
+
+def test_dinf_flat_and_pit_have_no_direction():
+    flat = np.zeros((3, 3))
+    assert TerrainRouting.dinfBlock(flat, 10.0, 10.0)[0, 0] == TerrainRouting.FD_NODATA
+    pit = np.ones((3, 3))
+    pit[1, 1] = 0.0
+    assert TerrainRouting.dinfBlock(pit, 10.0, 10.0)[0, 0] == TerrainRouting.FD_NODATA
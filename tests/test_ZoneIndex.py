@@ -0,0 +1,111 @@
+# # # Tests of the sparse zone index # # #
+
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+from shapely.geometry import Point, box
+import ZoneIndex
+
+GT = (0.0, 10.0, 0.0, 0.0, 0.0, -10.0)
+
+
+def zoneIndex():
+    """Three zones on a 2 x 3 grid: cells 0 and 1, cells 5 and 1 with half of cell 5 covered, and no cells"""
+    return ZoneIndex.ZoneIndex([10, 20, 30], [0, 2, 4, 4], [0, 1, 5, 1], [1, 1, 0.5, 1], GT, (2, 3))
+
+
+def test_zone_of_follows_indptr():
+    assert zoneIndex().zoneOf().tolist() == [0, 0, 1, 1]
+
+
+def test_stats_sums_weighted_cells_and_skips_nodata(raster):
+    path = raster("values.tif", np.array([[1, 2, 3], [4, -9, 6]], np.float32), -9)
+    sums, counts = zoneIndex().stats(path)
+    assert sums.tolist() == [3.0, 5.0, 0.0]
+    assert counts.tolist() == [2.0, 1.5, 0.0]
+
+
+def test_stats_rejects_another_grid(raster):
+    path = raster("values.tif", np.zeros((3, 3), np.float32))
+    with pytest.raises(Exception):
+        zoneIndex().stats(path)
+
+
+def test_window_entries():
+    entries, rows, cols = zoneIndex().window(1, 0, 2, 2)
+    found = sorted(zip(entries.tolist(), rows.tolist(), cols.tolist()))
+    assert found == [(1, 0, 0), (2, 1, 1), (3, 0, 0)]
+
+
+def test_save_and_load(tmp_path, raster):
+    index = ZoneIndex.ZoneIndex([10, 20, 30], [0, 2, 4, 4], [0, 1, 5, 1], [1, 1, 0.5, 1], GT, (2, 3),
+                                'LOCAL_CS["grid"]', [200.0, 150.0, 0.0])
+    index.save(str(tmp_path / "index.npz"))
+    loaded = ZoneIndex.ZoneIndex.load(str(tmp_path / "index.npz"))
+    assert loaded.ids.tolist() == [10, 20, 30]
+    assert loaded.indptr.tolist() == index.indptr.tolist()
+    assert loaded.cells.tolist() == index.cells.tolist()
+    assert loaded.weights.tolist() == index.weights.tolist()
+    assert loaded.geotransform == GT
+    assert loaded.shape == (2, 3)
+    assert loaded.projection == 'LOCAL_CS["grid"]'
+    assert loaded.areas.tolist() == [200.0, 150.0, 0.0]
+    assert loaded.zoneOf().tolist() == index.zoneOf().tolist()
+    path = raster("values.tif", np.array([[1, 2, 3], [4, -9, 6]], np.float32), -9)
+    for expected, found in zip(zoneIndex().stats(path), loaded.stats(path)):
+        assert found.tolist() == expected.tolist()
+
+
+def assertSeparateGroups(zones, groups):
+    placed = sorted(i for group in groups for i in group.tolist())
+    assert placed == list(range(len(zones)))
+    for group in groups:
+        for a in group.tolist():
+            for b in group.tolist():
+                if a < b:
+                    assert zones[a].intersection(zones[b]).area == 0
+
+
+def test_overlap_layers_split_overlapping_zones():
+    zones = [box(0, 0, 10, 10), box(5, 5, 15, 15), box(10, 0, 20, 5), box(8, 8, 12, 12), box(30, 30, 31, 31)]
+    groups = ZoneIndex.overlapLayers(zones)
+    assertSeparateGroups(zones, groups)
+    # zones that only touch (0 and 2) share a group, three zones over (9, 9) need three groups
+    assert any(0 in group and 2 in group for group in groups)
+    assert len(groups) == 3
+
+
+def test_overlap_layers_of_random_buffers():
+    rng = np.random.RandomState(0)
+    zones = [Point(x, y).buffer(r) for x, y, r in zip(rng.uniform(0, 500, 80), rng.uniform(0, 500, 80),
+                                                      rng.uniform(5, 40, 80))]
+    assertSeparateGroups(zones, ZoneIndex.overlapLayers(zones))
+
+
+def test_overlap_layers_without_zones():
+    assert ZoneIndex.overlapLayers([]) == []
+
+
+def test_summarize_several_rasters_and_statistics(raster):
+    a = raster("a.tif", np.array([[1, 2, 3], [4, -9, 6]], np.float32), -9)
+    b = raster("b.tif", np.full((2, 3), 2, np.float32))
+    table = zoneIndex().summarize([a, b], ("sum", "mean", "count", "min", "max", "p50"), ["a", "b"])
+
+    assert table["ID"].tolist() == [10, 20, 30]
+    assert table["A_SUM"].tolist() == [3.0, 5.0, 0.0]
+    assert table["A_COUNT"].tolist() == [2.0, 1.5, 0.0]
+    assert np.allclose(table["A_MEAN"][:2], [1.5, 5 / 1.5])
+    assert table["A_MIN"][:2].tolist() == [1.0, 2.0]
+    assert table["A_MAX"][:2].tolist() == [2.0, 6.0]
+    assert table["A_P50"][:2].tolist() == [1.5, 4.0]
+    assert table["B_MEAN"][:2].tolist() == [2.0, 2.0]
+    # a zone without cells gets no statistics but its sum and count
+    for field in ("A_MEAN", "A_MIN", "A_MAX", "A_P50", "B_MEAN"):
+        assert np.isnan(table[field][2])
+
+
+def test_summarize_unknown_statistic(raster):
+    path = raster("a.tif", np.ones((2, 3), np.float32))
+    with pytest.raises(Exception):
+        zoneIndex().summarize([path], ("median",))